@@ -3,6 +3,7 @@ from __future__ import print_function
 import json
 import sys
 import errno
+import hashlib
 import optparse
 import os
 import pipes
@@ -11,6 +12,7 @@ import re
 import shlex
 import subprocess
 import shutil
+import threading
 import io
 
 from distutils.spawn import find_executable as which
@@ -658,6 +660,13 @@ parser.add_option('--lazy-generator',
     dest='lazy_generator',
     help='generate files only if they differ from the existing ones')
 
+parser.add_option('--no-probe-cache',
+    action='store_true',
+    dest='no_probe_cache',
+    default=False,
+    help='do not reuse compiler and pkg-config probe results from ' +
+         'previous runs')
+
 parser.add_option('--v8-non-optimized-debug',
     action='store_true',
     dest='v8_non_optimized_debug',
@@ -741,13 +750,143 @@ def B(value):
 def to_utf8(s):
   return s if isinstance(s, str) else s.decode("utf-8")
 
-def pkg_config(pkg):
-  """Run pkg-config on the specified package
-  Returns ("-l flags", "-I flags", "-L flags", "version")
-  otherwise (None, None, None, None)"""
-  pkg_config = os.environ.get('PKG_CONFIG', 'pkg-config')
+PROBE_CACHE_FILE = os.path.join('out', '.configure_probe_cache.json')
+
+# Environment variables that change what the compiler, the assembler or
+# pkg-config report.
+PROBE_ENVIRONMENT = ('PATH', 'LANG', 'LC_ALL', 'LC_MESSAGES', 'CPATH',
+                     'C_INCLUDE_PATH', 'CPLUS_INCLUDE_PATH', 'COMPILER_PATH',
+                     'GCC_EXEC_PREFIX', 'SDKROOT', 'DEVELOPER_DIR',
+                     'MACOSX_DEPLOYMENT_TARGET', 'PKG_CONFIG_PATH',
+                     'PKG_CONFIG_LIBDIR', 'PKG_CONFIG_SYSROOT_DIR')
+
+class ProbeCache(object):
+  """Memoizes the output of the commands used to probe the toolchain.
+
+  A result is keyed by the command line, its standard input, the relevant
+  environment and the path, size and mtime of the executables and input
+  directories it depends on, so it is reused only while the toolchain is
+  unchanged. Results are kept in PROBE_CACHE_FILE between runs."""
+
+  VERSION = 1
+
+  def __init__(self, path):
+    self.path = path
+    self.stored = {}
+    self.results = {}
+    self.errors = {}
+    self.done = {}
+    self.lock = threading.Lock()
+    if not path:
+      return
+    try:
+      with open(path) as f:
+        data = json.load(f)
+      if data.get('version') == self.VERSION:
+        self.stored = data['results']
+    except (IOError, OSError, ValueError, KeyError, AttributeError):
+      pass
+
+  @staticmethod
+  def identity(path):
+    try:
+      st = os.stat(path)
+    except OSError:
+      return None
+    return [os.path.realpath(path), st.st_size, st.st_mtime]
+
+  def key(self, args, stdin, env, inputs):
+    files = []
+    for arg in args:
+      if arg.startswith('-'):
+        continue
+      path = arg if os.sep in arg else which(arg)
+      if path and os.path.isfile(path):
+        files.append(self.identity(path))
+    environ = [(name, env.get(name)) for name in PROBE_ENVIRONMENT]
+    key = [args, stdin.decode('latin-1'), environ, files,
+           [self.identity(path) for path in inputs]]
+    return hashlib.sha1(json.dumps(key).encode('utf-8')).hexdigest()
+
+  def run(self, args, stdin=b'', env=None, inputs=()):
+    """Returns (returncode, stdout, stderr) of args, running it only when no
+    result for the same toolchain is known. Raises OSError like Popen when the
+    command cannot be started."""
+    env = env or os.environ
+    key = self.key(args, stdin, env, inputs)
+    owner = False
+    with self.lock:
+      done = self.done.get(key)
+      if done is None:
+        done = self.done[key] = threading.Event()
+        if key in self.stored:
+          self.results[key] = self.stored[key]
+          done.set()
+        else:
+          owner = True
+
+    if owner:
+      try:
+        proc = subprocess.Popen(args, stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, env=env)
+        out, err = proc.communicate(stdin)
+        self.results[key] = [proc.returncode, out.decode('latin-1'),
+                             err.decode('latin-1')]
+      except OSError as e:
+        self.errors[key] = e
+      finally:
+        done.set()
+
+    done.wait()
+    if key in self.errors:
+      raise self.errors[key]
+    returncode, out, err = self.results[key]
+    return (returncode, out.encode('latin-1'), err.encode('latin-1'))
+
+  def prefetch(self, probes):
+    """Runs the (function, args) probes concurrently in the background so the
+    sequential checks later on find their results ready."""
+    def run_probe(function, args):
+      try:
+        function(*args)
+      except Exception:
+        pass  # Reported when the check itself runs the probe.
+    for function, args in probes:
+      thread = threading.Thread(target=run_probe, args=(function, args))
+      thread.daemon = True
+      thread.start()
+
+  def save(self):
+    if not self.path:
+      return
+    with self.lock:
+      if self.stored == self.results:
+        return
+      data = {'version': self.VERSION, 'results': self.results}
+    try:
+      if not os.path.isdir(os.path.dirname(self.path)):
+        os.makedirs(os.path.dirname(self.path))
+      tmp = self.path + '.tmp'
+      with open(tmp, 'w') as f:
+        json.dump(data, f, sort_keys=True)
+      os.rename(tmp, self.path)
+    except (IOError, OSError) as e:
+      print_verbose('could not write %s: %s' % (self.path, e))
+
+probe_cache = ProbeCache(None if options.no_probe_cache else PROBE_CACHE_FILE)
+
+def pkg_config_probe(pkg):
+  """Returns the (returncode, stdout, stderr) of the pkg-config queries for
+  the specified package"""
+  pkg_config = shlex.split(os.environ.get('PKG_CONFIG', 'pkg-config'))
+  pc_path = probe_cache.run(pkg_config + ['--variable', 'pc_path',
+                                          'pkg-config'])[1]
+  inputs = [path for path in to_utf8(pc_path).strip().split(os.pathsep) +
+            os.environ.get('PKG_CONFIG_PATH', '').split(os.pathsep) +
+            os.environ.get('PKG_CONFIG_LIBDIR', '').split(os.pathsep) if path]
   args = []  # Print pkg-config warnings on first round.
-  retval = ()
+  results = []
   for flag in ['--libs-only-l', '--cflags-only-I',
                '--libs-only-L', '--modversion']:
     args += [flag]
@@ -755,29 +894,43 @@ def pkg_config(pkg):
       args += pkg
     else:
       args += [pkg]
-    try:
-      proc = subprocess.Popen(shlex.split(pkg_config) + args,
-                              stdout=subprocess.PIPE)
-      val = to_utf8(proc.communicate()[0]).strip()
-    except OSError as e:
-      if e.errno != errno.ENOENT: raise e  # Unexpected error.
-      return (None, None, None, None)  # No pkg-config/pkgconf installed.
-    retval += (val,)
+    results.append(probe_cache.run(pkg_config + args, inputs=inputs))
     args = ['--silence-errors']
+  return results
+
+def pkg_config(pkg):
+  """Run pkg-config on the specified package
+  Returns ("-l flags", "-I flags", "-L flags", "version")
+  otherwise (None, None, None, None)"""
+  try:
+    results = pkg_config_probe(pkg)
+  except OSError as e:
+    if e.errno != errno.ENOENT: raise e  # Unexpected error.
+    return (None, None, None, None)  # No pkg-config/pkgconf installed.
+  retval = ()
+  for _, out, err in results:
+    if err:
+      sys.stderr.write(to_utf8(err))
+    retval += (to_utf8(out).strip(),)
   return retval
 
 
+def check_compiler_probe(cc, lang):
+  return probe_cache.run(shlex.split(cc) + ['-E', '-P', '-x', lang, '-'],
+                         stdin=b'__clang__ __GNUC__ __GNUC_MINOR__ '
+                               b'__GNUC_PATCHLEVEL__ __clang_major__ '
+                               b'__clang_minor__ __clang_patchlevel__')
+
 def try_check_compiler(cc, lang):
   try:
-    proc = subprocess.Popen(shlex.split(cc) + ['-E', '-P', '-x', lang, '-'],
-                            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    _, out, err = check_compiler_probe(cc, lang)
   except OSError:
     return (False, False, '', '')
 
-  proc.stdin.write(b'__clang__ __GNUC__ __GNUC_MINOR__ __GNUC_PATCHLEVEL__ '
-                   b'__clang_major__ __clang_minor__ __clang_patchlevel__')
+  if err:
+    sys.stderr.write(to_utf8(err))
 
-  values = (to_utf8(proc.communicate()[0]).split() + ['0'] * 7)[0:7]
+  values = (to_utf8(out).split() + ['0'] * 7)[0:7]
   is_clang = values[0] == '1'
   gcc_version = tuple(map(int, values[1:1+3]))
   clang_version = tuple(map(int, values[4:4+3])) if is_clang else None
@@ -791,10 +944,12 @@ def try_check_compiler(cc, lang):
 # Commands and regular expressions to obtain its version number are taken from
 # https://github.com/openssl/openssl/blob/OpenSSL_1_0_2-stable/crypto/sha/asm/sha512-x86_64.pl#L112-L129
 #
+def version_probe(cc):
+  return probe_cache.run(shlex.split(cc) + ['-v'])
+
 def get_version_helper(cc, regexp):
   try:
-    proc = subprocess.Popen(shlex.split(cc) + ['-v'], stdin=subprocess.PIPE,
-                            stderr=subprocess.PIPE, stdout=subprocess.PIPE)
+    err = version_probe(cc)[2]
   except OSError:
     error('''No acceptable C compiler found!
 
@@ -802,7 +957,7 @@ def get_version_helper(cc, regexp):
        consider adjusting the CC environment variable if you installed
        it in a non-standard prefix.''')
 
-  match = re.search(regexp, to_utf8(proc.communicate()[1]))
+  match = re.search(regexp, to_utf8(err))
 
   if match:
     return match.group(2)
@@ -811,17 +966,14 @@ def get_version_helper(cc, regexp):
 
 def get_nasm_version(asm):
   try:
-    proc = subprocess.Popen(shlex.split(asm) + ['-v'],
-                            stdin=subprocess.PIPE, stderr=subprocess.PIPE,
-                            stdout=subprocess.PIPE)
+    out = version_probe(asm)[1]
   except OSError:
     warn('''No acceptable ASM compiler found!
          Please make sure you have installed NASM from https://www.nasm.us
          and refer BUILDING.md.''')
     return '0.0'
 
-  match = re.match(r"NASM version ([2-9]\.[0-9][0-9]+)",
-                   to_utf8(proc.communicate()[0]))
+  match = re.match(r"NASM version ([2-9]\.[0-9][0-9]+)", to_utf8(out))
 
   if match:
     return match.group(1)
@@ -836,15 +988,17 @@ def get_xcode_version(cc):
   return get_version_helper(
     cc, r"(^Apple (?:clang|LLVM) version) ([0-9]+\.[0-9]+)")
 
+def gas_version_probe(cc):
+  custom_env = os.environ.copy()
+  custom_env["LC_ALL"] = "C"
+  return probe_cache.run(shlex.split(cc) + ['-Wa,-v', '-c', '-o',
+                                            '/dev/null', '-x',
+                                            'assembler',  '/dev/null'],
+                         env=custom_env)
+
 def get_gas_version(cc):
   try:
-    custom_env = os.environ.copy()
-    custom_env["LC_ALL"] = "C"
-    proc = subprocess.Popen(shlex.split(cc) + ['-Wa,-v', '-c', '-o',
-                                               '/dev/null', '-x',
-                                               'assembler',  '/dev/null'],
-                            stdin=subprocess.PIPE, stderr=subprocess.PIPE,
-                            stdout=subprocess.PIPE, env=custom_env)
+    gas_ret = to_utf8(gas_version_probe(cc)[2])
   except OSError:
     error('''No acceptable C compiler found!
 
@@ -852,7 +1006,6 @@ def get_gas_version(cc):
        consider adjusting the CC environment variable if you installed
        it in a non-standard prefix.''')
 
-  gas_ret = to_utf8(proc.communicate()[1])
   match = re.match(r"GNU assembler version ([2-9]\.[0-9]+)", gas_ret)
 
   if match:
@@ -910,14 +1063,15 @@ def check_compiler(o):
     o['variables']['gas_version'] = get_gas_version(CC)
 
 
+def cc_macros_probe(cc=None):
+  return probe_cache.run(shlex.split(cc or CC) + ['-dM', '-E', '-'],
+                         stdin=b'\n')
+
 def cc_macros(cc=None):
   """Checks predefined macros using the C compiler command."""
 
   try:
-    p = subprocess.Popen(shlex.split(cc or CC) + ['-dM', '-E', '-'],
-                         stdin=subprocess.PIPE,
-                         stdout=subprocess.PIPE,
-                         stderr=subprocess.PIPE)
+    out = cc_macros_probe(cc)[1]
   except OSError:
     error('''No acceptable C compiler found!
 
@@ -925,8 +1079,7 @@ def cc_macros(cc=None):
        consider adjusting the CC environment variable if you installed
        it in a non-standard prefix.''')
 
-  p.stdin.write(b'\n')
-  out = to_utf8(p.communicate()[0]).split('\n')
+  out = to_utf8(out).split('\n')
 
   k = {}
   for line in out:
@@ -960,16 +1113,21 @@ def is_arm_hard_float_abi():
   return '__ARM_PCS_VFP' in cc_macros()
 
 
-def host_arch_cc():
-  """Host architecture check using the CC command."""
+def host_cc():
+  """The C compiler command used to detect the host architecture."""
 
   import platform
   if sys.platform.startswith('aix') or platform.processor() == "sparc":
     # we only support gcc at this point and the default on AIX
     # would be xlc so hard code gcc
-    k = cc_macros('gcc')
-  else:
-    k = cc_macros(os.environ.get('CC_host'))
+    return 'gcc'
+  return os.environ.get('CC_host')
+
+
+def host_arch_cc():
+  """Host architecture check using the CC command."""
+
+  k = cc_macros(host_cc())
 
   matchup = {
     '__aarch64__' : 'arm64',
@@ -1743,6 +1901,32 @@ def make_bin_override():
 
   return bin_override
 
+def prefetch_probes():
+  """Starts the toolchain probes the checks below will need, so that the ones
+  missing from the probe cache run concurrently."""
+  probes = []
+  if sys.platform == 'win32':
+    if not options.openssl_no_asm and options.dest_cpu in ('x86', 'x64'):
+      probes.append((version_probe, ('nasm',)))
+  else:
+    probes.append((check_compiler_probe, (CXX, 'c++')))
+    probes.append((check_compiler_probe, (CC, 'c')))
+    probes.append((version_probe, (CC,)))
+    if not (options.without_ssl or options.openssl_no_asm or
+            options.shared_openssl or sys.platform == 'darwin'):
+      probes.append((gas_version_probe, (CC,)))
+  if os.name != 'nt':
+    probes.append((cc_macros_probe, (host_cc(),)))
+  for lib, pkgname in (('zlib', None), ('http_parser', None),
+                       ('libuv', None),
+                       ('brotli', ['libbrotlidec', 'libbrotlienc']),
+                       ('cares', 'libcares'), ('nghttp2', 'libnghttp2')):
+    if getattr(options, 'shared_' + lib):
+      probes.append((pkg_config_probe, (pkgname or lib,)))
+  if options.with_intl == 'system-icu':
+    probes.append((pkg_config_probe, ('icu-i18n',)))
+  probe_cache.prefetch(probes)
+
 output = {
   'variables': {},
   'include_dirs': [],
@@ -1751,6 +1935,8 @@ output = {
   'cflags': [],
 }
 
+prefetch_probes()
+
 # Print a warning when the compiler is too old.
 check_compiler(output)
 
@@ -1848,6 +2034,8 @@ if bin_override:
 
 write('config.mk', do_not_edit + config_str)
 
+probe_cache.save()
+
 
 
 gyp_args = ['--no-parallel', '-Dconfiguring_node=1']
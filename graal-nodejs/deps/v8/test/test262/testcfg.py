@@ -28,8 +28,11 @@
 # for py2/py3 compatibility
 from __future__ import print_function
 
+import hashlib
 import imp
 import itertools
+import json
+import multiprocessing
 import os
 import re
 import sys
@@ -78,6 +81,169 @@ TEST_262_LOCAL_TESTS_PATH = ["local-tests", "test"]
 sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
                              *TEST_262_TOOLS_PATH))
 
+# Parsed test records are cached in the build output directory.
+TEST_RECORD_CACHE_FILE = "test262_records.json"
+TEST_RECORD_CACHE_VERSION = 1
+# Parts of the records that aren't used by the test runner and that would make
+# the cache as large as the sources.
+UNCACHED_RECORD_KEYS = ["header", "test", "commentary"]
+# Minimum number of sources to parse for parsing them in worker processes.
+PARALLEL_PARSE_MIN = 512
+
+
+def load_parse_test_record(root):
+  f = None
+  try:
+    (f, pathname, description) = imp.find_module("parseTestRecord", [root])
+    module = imp.load_module("parseTestRecord", f, pathname, description)
+    return module.parseTestRecord
+  except:
+    print ('Cannot load parseTestRecord; '
+           'you may need to gclient sync for test262')
+    raise
+  finally:
+    if f:
+      f.close()
+
+
+# Parser of the worker processes, loaded on first use.
+_worker_parse_test_record = None
+
+def _parse_test_records(args):
+  """Parses a chunk of (source path, test path) pairs in a worker process.
+  Returns None for sources that fail to parse, these are parsed again when
+  the test is created to report the error.
+  """
+  global _worker_parse_test_record
+  tools_root, sources = args
+  if _worker_parse_test_record is None:
+    _worker_parse_test_record = load_parse_test_record(tools_root)
+  records = []
+  for source_path, path in sources:
+    try:
+      with open(source_path) as f:
+        records.append(_worker_parse_test_record(f.read(), path))
+    except Exception:
+      records.append(None)
+  return records
+
+
+class TestRecordCache(object):
+  """Parsed test records of the suite's sources, kept on disk between runs.
+
+  A record is reused while the size and mtime of its source and the
+  parseTestRecord implementation are unchanged. Stale records are parsed in
+  bulk by prepare, across worker processes when there are many of them.
+  """
+
+  def __init__(self, path, tools_root, parse_test_record):
+    self.path = path
+    self.tools_root = tools_root
+    self.parse_test_record = parse_test_record
+    with open(os.path.join(tools_root, "parseTestRecord.py"), "rb") as f:
+      self.parser_digest = hashlib.sha1(f.read()).hexdigest()
+    self.records = {}
+    self.prepared = False
+    self._load()
+
+  def _load(self):
+    try:
+      with open(self.path) as f:
+        cache = json.load(f)
+    except (IOError, OSError, ValueError):
+      return
+    if (cache.get("version") == TEST_RECORD_CACHE_VERSION and
+        cache.get("parser") == self.parser_digest):
+      self.records = cache["records"]
+
+  def _save(self):
+    cache = {
+      "version": TEST_RECORD_CACHE_VERSION,
+      "parser": self.parser_digest,
+      "records": self.records,
+    }
+    tmp = self.path + ".tmp"
+    try:
+      with open(tmp, "w") as f:
+        # YAML may produce values like dates in keys the runner doesn't use.
+        json.dump(cache, f, default=str)
+      os.rename(tmp, self.path)
+    except (IOError, OSError):
+      # No build output directory, parse again next time.
+      pass
+
+  @staticmethod
+  def _stamp(source_path):
+    st = os.stat(source_path)
+    return [st.st_size, st.st_mtime]
+
+  def _store(self, source_path, stamp, record):
+    record = dict((k, v) for (k, v) in record.items()
+                  if k not in UNCACHED_RECORD_KEYS)
+    self.records[source_path] = [stamp, record]
+    return record
+
+  def prepare(self, sources):
+    """Brings the records of the (source path, test path) pairs up to date and
+    writes the cache if any of them changed."""
+    self.prepared = True
+    stale = []
+    stamps = []
+    records = {}
+    for source_path, path in sources:
+      try:
+        stamp = self._stamp(source_path)
+      except OSError:
+        continue
+      entry = self.records.get(source_path)
+      if entry is None or entry[0] != stamp:
+        stale.append((source_path, path))
+        stamps.append(stamp)
+      else:
+        records[source_path] = entry
+    # Drop the records of removed tests.
+    removed = len(self.records) != len(records) + len(stale)
+    self.records = records
+    if not stale:
+      if removed:
+        self._save()
+      return
+
+    if len(stale) >= PARALLEL_PARSE_MIN and not utils.IsWindows():
+      jobs = multiprocessing.cpu_count()
+      chunk_size = max(1, len(stale) // (jobs * 4))
+      chunks = [(self.tools_root, stale[i:i + chunk_size])
+                for i in range(0, len(stale), chunk_size)]
+      pool = multiprocessing.Pool(jobs)
+      try:
+        records = list(itertools.chain.from_iterable(
+            pool.map(_parse_test_records, chunks)))
+      finally:
+        pool.close()
+        pool.join()
+    else:
+      records = []
+      for source_path, path in stale:
+        try:
+          with open(source_path) as f:
+            records.append(self.parse_test_record(f.read(), path))
+        except Exception:
+          records.append(None)
+
+    for (source_path, _), stamp, record in zip(stale, stamps, records):
+      if record is not None:
+        self._store(source_path, stamp, record)
+    self._save()
+
+  def get(self, source_path, path):
+    stamp = self._stamp(source_path)
+    entry = self.records.get(source_path)
+    if entry is not None and entry[0] == stamp:
+      return entry[1]
+    with open(source_path) as f:
+      record = self.parse_test_record(f.read(), path)
+    return self._store(source_path, stamp, record)
+
 
 class VariantsGenerator(testsuite.VariantsGenerator):
   def gen(self, test):
@@ -122,6 +288,15 @@ class TestLoader(testsuite.JSTestLoader):
     features = test.test_record.get("features", [])
     return SKIPPED_FEATURES.intersection(features)
 
+  def list_tests(self):
+    if not self.suite.test_records.prepared:
+      self.suite.test_records.prepare(
+          (self.suite.get_source_path(path), path)
+          for path in (self._filename_to_testname(filename)
+                       for filename in self._list_test_filenames()
+                       if not self._should_filter_by_name(filename)))
+    return super(TestLoader, self).list_tests()
+
 
 class TestSuite(testsuite.TestSuite):
   def __init__(self, *args, **kwargs):
@@ -134,22 +309,18 @@ class TestSuite(testsuite.TestSuite):
                     for f in TEST_262_HARNESS_FILES]
     self.harness += [os.path.join(self.root, "harness-adapt.js")]
     self.local_test_root = os.path.join(self.root, *TEST_262_LOCAL_TESTS_PATH)
-    self.parse_test_record = self._load_parse_test_record()
-
-  def _load_parse_test_record(self):
-    root = os.path.join(self.root, *TEST_262_TOOLS_PATH)
-    f = None
-    try:
-      (f, pathname, description) = imp.find_module("parseTestRecord", [root])
-      module = imp.load_module("parseTestRecord", f, pathname, description)
-      return module.parseTestRecord
-    except:
-      print ('Cannot load parseTestRecord; '
-             'you may need to gclient sync for test262')
-      raise
-    finally:
-      if f:
-        f.close()
+    tools_root = os.path.join(self.root, *TEST_262_TOOLS_PATH)
+    self.parse_test_record = load_parse_test_record(tools_root)
+    self.test_records = TestRecordCache(
+        os.path.join(self.test_config.shell_dir, TEST_RECORD_CACHE_FILE),
+        tools_root, self.parse_test_record)
+
+  def get_source_path(self, path):
+    filename = path + ".js"
+    source_path = os.path.join(self.local_test_root, filename)
+    if os.path.exists(source_path):
+      return source_path
+    return os.path.join(self.test_root, filename)
 
   def _test_loader_class(self):
     return TestLoader
@@ -165,8 +336,8 @@ class TestCase(testcase.D8TestCase):
   def __init__(self, *args, **kwargs):
     super(TestCase, self).__init__(*args, **kwargs)
 
-    source = self.get_source()
-    self.test_record = self.suite.parse_test_record(source, self.path)
+    self.test_record = self.suite.test_records.get(
+        self._get_source_path(), self.path)
     self._expected_exception = (
         self.test_record
           .get('negative', {})
@@ -232,11 +403,7 @@ class TestCase(testcase.D8TestCase):
       return self.suite.harnesspath
 
   def _get_source_path(self):
-    filename = self.path + self._get_suffix()
-    path = os.path.join(self.suite.local_test_root, filename)
-    if os.path.exists(path):
-      return path
-    return os.path.join(self.suite.test_root, filename)
+    return self.suite.get_source_path(self.path)
 
   @property
   def output_proc(self):
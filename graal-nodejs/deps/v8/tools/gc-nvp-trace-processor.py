@@ -33,16 +33,21 @@
 # run with flags --trace-gc --trace-gc-nvp. Relies on gnuplot for actual
 # plotting.
 #
-# Usage: gc-nvp-trace-processor.py <GC-trace-filename>
+# Usage: gc-nvp-trace-processor.py [options] <GC-trace-filename>
+#
+# The trace is read in a single pass into typed columns. Passing "-" as the
+# file name reads the trace from stdin, e.g. from a live process:
+#
+#   d8 --trace-gc --trace-gc-nvp app.js | \
+#       gc-nvp-trace-processor.py --refresh 100 -
 #
 
 
 # for py2/py3 compatibility
 from __future__ import with_statement
 from __future__ import print_function
-from functools import reduce
 
-import sys, types, subprocess, math
+import array, math, optparse, sys, subprocess
 import gc_nvp_common
 
 
@@ -59,7 +64,7 @@ def flatten(l):
 
 def gnuplot(script):
   gnuplot = subprocess.Popen(["gnuplot"], stdin=subprocess.PIPE)
-  gnuplot.stdin.write(script)
+  gnuplot.stdin.write(script.encode('utf-8'))
   gnuplot.stdin.close()
   gnuplot.wait()
 
@@ -144,24 +149,158 @@ def is_y2_used(plot):
           return True
   return False
 
-def get_field(trace_line, field):
-  t = type(field)
-  if t is bytes:
-    return trace_line[field]
-  elif t is types.FunctionType:
-    return field(trace_line)
+
+class PhaseStats(object):
+  """Running aggregates of one field over the GC events of a phase."""
+
+  def __init__(self, name, field, predicate):
+    self.name = name
+    self.field = field
+    self.predicate = predicate
+    self.values = array.array('d')
+    self.total = long(0)
+    self.max = 0
+
+  def add(self, row):
+    if not self.predicate(row):
+      return
+    value = row[self.field]
+    self.values.append(value)
+    self.total += long(value)
+    self.max = max(self.max, value)
+
+  def percentile(self, sorted_values, p):
+    if not sorted_values:
+      return 0
+    rank = int(math.ceil(p / 100.0 * len(sorted_values)))
+    return sorted_values[max(rank, 1) - 1]
+
+  def write_html(self, out):
+    n = len(self.values)
+    avg = self.total // n if n > 0 else 0
+    if n > 1:
+      dev = math.sqrt(sum((v - avg) ** 2 for v in self.values) / (n - 1))
+    else:
+      dev = 0
+    sorted_values = sorted(self.values)
+    out.write('<tr><td>%s</td><td>%d</td><td>%d</td>'
+              '<td>%d</td><td>%d [dev %f]</td>'
+              '<td>%.1f</td><td>%.1f</td><td>%.1f</td></tr>' %
+              (self.name, n, self.total, self.max, avg, dev,
+               self.percentile(sorted_values, 50),
+               self.percentile(sorted_values, 90),
+               self.percentile(sorted_values, 99)))
+
+
+class ThroughputStats(object):
+  """Running totals of heap sizes and pauses of the GC events of a kind."""
+
+  def __init__(self, name, predicate):
+    self.name = name
+    self.predicate = predicate
+    self.total_live_after = long(0)
+    self.total_live_before = long(0)
+    self.total_gc = long(0)
+
+  def add(self, row):
+    if not self.predicate(row):
+      return
+    self.total_live_after += long(row['total_size_after'])
+    self.total_live_before += long(row['total_size_before'])
+    self.total_gc += long(row['pause'])
+
+  def write_html(self, out):
+    if self.total_gc == 0:
+      return
+    out.write('GC %s Throughput (after): %s / %s ms = %s/ms<br/>' %
+              (self.name,
+               HumanReadable(self.total_live_after),
+               self.total_gc,
+               HumanReadable(self.total_live_after // self.total_gc)))
+    out.write('GC %s Throughput (before): %s / %s ms = %s/ms<br/>' %
+              (self.name,
+               HumanReadable(self.total_live_before),
+               self.total_gc,
+               HumanReadable(self.total_live_before // self.total_gc)))
+
+
+def HumanReadable(size):
+  suffixes = ['bytes', 'kB', 'MB', 'GB']
+  power = 1
+  for i in range(len(suffixes)):
+    if size < power*1024:
+      return "%.1f" % (float(size) / power) + " " + suffixes[i]
+    power *= 1024
+
+
+class GCTrace(object):
+  """GC events stored column by column, with per-phase aggregates.
+
+  Numeric fields are kept in typed arrays, other fields in lists. Fields
+  missing from an event are filled with 0 or the empty string.
+  """
+
+  def __init__(self):
+    self.columns = {}
+    self.length = 0
+    self.phases = [
+      PhaseStats('Total in GC', 'pause', lambda r: True),
+      PhaseStats('Scavenge', 'pause', lambda r: r['gc'] == 's'),
+      PhaseStats('MarkSweep', 'pause', lambda r: r['gc'] == 'ms'),
+      PhaseStats('Mark', 'mark', lambda r: r['mark'] != 0),
+      PhaseStats('Sweep', 'sweep', lambda r: r['sweep'] != 0),
+      PhaseStats('External', 'external', lambda r: r['external'] != 0),
+    ]
+    self.throughputs = [
+      ThroughputStats('TOTAL', lambda r: True),
+      ThroughputStats('MS', lambda r: r['gc'] == 'ms'),
+      ThroughputStats('OLDSPACE', lambda r: r['gc'] != 's'),
+    ]
+
+  def __len__(self):
+    return self.length
+
+  def append(self, row):
+    for name, value in row.items():
+      column = self.columns.get(name)
+      if column is None:
+        if isinstance(value, str):
+          column = [''] * self.length
+        elif name == 'i':
+          column = array.array('l', [0] * self.length)
+        else:
+          column = array.array('d', [0] * self.length)
+        self.columns[name] = column
+      elif isinstance(value, str) and isinstance(column, array.array):
+        column = [str(v) for v in column]
+        self.columns[name] = column
+      column.append(value)
+    self.length += 1
+    for column in self.columns.values():
+      if len(column) < self.length:
+        column.append('' if isinstance(column, list) else 0)
+    for stats in self.phases:
+      stats.add(row)
+    for stats in self.throughputs:
+      stats.add(row)
+
+  def column(self, field):
+    if callable(field):
+      return field(self.columns)
+    return self.columns[field]
+
 
 def generate_datafile(datafile_name, trace, fields):
+  columns = [trace.column(field) for field in fields]
   with open(datafile_name, 'w') as datafile:
-    for line in trace:
-      data_line = [str(get_field(line, field)) for field in fields]
-      datafile.write('\t'.join(data_line))
-      datafile.write('\n')
+    datafile.writelines(
+        '\t'.join(map(str, values)) + '\n' for values in zip(*columns))
 
 def generate_script_and_datafile(plot, trace, datafile, output):
   (fields, field_to_index) = collect_fields(plot)
   generate_datafile(datafile, trace, fields)
   script = [
+      'reset',
       'set terminal png',
       'set output "%s"' % output,
       'set autoscale',
@@ -183,33 +322,41 @@ def generate_script_and_datafile(plot, trace, datafile, output):
 
 def plot_all(plots, trace, prefix):
   charts = []
+  scripts = []
 
   for plot in plots:
     outfilename = "%s_%d.png" % (prefix, len(charts))
+    datafile = '~datafile_%d' % len(charts)
     charts.append(outfilename)
-    script = generate_script_and_datafile(plot, trace, '~datafile', outfilename)
-    print('Plotting %s...' % outfilename)
-    gnuplot(script)
+    scripts.append(
+        generate_script_and_datafile(plot, trace, datafile, outfilename))
+
+  # A single gnuplot process renders all charts.
+  print('Plotting %s...' % ', '.join(charts))
+  gnuplot('\n'.join(scripts) + '\n')
 
   return charts
 
-def reclaimed_bytes(row):
-  return row['total_size_before'] - row['total_size_after']
+# Derived fields take the columns of the trace and return a column.
 
-def other_scope(r):
-  if r['gc'] == 's':
-    # there is no 'other' scope for scavenging collections.
-    return 0
-  return r['pause'] - r['mark'] - r['sweep'] - r['external']
+def reclaimed_bytes(c):
+  return [before - after for (before, after) in
+          zip(c['total_size_before'], c['total_size_after'])]
 
-def scavenge_scope(r):
-  if r['gc'] == 's':
-    return r['pause'] - r['external']
-  return 0
+def other_scope(c):
+  # there is no 'other' scope for scavenging collections.
+  return [0 if gc == 's' else pause - mark - sweep - external
+          for (gc, pause, mark, sweep, external) in
+          zip(c['gc'], c['pause'], c['mark'], c['sweep'], c['external'])]
 
+def scavenge_scope(c):
+  return [pause - external if gc == 's' else 0
+          for (gc, pause, external) in zip(c['gc'], c['pause'], c['external'])]
 
-def real_mutator(r):
-  return r['mutator'] - r['steps_took']
+
+def real_mutator(c):
+  return [mutator - steps_took for (mutator, steps_took) in
+          zip(c['mutator'], c['steps_took'])]
 
 plots = [
   [
@@ -271,100 +418,62 @@ plots = [
   ],
 ]
 
-def freduce(f, field, trace, init):
-  return reduce(lambda t,r: f(t, r[field]), trace, init)
-
-def calc_total(trace, field):
-  return freduce(lambda t,v: t + long(v), field, trace, long(0))
+def write_report(trace, prefix):
+  charts = plot_all(plots, trace, prefix)
 
-def calc_max(trace, field):
-  return freduce(lambda t,r: max(t, r), field, trace, 0)
-
-def count_nonzero(trace, field):
-  return freduce(lambda t,r: t if r == 0 else t + 1, field, trace, 0)
-
-
-def process_trace(filename):
-  trace = gc_nvp_common.parse_gc_trace(filename)
-
-  marksweeps = filter(lambda r: r['gc'] == 'ms', trace)
-  scavenges = filter(lambda r: r['gc'] == 's', trace)
-  globalgcs = filter(lambda r: r['gc'] != 's', trace)
-
-
-  charts = plot_all(plots, trace, filename)
-
-  def stats(out, prefix, trace, field):
-    n = len(trace)
-    total = calc_total(trace, field)
-    max = calc_max(trace, field)
-    if n > 0:
-      avg = total / n
-    else:
-      avg = 0
-    if n > 1:
-      dev = math.sqrt(freduce(lambda t,r: t + (r - avg) ** 2, field, trace, 0) /
-                      (n - 1))
-    else:
-      dev = 0
-
-    out.write('<tr><td>%s</td><td>%d</td><td>%d</td>'
-              '<td>%d</td><td>%d [dev %f]</td></tr>' %
-              (prefix, n, total, max, avg, dev))
-
-  def HumanReadable(size):
-    suffixes = ['bytes', 'kB', 'MB', 'GB']
-    power = 1
-    for i in range(len(suffixes)):
-      if size < power*1024:
-        return "%.1f" % (float(size) / power) + " " + suffixes[i]
-      power *= 1024
-
-  def throughput(name, trace):
-    total_live_after = calc_total(trace, 'total_size_after')
-    total_live_before = calc_total(trace, 'total_size_before')
-    total_gc = calc_total(trace, 'pause')
-    if total_gc == 0:
-      return
-    out.write('GC %s Throughput (after): %s / %s ms = %s/ms<br/>' %
-              (name,
-               HumanReadable(total_live_after),
-               total_gc,
-               HumanReadable(total_live_after / total_gc)))
-    out.write('GC %s Throughput (before): %s / %s ms = %s/ms<br/>' %
-              (name,
-               HumanReadable(total_live_before),
-               total_gc,
-               HumanReadable(total_live_before / total_gc)))
-
-
-  with open(filename + '.html', 'w') as out:
+  with open(prefix + '.html', 'w') as out:
     out.write('<html><body>')
     out.write('<table>')
     out.write('<tr><td>Phase</td><td>Count</td><td>Time (ms)</td>')
-    out.write('<td>Max</td><td>Avg</td></tr>')
-    stats(out, 'Total in GC', trace, 'pause')
-    stats(out, 'Scavenge', scavenges, 'pause')
-    stats(out, 'MarkSweep', marksweeps, 'pause')
-    stats(out, 'Mark', filter(lambda r: r['mark'] != 0, trace), 'mark')
-    stats(out, 'Sweep', filter(lambda r: r['sweep'] != 0, trace), 'sweep')
-    stats(out,
-          'External',
-          filter(lambda r: r['external'] != 0, trace),
-          'external')
+    out.write('<td>Max</td><td>Avg</td>')
+    out.write('<td>P50</td><td>P90</td><td>P99</td></tr>')
+    for stats in trace.phases:
+      stats.write_html(out)
     out.write('</table>')
-    throughput('TOTAL', trace)
-    throughput('MS', marksweeps)
-    throughput('OLDSPACE', globalgcs)
+    for stats in trace.throughputs:
+      stats.write_html(out)
     out.write('<br/>')
     for chart in charts:
       out.write('<img src="%s">' % chart)
-      out.write('</body></html>')
-
-  print("%s generated." % (filename + '.html'))
+    out.write('</body></html>')
+
+  print("%s generated." % (prefix + '.html'))
+
+
+def process_trace(lines, prefix, refresh=0):
+  trace = GCTrace()
+  for row in gc_nvp_common.iter_gc_trace(lines):
+    trace.append(row)
+    if refresh > 0 and len(trace) % refresh == 0:
+      write_report(trace, prefix)
+  write_report(trace, prefix)
+
+
+def main():
+  parser = optparse.OptionParser(
+      usage="Usage: %prog [options] <GC-trace-filename>\n\n"
+            "Use - as the file name to read the trace from stdin.")
+  parser.add_option("--prefix",
+                    help="prefix of the generated files "
+                         "[default: the trace file name, gc-trace for stdin]")
+  parser.add_option("--refresh", type="int", default=0,
+                    help="regenerate the report every N GC events "
+                         "[default: only at the end]")
+  (options, args) = parser.parse_args()
+  if len(args) != 1:
+    parser.print_usage()
+    return 1
+
+  filename = args[0]
+  if filename == '-':
+    # Read line by line to see events of live processes as they come.
+    process_trace(iter(sys.stdin.readline, ''),
+                  options.prefix or 'gc-trace', options.refresh)
+  else:
+    with open(filename) as f:
+      process_trace(f, options.prefix or filename, options.refresh)
+  return 0
 
-if len(sys.argv) != 2:
-  print("Usage: %s <GC-trace-filename>" % sys.argv[0])
-  sys.exit(1)
 
-process_trace(sys.argv[1])
+if __name__ == '__main__':
+  sys.exit(main())
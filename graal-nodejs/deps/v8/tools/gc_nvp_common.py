@@ -21,12 +21,17 @@ def split_nvp(s):
   return t
 
 
+def iter_gc_trace(lines):
+  """Yields the GC events with a positive pause from an iterable of lines."""
+  i = 0
+  for line in lines:
+    info = split_nvp(line)
+    if info and 'pause' in info and info['pause'] > 0:
+      info['i'] = i
+      i += 1
+      yield info
+
+
 def parse_gc_trace(input):
-  trace = []
   with open(input) as f:
-    for line in f:
-      info = split_nvp(line)
-      if info and 'pause' in info and info['pause'] > 0:
-        info['i'] = len(trace)
-        trace.append(info)
-  return trace
+    return list(iter_gc_trace(f))
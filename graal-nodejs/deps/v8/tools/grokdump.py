@@ -38,16 +38,21 @@ import bisect
 import cgi
 import cmd
 import codecs
+import collections
 import ctypes
 import datetime
 import disasm
+import hashlib
 import inspect
+import json
 import mmap
 import optparse
 import os
 import re
 import StringIO
+import struct
 import sys
+import threading
 import types
 import urllib
 import urlparse
@@ -614,6 +619,28 @@ class MinidumpReader(object):
 
   _HEADER_MAGIC = 0x504d444d
 
+  _U8 = struct.Struct("=B")
+  _U32 = struct.Struct("=I")
+  _U64 = struct.Struct("=Q")
+
+  # Bytes counted by IsProbableASCIIRegion and IsProbableExecutableRegion.
+  _PRINTABLE_BYTES = "".join(chr(b) for b in range(0x20, 0x7f))
+  _CONTROL_BYTES = "".join(chr(b) for b in range(0x01, 0x20))
+  _HIGH_BYTES = "".join(chr(b) for b in range(0x7f, 0x100))
+  _OPCODE_BYTES = "".join(chr(b) for b in (
+      [0x8b,  # mov
+       0x89,  # mov reg-reg
+       0xc3,  # return
+       0x74,  # jeq
+       0x84,  # jeq far
+       0x75,  # jne
+       0x85,  # jne far
+       0xe8,  # call
+       0xe9,  # jmp far
+       0xeb] +  # jmp near
+      list(range(0x50, 0x60))))  # push/pop
+  _REX_PREFIX_BYTES = "".join(chr(b) for b in range(0x40, 0x50))
+
   def __init__(self, options, minidump_name):
     self.minidump_name = minidump_name
     self.minidump_file = open(minidump_name, "r")
@@ -641,6 +668,7 @@ class MinidumpReader(object):
 
     self._ReadArchitecture(directories)
     self._ReadDirectories(directories)
+    self._IndexMemoryRegions()
     self._FindObjdump(options)
 
   def _ReadArchitecture(self, directories):
@@ -704,6 +732,24 @@ class MinidumpReader(object):
         assert ctypes.sizeof(self.memory_list64) == d.location.data_size
         DebugPrint(self.memory_list64)
 
+  def _IndexMemoryRegions(self):
+    # Memory regions as (start, size, location) in dump order, and sorted by
+    # start address for translating addresses with bisect.
+    self.memory_regions = []
+    if self.memory_list64 is not None:
+      offset = 0
+      for r in self.memory_list64.ranges:
+        location = self.memory_list64.base_rva + offset
+        self.memory_regions.append((r.start, r.size, location))
+        offset += r.size
+    if self.memory_list is not None:
+      for r in self.memory_list.ranges:
+        self.memory_regions.append((r.start, r.memory.data_size, r.memory.rva))
+    self.sorted_memory_regions = sorted(self.memory_regions)
+    self.memory_region_starts = [
+        region[0] for region in self.sorted_memory_regions]
+    self.last_memory_region = None
+
   def _FindObjdump(self, options):
     if options.objdump:
         objdump_bin = options.objdump
@@ -786,15 +832,15 @@ class MinidumpReader(object):
 
   def ReadU8(self, address):
     location = self.FindLocation(address)
-    return ctypes.c_uint8.from_buffer(self.minidump, location).value
+    return MinidumpReader._U8.unpack_from(self.minidump, location)[0]
 
   def ReadU32(self, address):
     location = self.FindLocation(address)
-    return ctypes.c_uint32.from_buffer(self.minidump, location).value
+    return MinidumpReader._U32.unpack_from(self.minidump, location)[0]
 
   def ReadU64(self, address):
     location = self.FindLocation(address)
-    return ctypes.c_uint64.from_buffer(self.minidump, location).value
+    return MinidumpReader._U64.unpack_from(self.minidump, location)[0]
 
   def Is64(self):
     return (self.arch == MD_CPU_ARCHITECTURE_ARM64 or
@@ -810,9 +856,15 @@ class MinidumpReader(object):
     return self.minidump[location:location + size]
 
   def _ReadWord(self, location):
+    return self._WordStruct().unpack_from(self.minidump, location)[0]
+
+  def _WordStruct(self):
     if self.Is64():
-      return ctypes.c_uint64.from_buffer(self.minidump, location).value
-    return ctypes.c_uint32.from_buffer(self.minidump, location).value
+      return MinidumpReader._U64
+    return MinidumpReader._U32
+
+  def _CountBytes(self, data, byte_set):
+    return len(data) - len(data.translate(None, byte_set))
 
   def ReadAsciiPtr(self, address):
     ascii_content = [c if c >= '\x20' and c <  '\x7f' else '.'
@@ -831,19 +883,11 @@ class MinidumpReader(object):
     return string
 
   def IsProbableASCIIRegion(self, location, length):
-    ascii_bytes = 0
-    non_ascii_bytes = 0
-    for i in range(length):
-      loc = location + i
-      byte = ctypes.c_uint8.from_buffer(self.minidump, loc).value
-      if byte >= 0x7f:
-        non_ascii_bytes += 1
-      if byte < 0x20 and byte != 0:
-        non_ascii_bytes += 1
-      if byte < 0x7f and byte >= 0x20:
-        ascii_bytes += 1
-      if byte == 0xa:  # newline
-        ascii_bytes += 1
+    data = self.minidump[location:location + length]
+    ascii_bytes = (self._CountBytes(data, MinidumpReader._PRINTABLE_BYTES) +
+                   data.count("\n"))
+    non_ascii_bytes = (self._CountBytes(data, MinidumpReader._CONTROL_BYTES) +
+                       self._CountBytes(data, MinidumpReader._HIGH_BYTES))
     if ascii_bytes * 10 <= length:
       return False
     if length > 0 and ascii_bytes > non_ascii_bytes * 7:
@@ -853,24 +897,10 @@ class MinidumpReader(object):
     return False
 
   def IsProbableExecutableRegion(self, location, length):
-    opcode_bytes = 0
-    sixty_four = self.Is64()
-    for i in range(length):
-      loc = location + i
-      byte = ctypes.c_uint8.from_buffer(self.minidump, loc).value
-      if (byte == 0x8b or           # mov
-          byte == 0x89 or           # mov reg-reg
-          (byte & 0xf0) == 0x50 or  # push/pop
-          (sixty_four and (byte & 0xf0) == 0x40) or  # rex prefix
-          byte == 0xc3 or           # return
-          byte == 0x74 or           # jeq
-          byte == 0x84 or           # jeq far
-          byte == 0x75 or           # jne
-          byte == 0x85 or           # jne far
-          byte == 0xe8 or           # call
-          byte == 0xe9 or           # jmp far
-          byte == 0xeb):            # jmp near
-        opcode_bytes += 1
+    data = self.minidump[location:location + length]
+    opcode_bytes = self._CountBytes(data, MinidumpReader._OPCODE_BYTES)
+    if self.Is64():
+      opcode_bytes += self._CountBytes(data, MinidumpReader._REX_PREFIX_BYTES)
     opcode_percent = (opcode_bytes * 100) / length
     threshold = 20
     if opcode_percent > threshold + 2:
@@ -880,66 +910,88 @@ class MinidumpReader(object):
     return False
 
   def FindRegion(self, addr):
-    answer = [-1, -1]
-    def is_in(reader, start, size, location):
-      if addr >= start and addr < start + size:
-        answer[0] = start
-        answer[1] = size
-    self.ForEachMemoryRegion(is_in)
-    if answer[0] == -1:
+    region = self._FindMemoryRegion(addr)
+    if region is None:
       return None
-    return answer
+    return [region[0], region[1]]
 
   def ForEachMemoryRegion(self, cb):
-    if self.memory_list64 is not None:
-      for r in self.memory_list64.ranges:
-        location = self.memory_list64.base_rva + offset
-        cb(self, r.start, r.size, location)
-        offset += r.size
-
-    if self.memory_list is not None:
-      for r in self.memory_list.ranges:
-        cb(self, r.start, r.memory.data_size, r.memory.rva)
+    for start, size, location in self.memory_regions:
+      cb(self, start, size, location)
 
   def FindWord(self, word, alignment=0):
     def search_inside_region(reader, start, size, location):
       location = (location + alignment) & ~alignment
-      for i in range(size - self.PointerSize()):
-        loc = location + i
-        if reader._ReadWord(loc) == word:
-          slot = start + (loc - location)
-          print("%s: %s" % (reader.FormatIntPtr(slot),
-                            reader.FormatIntPtr(word)))
+      for loc in reader._FindWordLocations(word, location, size):
+        slot = start + (loc - location)
+        print("%s: %s" % (reader.FormatIntPtr(slot),
+                          reader.FormatIntPtr(word)))
     self.ForEachMemoryRegion(search_inside_region)
 
   def FindWordList(self, word):
     aligned_res = []
     unaligned_res = []
     def search_inside_region(reader, start, size, location):
-      for i in range(size - self.PointerSize()):
-        loc = location + i
-        if reader._ReadWord(loc) == word:
-          slot = start + (loc - location)
-          if self.IsAlignedAddress(slot):
-            aligned_res.append(slot)
-          else:
-            unaligned_res.append(slot)
+      for loc in reader._FindWordLocations(word, location, size):
+        slot = start + (loc - location)
+        if self.IsAlignedAddress(slot):
+          aligned_res.append(slot)
+        else:
+          unaligned_res.append(slot)
     self.ForEachMemoryRegion(search_inside_region)
     return (aligned_res, unaligned_res)
 
-  def FindLocation(self, address):
-    offset = 0
-    if self.memory_list64 is not None:
-      for r in self.memory_list64.ranges:
-        if r.start <= address < r.start + r.size:
-          return self.memory_list64.base_rva + offset + address - r.start
-        offset += r.size
-    if self.memory_list is not None:
-      for r in self.memory_list.ranges:
-        if r.start <= address < r.start + r.memory.data_size:
-          return r.memory.rva + address - r.start
+  def FindAlignedWord(self, word, start, end):
+    """Returns the first slot in range(start, end, PointerSize()) holding
+    word, or None if there is none or an invalid slot comes first."""
+    ptr_size = self.PointerSize()
+    needle = self._WordStruct().pack(word)
+    slot = start
+    while slot < end:
+      region = self._FindMemoryRegion(slot)
+      if region is None:
+        return None
+      region_start, size, location = region
+      # All slots below limit are valid and are searched at once.
+      limit = min(end, region_start + size)
+      search_from = location + slot - region_start
+      search_to = location + limit - region_start + ptr_size - 1
+      loc = self.minidump.find(needle, search_from, search_to)
+      while loc >= 0:
+        if (loc - search_from) % ptr_size == 0:
+          return slot + loc - search_from
+        loc = self.minidump.find(needle, loc + 1, search_to)
+      slot += (limit - slot + ptr_size - 1) // ptr_size * ptr_size
     return None
 
+  def _FindWordLocations(self, word, location, size):
+    # Same as checking every byte offset i in range(size - PointerSize()).
+    needle = self._WordStruct().pack(word)
+    end = location + size - 1
+    loc = self.minidump.find(needle, location, end)
+    while loc >= 0:
+      yield loc
+      loc = self.minidump.find(needle, loc + 1, end)
+
+  def _FindMemoryRegion(self, address):
+    region = self.last_memory_region
+    if region is not None and region[0] <= address < region[0] + region[1]:
+      return region
+    i = bisect.bisect_right(self.memory_region_starts, address) - 1
+    if i < 0:
+      return None
+    region = self.sorted_memory_regions[i]
+    if address >= region[0] + region[1]:
+      return None
+    self.last_memory_region = region
+    return region
+
+  def FindLocation(self, address):
+    region = self._FindMemoryRegion(address)
+    if region is None:
+      return None
+    return region[2] + address - region[0]
+
   def GetDisasmLines(self, address, size):
     def CountUndefinedInstructions(lines):
       pattern = "<UNDEFINED>"
@@ -1717,6 +1769,31 @@ class Code(HeapObject):
     return FormatDisasmLine(self.entry, self.heap, line)
 
 
+class LruCache(object):
+  """Mapping that keeps only the most recently used entries."""
+
+  def __init__(self, capacity):
+    self.capacity = capacity
+    self.entries = collections.OrderedDict()
+
+  def __contains__(self, key):
+    return key in self.entries
+
+  def __getitem__(self, key):
+    value = self.entries.pop(key)
+    self.entries[key] = value
+    return value
+
+  def __setitem__(self, key, value):
+    self.entries.pop(key, None)
+    self.entries[key] = value
+    if len(self.entries) > self.capacity:
+      self.entries.popitem(last=False)
+
+  def __len__(self):
+    return len(self.entries)
+
+
 class V8Heap(object):
   CLASS_MAP = {
     "SYMBOL_TYPE": SeqString,
@@ -1749,10 +1826,14 @@ class V8Heap(object):
     "CODE_TYPE": Code,
   }
 
-  def __init__(self, reader, stack_map):
+  def __init__(self, reader, stack_map, object_cache_size=None):
     self.reader = reader
     self.stack_map = stack_map
-    self.objects = {}
+    # Decoded objects, and None for addresses that are not objects.
+    if object_cache_size is None:
+      self.objects = {}
+    else:
+      self.objects = LruCache(object_cache_size)
 
   def FindObjectOrSmi(self, tagged_address):
     if self.IsSmi(tagged_address): return self.SmiUntag(tagged_address)
@@ -1762,6 +1843,11 @@ class V8Heap(object):
     if tagged_address in self.objects:
       return self.objects[tagged_address]
     if not self.IsTaggedObjectAddress(tagged_address): return None
+    object = self._DecodeObject(tagged_address)
+    self.objects[tagged_address] = object
+    return object
+
+  def _DecodeObject(self, tagged_address):
     address = tagged_address - 1
     if not self.reader.IsValidAddress(address): return None
     map_tagged_address = self.reader.ReadUIntPtr(address)
@@ -1771,16 +1857,13 @@ class V8Heap(object):
       instance_type_name = INSTANCE_TYPES.get(meta_map.instance_type)
       if instance_type_name != "MAP_TYPE": return None
       meta_map.map = meta_map
-      object = meta_map
-    else:
-      map = self.FindMap(map_tagged_address)
-      if map is None: return None
-      instance_type_name = INSTANCE_TYPES.get(map.instance_type)
-      if instance_type_name is None: return None
-      cls = V8Heap.CLASS_MAP.get(instance_type_name, HeapObject)
-      object = cls(self, map, address)
-    self.objects[tagged_address] = object
-    return object
+      return meta_map
+    map = self.FindMap(map_tagged_address)
+    if map is None: return None
+    instance_type_name = INSTANCE_TYPES.get(map.instance_type)
+    if instance_type_name is None: return None
+    cls = V8Heap.CLASS_MAP.get(instance_type_name, HeapObject)
+    return cls(self, map, address)
 
   def FindMap(self, tagged_address):
     address = self.FindMapAddress(tagged_address)
@@ -1984,6 +2067,160 @@ class InspectionInfo(object):
     return self.address_comments.get(address, "")
 
 
+class HeapIndex(object):
+  """Index of the heap objects that aligned slots in the dump point to.
+
+  For each object the index records its map and instance type, and the
+  slots pointing to it. The index is built in a background thread and
+  cached next to the dump, keyed by the SHA-1 of the dump, so that later
+  sessions on the same dump load it instead of scanning the dump again.
+  """
+
+  VERSION = 2
+  HASH_CHUNK_SIZE = 1 << 24
+  SCAN_CHUNK_WORDS = 1 << 20
+
+  def __init__(self, minidump_name, reader, heap):
+    self.cache_file = minidump_name + ".index"
+    self.reader = reader
+    self.heap = heap
+    # Tagged address -> (map tagged address, instance type name).
+    self.objects = {}
+    # Tagged address -> aligned slots holding it.
+    self.references = {}
+    self.ready = threading.Event()
+    self.thread = threading.Thread(target=self._Build)
+    self.thread.daemon = True
+
+  def Start(self):
+    self.thread.start()
+
+  def GetObjectInfo(self, tagged_address):
+    if not self.ready.is_set(): return None
+    return self.objects.get(tagged_address)
+
+  def GetReferences(self, tagged_address):
+    if not self.ready.is_set(): return None
+    return self.references.get(tagged_address)
+
+  def _Build(self):
+    key = self._Hash()
+    if not self._Load(key):
+      self._Scan()
+      self._Save(key)
+    self.ready.set()
+
+  def _Hash(self):
+    digest = hashlib.sha1()
+    minidump = self.reader.minidump
+    for offset in range(0, len(minidump), HeapIndex.HASH_CHUNK_SIZE):
+      digest.update(minidump[offset:offset + HeapIndex.HASH_CHUNK_SIZE])
+    return digest.hexdigest()
+
+  # The cache is plain JSON: a header line with the version and the key,
+  # followed by a line with the objects and a line with the references.
+  # The cache file is as untrusted as the dump, so the header is checked
+  # before the rest is parsed, and only ints and strings are accepted.
+
+  def _Load(self, key):
+    if not os.path.exists(self.cache_file):
+      return False
+    try:
+      with open(self.cache_file, "r") as f:
+        header = json.loads(f.readline())
+        if (not isinstance(header, dict) or
+            header.get("version") != HeapIndex.VERSION or
+            header.get("key") != key):
+          return False
+        objects = {}
+        for address, map_address, type_name in json.loads(f.readline()):
+          if not (HeapIndex._IsInt(address) and
+                  HeapIndex._IsInt(map_address) and
+                  isinstance(type_name, basestring)):
+            raise ValueError("malformed object entry")
+          objects[address] = (map_address, str(type_name))
+        references = {}
+        for address, slots in json.loads(f.readline()):
+          if not (HeapIndex._IsInt(address) and
+                  all(HeapIndex._IsInt(slot) for slot in slots)):
+            raise ValueError("malformed reference entry")
+          references[address] = slots
+    except (IOError, TypeError, ValueError) as e:
+      print("Warning: Cannot read %s: %s" % (self.cache_file, e),
+            file=sys.stderr)
+      return False
+    self.objects = objects
+    self.references = references
+    return True
+
+  @staticmethod
+  def _IsInt(value):
+    return isinstance(value, (int, long)) and not isinstance(value, bool)
+
+  def _Save(self, key):
+    temp_file = self.cache_file + ".tmp"
+    try:
+      with open(temp_file, "w") as f:
+        json.dump({"version": HeapIndex.VERSION, "key": key}, f)
+        f.write("\n")
+        json.dump([(address, map_address, type_name)
+                   for address, (map_address, type_name)
+                   in self.objects.iteritems()], f)
+        f.write("\n")
+        json.dump(list(self.references.iteritems()), f)
+        f.write("\n")
+      os.rename(temp_file, self.cache_file)
+    except (IOError, OSError) as e:
+      print("Warning: Cannot write %s: %s" % (self.cache_file, e),
+            file=sys.stderr)
+
+  def _Scan(self):
+    reader = self.reader
+    ptr_size = reader.PointerSize()
+    word_format = "=%dQ" if reader.Is64() else "=%dI"
+    alignment_mask = self.heap.ObjectAlignmentMask()
+    rejected = set()
+    for start, size, location in reader.memory_regions:
+      first_slot = (start + ptr_size - 1) & ~(ptr_size - 1)
+      slot_count = (start + size - first_slot) // ptr_size
+      for chunk in range(0, slot_count, HeapIndex.SCAN_CHUNK_WORDS):
+        count = min(HeapIndex.SCAN_CHUNK_WORDS, slot_count - chunk)
+        chunk_slot = first_slot + chunk * ptr_size
+        words = struct.unpack_from(word_format % count, reader.minidump,
+                                   location + chunk_slot - start)
+        for i, value in enumerate(words):
+          if (value & alignment_mask) != 1 or value in rejected: continue
+          if value not in self.objects:
+            info = self._DescribeObject(value)
+            if info is None:
+              rejected.add(value)
+              continue
+            self.objects[value] = info
+          self.references.setdefault(value, []).append(
+              chunk_slot + i * ptr_size)
+
+  def _DescribeObject(self, tagged_address):
+    # Same checks as V8Heap.FindObject, without decoding the object.
+    reader = self.reader
+    address = tagged_address - 1
+    if not reader.IsValidAddress(address): return None
+    map_tagged_address = reader.ReadUIntPtr(address)
+    if map_tagged_address == tagged_address:
+      map_address = address
+    else:
+      map_address = self.heap.FindMapAddress(map_tagged_address)
+      if map_address is None: return None
+    instance_type_address = (map_address + reader.PointerSize() +
+                             self.heap.IntSize())
+    if not reader.IsValidAddress(instance_type_address): return None
+    instance_type_name = INSTANCE_TYPES.get(
+        reader.ReadU8(instance_type_address))
+    if instance_type_name is None: return None
+    if map_address == address and instance_type_name != "MAP_TYPE":
+      return None
+    return (map_tagged_address, instance_type_name)
+
+
 class InspectionPadawan(object):
   """The padawan can improve annotations by sensing well-known objects."""
   def __init__(self, reader, heap):
@@ -2164,12 +2401,7 @@ class InspectionPadawan(object):
     return stack_start
 
   def FindPtr(self, expected_value, start, end):
-    ptr_size = self.reader.PointerSize()
-    for slot in range(start, end, ptr_size):
-      if not self.reader.IsValidAddress(slot): return None
-      value = self.reader.ReadUIntPtr(slot)
-      if value == expected_value: return slot
-    return None
+    return self.reader.FindAlignedWord(expected_value, start, end)
 
   def TryExtractErrorMessage(self, slot, start, end, print_message):
     ptr_size = self.reader.PointerSize()
@@ -2700,6 +2932,8 @@ class InspectionWebFormatter(object):
   CONTEXT_FULL = 0
   CONTEXT_SHORT = 1
 
+  OBJECT_CACHE_SIZE = 100000
+
   def __init__(self, switches, minidump_name, http_server):
     self.dumpfilename = os.path.split(minidump_name)[1]
     self.encfilename = urllib.urlencode({ 'dump' : self.dumpfilename })
@@ -2716,10 +2950,13 @@ class InspectionWebFormatter(object):
       maybe_address = self.reader.ReadUIntPtr(slot)
       if not maybe_address in stack_map:
         stack_map[maybe_address] = slot
-    self.heap = V8Heap(self.reader, stack_map)
+    self.heap = V8Heap(self.reader, stack_map,
+                       InspectionWebFormatter.OBJECT_CACHE_SIZE)
 
     self.padawan = InspectionPadawan(self.reader, self.heap)
     self.comments = InspectionInfo(minidump_name, self.reader)
+    self.index = HeapIndex(minidump_name, self.reader, self.heap)
+    self.index.Start()
     self.padawan.known_first_old_page = (
         self.comments.get_page_address("oldpage"))
     self.padawan.known_first_map_page = (
@@ -3241,7 +3478,16 @@ class InspectionWebFormatter(object):
         f.write("<hr>")
         self.output_disasm_range(f, address - 16, address + 16, address, True)
 
-      aligned_res, unaligned_res = self.reader.FindWordList(address)
+      object_info = self.index.GetObjectInfo(address)
+      if object_info is not None:
+        # Pointers to heap objects are only ever stored in aligned slots.
+        map_address, instance_type_name = object_info
+        f.write("<h3>Heap object of type %s with map %s</h3>" %
+                (instance_type_name, self.format_address(map_address)))
+        aligned_res = self.index.GetReferences(address)
+        unaligned_res = []
+      else:
+        aligned_res, unaligned_res = self.reader.FindWordList(address)
 
       if len(aligned_res) > 0:
         f.write("<h3>Occurrences of 0x%x at aligned addresses</h3>" %
@@ -7,6 +7,8 @@
 
 import argparse
 import collections
+import functools
+import multiprocessing
 import re
 import subprocess
 import sys
@@ -45,6 +47,9 @@ examples:
   #
   $ tools/run-perf.sh out/x64.release/d8 --noopt octane/run.js
   $ tools/ignition/linux_perf_report.py
+
+  # Same as above, but split the callchains across 8 worker processes.
+  $ tools/ignition/linux_perf_report.py -j 8
 """
 
 
@@ -55,6 +60,19 @@ JIT_CODE_SYMBOLS_RE = re.compile(
 GC_SYMBOLS_RE = re.compile(
   r"v8::internal::Heap::CollectGarbage")
 
+# Symbol kinds, as returned by classify_symbol.
+SYMBOL_OTHER = 0
+SYMBOL_BYTECODE_HANDLER = 1
+SYMBOL_JIT_CODE = 2
+SYMBOL_GC = 3
+SYMBOL_CENTRY_STUB = 4
+SYMBOL_COMPILER = 5
+SYMBOL_ENTRY_TRAMPOLINE = 6
+
+# Approximate number of bytes of perf script output handed to a worker at a
+# time. Chunks are only cut at the end of a callchain.
+CHUNK_SIZE = 4 << 20
+
 
 def strip_function_parameters(symbol):
   if symbol[-1] != ')': return symbol
@@ -72,12 +90,31 @@ def strip_function_parameters(symbol):
   return symbol[:-pos]
 
 
+def classify_symbol(symbol):
+  if symbol.startswith("BytecodeHandler:"):
+    return SYMBOL_BYTECODE_HANDLER
+  if JIT_CODE_SYMBOLS_RE.match(symbol):
+    return SYMBOL_JIT_CODE
+  if GC_SYMBOLS_RE.match(symbol):
+    return SYMBOL_GC
+  if symbol == "Stub:CEntryStub":
+    return SYMBOL_CENTRY_STUB
+  if COMPILER_SYMBOLS_RE.match(symbol):
+    return SYMBOL_COMPILER
+  if symbol == "Builtin:InterpreterEntryTrampoline":
+    return SYMBOL_ENTRY_TRAMPOLINE
+  return SYMBOL_OTHER
+
+
 def collapsed_callchains_generator(perf_stream, hide_other=False,
                                    hide_compiler=False, hide_jit=False,
                                    hide_gc=False, show_full_signatures=False):
   current_chain = []
   skip_until_end_of_chain = False
   compiler_symbol_in_chain = False
+  # The same few thousand symbols make up nearly all frames, so strip and
+  # classify each of them once.
+  symbol_cache = {}
 
   for line in perf_stream:
     # Lines starting with a "#" are comments, skip them.
@@ -102,9 +139,14 @@ def collapsed_callchains_generator(perf_stream, hide_other=False,
       continue
 
     # Trim the leading address and the trailing +offset, if present.
-    symbol = line.split(" ", 1)[1].split("+", 1)[0]
-    if not show_full_signatures:
-      symbol = strip_function_parameters(symbol)
+    raw_symbol = line.split(" ", 1)[1].split("+", 1)[0]
+    cached = symbol_cache.get(raw_symbol)
+    if cached is None:
+      symbol = raw_symbol
+      if not show_full_signatures:
+        symbol = strip_function_parameters(symbol)
+      cached = symbol_cache[raw_symbol] = (symbol, classify_symbol(symbol))
+    symbol, kind = cached
 
     # Avoid chains of [unknown]
     if (symbol == "[unknown]" and current_chain and
@@ -113,28 +155,28 @@ def collapsed_callchains_generator(perf_stream, hide_other=False,
 
     current_chain.append(symbol)
 
-    if symbol.startswith("BytecodeHandler:"):
+    if kind == SYMBOL_BYTECODE_HANDLER:
       current_chain.append("[interpreter]")
       yield current_chain
       skip_until_end_of_chain = True
-    elif JIT_CODE_SYMBOLS_RE.match(symbol):
+    elif kind == SYMBOL_JIT_CODE:
       if not hide_jit:
         current_chain.append("[jit]")
         yield current_chain
         skip_until_end_of_chain = True
-    elif GC_SYMBOLS_RE.match(symbol):
+    elif kind == SYMBOL_GC:
       if not hide_gc:
         current_chain.append("[gc]")
         yield current_chain
         skip_until_end_of_chain = True
-    elif symbol == "Stub:CEntryStub" and compiler_symbol_in_chain:
+    elif kind == SYMBOL_CENTRY_STUB and compiler_symbol_in_chain:
       if not hide_compiler:
         current_chain.append("[compiler]")
         yield current_chain
       skip_until_end_of_chain = True
-    elif COMPILER_SYMBOLS_RE.match(symbol):
+    elif kind == SYMBOL_COMPILER:
       compiler_symbol_in_chain = True
-    elif symbol == "Builtin:InterpreterEntryTrampoline":
+    elif kind == SYMBOL_ENTRY_TRAMPOLINE:
       if len(current_chain) == 1:
         yield ["[entry trampoline]"]
       else:
@@ -147,18 +189,20 @@ def collapsed_callchains_generator(perf_stream, hide_other=False,
       skip_until_end_of_chain = True
 
 
+def count_collapsed_callchains(callchains):
+  return collections.Counter(
+    ";".join(reversed(callchain)) for callchain in callchains)
+
+
 def calculate_samples_count_per_callchain(callchains):
-  chain_counters = collections.defaultdict(int)
-  for callchain in callchains:
-    key = ";".join(reversed(callchain))
-    chain_counters[key] += 1
-  return chain_counters.items()
+  return count_collapsed_callchains(callchains).items()
 
 
-def calculate_samples_count_per_handler(callchains):
-  def strip_handler_prefix_if_any(handler):
-    return handler if handler[0] == "[" else handler.split(":", 1)[1]
+def strip_handler_prefix_if_any(handler):
+  return handler if handler[0] == "[" else handler.split(":", 1)[1]
+
 
+def calculate_samples_count_per_handler(callchains):
   handler_counters = collections.defaultdict(int)
   for callchain in callchains:
     handler = strip_handler_prefix_if_any(callchain[-1])
@@ -166,13 +210,74 @@ def calculate_samples_count_per_handler(callchains):
   return handler_counters.items()
 
 
-def write_flamegraph_input_file(output_stream, callchains):
-  for callchain, count in calculate_samples_count_per_callchain(callchains):
+def calculate_samples_count_per_handler_from_counters(chain_counters):
+  handler_counters = collections.defaultdict(int)
+  for key, count in chain_counters.iteritems():
+    # The handler is the innermost frame, i.e. the first one in the key.
+    handler = strip_handler_prefix_if_any(key.split(";", 1)[0])
+    handler_counters[handler] += count
+  return handler_counters.items()
+
+
+def split_at_callchain_boundaries(perf_stream, chunk_size):
+  pending = ""
+  while True:
+    data = perf_stream.read(chunk_size)
+    if not data:
+      break
+    pending += data
+    # Only cut after the empty line closing a callchain, so that every chunk
+    # starts with a fresh parser state. Lines are split by the workers.
+    end = pending.rfind("\n\n")
+    if end < 0:
+      continue
+    yield pending[:end + 2]
+    pending = pending[end + 2:]
+  if pending:
+    yield pending
+
+
+def _count_chunk(chunk, filter_options):
+  return count_collapsed_callchains(
+    collapsed_callchains_generator(chunk.splitlines(True), *filter_options))
+
+
+def parallel_count_collapsed_callchains(perf_stream, jobs,
+                                        filter_options=(),
+                                        chunk_size=CHUNK_SIZE):
+  """Count collapsed callchains of perf_stream in a pool of jobs workers.
+
+  filter_options are the positional arguments following perf_stream of
+  collapsed_callchains_generator. Returns the same counters as
+  count_collapsed_callchains(collapsed_callchains_generator(...)).
+  """
+  chain_counters = collections.Counter()
+  pool = multiprocessing.Pool(jobs)
+  try:
+    worker = functools.partial(_count_chunk, filter_options=filter_options)
+    for counters in pool.imap_unordered(
+        worker, split_at_callchain_boundaries(perf_stream, chunk_size)):
+      chain_counters.update(counters)
+    pool.close()
+  except:
+    pool.terminate()
+    raise
+  finally:
+    pool.join()
+  return chain_counters
+
+
+def write_flamegraph_counters(output_stream, chain_counters):
+  for callchain, count in chain_counters.iteritems():
     output_stream.write("{}; {}\n".format(callchain, count))
 
 
-def write_handlers_report(output_stream, callchains):
-  handler_counters = calculate_samples_count_per_handler(callchains)
+def write_flamegraph_input_file(output_stream, callchains):
+  write_flamegraph_counters(output_stream,
+                            count_collapsed_callchains(callchains))
+
+
+def write_handlers_counters(output_stream, handler_counters):
   samples_num = sum(counter for _, counter in handler_counters)
   # Sort by decreasing number of samples
   handler_counters.sort(key=lambda entry: entry[1], reverse=True)
@@ -182,6 +287,11 @@ def write_handlers_report(output_stream, callchains):
                                  100. * count / samples_num))
 
 
+def write_handlers_report(output_stream, callchains):
+  write_handlers_counters(output_stream,
+                          calculate_samples_count_per_handler(callchains))
+
+
 def parse_command_line():
   command_line_parser = argparse.ArgumentParser(
     formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -226,6 +336,13 @@ def parse_command_line():
     help="show full signatures instead of function names",
     action="store_true"
   )
+  command_line_parser.add_argument(
+    "--jobs", "-j",
+    help="number of worker processes aggregating callchains (default: 1)",
+    type=int,
+    default=1,
+    metavar="<jobs>"
+  )
   command_line_parser.add_argument(
     "--output", "-o",
     help="output file name (stdout if omitted)",
@@ -245,15 +362,23 @@ def main():
                            "-i", program_options.perf_filename],
                           stdout=subprocess.PIPE)
 
-  callchains = collapsed_callchains_generator(
-    perf.stdout, program_options.hide_other, program_options.hide_compiler,
-    program_options.hide_jit, program_options.hide_gc,
-    program_options.show_full_signatures)
+  filter_options = (program_options.hide_other, program_options.hide_compiler,
+                    program_options.hide_jit, program_options.hide_gc,
+                    program_options.show_full_signatures)
+
+  if program_options.jobs > 1:
+    chain_counters = parallel_count_collapsed_callchains(
+      perf.stdout, program_options.jobs, filter_options)
+  else:
+    chain_counters = count_collapsed_callchains(
+      collapsed_callchains_generator(perf.stdout, *filter_options))
 
   if program_options.output_flamegraph:
-    write_flamegraph_input_file(program_options.output_stream, callchains)
+    write_flamegraph_counters(program_options.output_stream, chain_counters)
   else:
-    write_handlers_report(program_options.output_stream, callchains)
+    write_handlers_counters(
+      program_options.output_stream,
+      calculate_samples_count_per_handler_from_counters(chain_counters))
 
 
 if __name__ == "__main__":
@@ -135,6 +135,42 @@ class LinuxPerfReportTest(unittest.TestCase):
       ["foo", "BytecodeHandler:first", "[interpreter]"],
     ])
 
+  def test_split_at_callchain_boundaries(self):
+    perf_stream = StringIO.StringIO(PERF_SCRIPT_OUTPUT)
+    chunks = list(ipr.split_at_callchain_boundaries(perf_stream, 16))
+    self.assertGreater(len(chunks), 1)
+    self.assertEqual("".join(chunks), PERF_SCRIPT_OUTPUT)
+    for chunk in chunks[:-1]:
+      self.assertTrue(chunk.endswith("\n\n"))
+    callchains = []
+    for chunk in chunks:
+      callchains.extend(
+          ipr.collapsed_callchains_generator(chunk.splitlines(True)))
+    self.assertListEqual(callchains, list(ipr.collapsed_callchains_generator(
+        StringIO.StringIO(PERF_SCRIPT_OUTPUT))))
+
+  def test_parallel_count_collapsed_callchains(self):
+    for filter_options in [(), (True, True, True, True, True)]:
+      expected = ipr.count_collapsed_callchains(
+          ipr.collapsed_callchains_generator(
+              StringIO.StringIO(PERF_SCRIPT_OUTPUT), *filter_options))
+      counters = ipr.parallel_count_collapsed_callchains(
+          StringIO.StringIO(PERF_SCRIPT_OUTPUT), 2, filter_options,
+          chunk_size=16)
+      self.assertEqual(counters, expected)
+
+  def test_calculate_samples_count_per_handler_from_counters(self):
+    callchains = [
+      ["foo", "BytecodeHandler:bar"],
+      ["foo", "BytecodeHandler:bar"],
+      ["beep", "BytecodeHandler:bar"],
+      ["hello", "v8::internal::Compiler", "[compiler]"],
+    ]
+    counters = ipr.calculate_samples_count_per_handler_from_counters(
+        ipr.count_collapsed_callchains(callchains))
+    self.assertItemsEqual(counters,
+                          ipr.calculate_samples_count_per_handler(callchains))
+
   def test_compiler_symbols_regex(self):
     compiler_symbols = [
       "v8::internal::Parser",
@@ -39,6 +39,7 @@ import mmap
 import optparse
 import os
 import re
+import struct
 import subprocess
 import sys
 import time
@@ -216,94 +217,81 @@ class Code(object):
                                  inplace)
 
 
-class CodePage(object):
-  """Group of adjacent code objects."""
-
-  SHIFT = 20  # 1M pages
-  SIZE = (1 << SHIFT)
-  MASK = ~(SIZE - 1)
-
-  @staticmethod
-  def PageAddress(address):
-    return address & CodePage.MASK
-
-  @staticmethod
-  def PageId(address):
-    return address >> CodePage.SHIFT
-
-  @staticmethod
-  def PageAddressFromId(id):
-    return id << CodePage.SHIFT
-
-  def __init__(self, address):
-    self.address = address
-    self.code_objects = []
-
-  def Add(self, code):
-    self.code_objects.append(code)
-
-  def Remove(self, code):
-    self.code_objects.remove(code)
-
-  def Find(self, pc):
-    code_objects = self.code_objects
-    for i, code in enumerate(code_objects):
-      if code.start_address <= pc < code.end_address:
-        code_objects[0], code_objects[i] = code, code_objects[0]
-        return code
-    return None
+class CodeMap(object):
+  """Code object map.
 
-  def __iter__(self):
-    return self.code_objects.__iter__()
+  Code objects are indexed by start address in a sorted array that is
+  searched with bisect. Recently added code objects go to a small sorted
+  delta index first, which is merged into the main index once it grows
+  large, so that adding code stays cheap between lookups.
+  """
 
+  PAGE_SHIFT = 20  # 1M pages
+  PAGE_SIZE = (1 << PAGE_SHIFT)
 
-class CodeMap(object):
-  """Code object map."""
+  MIN_DELTA_SIZE = 1024
+  # The delta index is merged once it has 1/DELTA_FRACTION of the entries
+  # of the main index.
+  DELTA_FRACTION = 16
 
   def __init__(self):
-    self.pages = {}
     self.min_address = 1 << 64
     self.max_address = -1
+    # Maps code ids to the (start, end, code) entry of each code object in
+    # the map. Entries not in here are stale and are skipped until the next
+    # merge drops them.
+    self.live = {}
+    # Main index, with the running maximum of end addresses to bound the
+    # search for code objects overlapping a pc.
+    self.starts = []
+    self.entries = []
+    self.max_ends = []
+    self.stale = 0
+    # Delta index.
+    self.delta_starts = []
+    self.delta_entries = []
+    self.delta_max_size = 0
 
   def Add(self, code, max_pages=-1):
-    page_id = CodePage.PageId(code.start_address)
-    limit_id = CodePage.PageId(code.end_address + CodePage.SIZE - 1)
-    pages = 0
-    while page_id < limit_id:
-      if max_pages >= 0 and pages > max_pages:
+    start_address = code.start_address
+    end_address = code.end_address
+    if max_pages >= 0:
+      limit = (((start_address >> CodeMap.PAGE_SHIFT) + max_pages + 1) <<
+               CodeMap.PAGE_SHIFT)
+      if end_address > limit:
         print("Warning: page limit (%d) reached for %s [%s]" % (
             max_pages, code.name, code.origin), file=sys.stderr)
-        break
-      if page_id in self.pages:
-        page = self.pages[page_id]
-      else:
-        page = CodePage(CodePage.PageAddressFromId(page_id))
-        self.pages[page_id] = page
-      page.Add(code)
-      page_id += 1
-      pages += 1
-    self.min_address = min(self.min_address, code.start_address)
-    self.max_address = max(self.max_address, code.end_address)
+        end_address = limit
+    old_entry = self.live.get(code.id)
+    if old_entry is not None:
+      self._Discard(old_entry)
+    entry = (start_address, end_address, code)
+    self.live[code.id] = entry
+    index = bisect.bisect_right(self.delta_starts, start_address)
+    self.delta_starts.insert(index, start_address)
+    self.delta_entries.insert(index, entry)
+    self.delta_max_size = max(self.delta_max_size,
+                              end_address - start_address)
+    if len(self.delta_entries) > max(CodeMap.MIN_DELTA_SIZE,
+                                     len(self.entries) //
+                                     CodeMap.DELTA_FRACTION):
+      self._Merge()
+    self.min_address = min(self.min_address, start_address)
+    self.max_address = max(self.max_address, end_address)
 
   def Remove(self, code):
-    page_id = CodePage.PageId(code.start_address)
-    limit_id = CodePage.PageId(code.end_address + CodePage.SIZE - 1)
-    removed = False
-    while page_id < limit_id:
-      if page_id not in self.pages:
-        page_id += 1
-        continue
-      page = self.pages[page_id]
-      page.Remove(code)
-      removed = True
-      page_id += 1
-    return removed
+    entry = self.live.pop(code.id, None)
+    if entry is None:
+      return False
+    self._Discard(entry)
+    return True
 
   def AllCode(self):
-    for page in self.pages.itervalues():
-      for code in page:
-        if CodePage.PageAddress(code.start_address) == page.address:
-          yield code
+    for entry in self.entries:
+      if self.live.get(entry[2].id) is entry:
+        yield entry[2]
+    for entry in self.delta_entries:
+      yield entry[2]
 
   def UsedCode(self):
     for code in self.AllCode():
@@ -317,10 +305,60 @@ class CodeMap(object):
   def Find(self, pc):
     if pc < self.min_address or pc >= self.max_address:
       return None
-    page_id = CodePage.PageId(pc)
-    if page_id not in self.pages:
-      return None
-    return self.pages[page_id].Find(pc)
+    delta_starts = self.delta_starts
+    if delta_starts:
+      delta_entries = self.delta_entries
+      lowest = pc - self.delta_max_size
+      i = bisect.bisect_right(delta_starts, pc) - 1
+      while i >= 0 and delta_starts[i] > lowest:
+        entry = delta_entries[i]
+        if pc < entry[1]:
+          return entry[2]
+        i -= 1
+    max_ends = self.max_ends
+    entries = self.entries
+    live = self.live
+    i = bisect.bisect_right(self.starts, pc) - 1
+    while i >= 0 and max_ends[i] > pc:
+      entry = entries[i]
+      if pc < entry[1] and live.get(entry[2].id) is entry:
+        return entry[2]
+      i -= 1
+    return None
+
+  def _Discard(self, entry):
+    start_address = entry[0]
+    i = bisect.bisect_left(self.delta_starts, start_address)
+    while (i < len(self.delta_starts) and
+           self.delta_starts[i] == start_address):
+      if self.delta_entries[i] is entry:
+        del self.delta_starts[i]
+        del self.delta_entries[i]
+        return
+      i += 1
+    # The entry is in the main index, leave it there until the next merge.
+    self.stale += 1
+    if self.stale > max(CodeMap.MIN_DELTA_SIZE, len(self.entries) // 2):
+      self._Merge()
+
+  def _Merge(self):
+    live = self.live
+    entries = [entry for entry in self.entries
+               if live.get(entry[2].id) is entry]
+    entries.extend(self.delta_entries)
+    entries.sort(key=lambda entry: entry[0])
+    max_ends = []
+    max_end = -1
+    for entry in entries:
+      max_end = max(max_end, entry[1])
+      max_ends.append(max_end)
+    self.starts = [entry[0] for entry in entries]
+    self.entries = entries
+    self.max_ends = max_ends
+    self.stale = 0
+    self.delta_starts = []
+    self.delta_entries = []
+    self.delta_max_size = 0
 
 
 class CodeInfo(object):
@@ -458,6 +496,12 @@ class Descriptor(object):
     "u64": ctypes.c_uint64
   }
 
+  STRUCT_FORMAT_MAP = {
+    "u16": "H",
+    "u32": "I",
+    "u64": "Q"
+  }
+
   def __init__(self, fields):
     class TraceItem(ctypes.Structure):
       _fields_ = Descriptor.CtypesFields(fields)
@@ -467,6 +511,13 @@ class Descriptor(object):
                          for field, _ in TraceItem._fields_)
 
     self.ctype = TraceItem
+    self.fields = [field for (field, _) in fields]
+    # The trace structures are naturally aligned, so the unpadded struct
+    # layout matches the ctypes one.
+    self.struct = struct.Struct(
+        "=" + "".join(Descriptor.STRUCT_FORMAT_MAP[format]
+                      for (_, format) in fields))
+    assert self.struct.size == ctypes.sizeof(self.ctype)
 
   def Read(self, trace, offset):
     return self.ctype.from_buffer(trace, offset)
@@ -608,9 +659,9 @@ class TraceReader(object):
         perf_event_attr.sample_type)
     self.callchain_supported = \
         (perf_event_attr.sample_type & PERF_SAMPLE_CALLCHAIN) != 0
-    if self.callchain_supported:
-      self.ip_struct = Descriptor.CTYPE_MAP[PERF_SAMPLE_EVENT_IP_FORMAT]
-      self.ip_size = ctypes.sizeof(self.ip_struct)
+    self.sample_type = collections.namedtuple(
+        "Sample", self.sample_event_body_desc.fields + ["ips"])
+    self.callchain_structs = {}
 
   def ReadEventHeader(self):
     if self.offset >= self.limit:
@@ -639,17 +690,25 @@ class TraceReader(object):
     return mmap_info
 
   def ReadSample(self, header, offset):
-    sample = self.sample_event_body_desc.Read(self.trace,
-                                              offset + self.header_size)
-    if not self.callchain_supported:
-      return sample
-    sample.ips = []
-    offset += self.header_size + ctypes.sizeof(sample)
-    for _ in range(sample.nr):
-      sample.ips.append(
-        self.ip_struct.from_buffer(self.trace, offset).value)
-      offset += self.ip_size
-    return sample
+    return self._DecodeSample(offset)
+
+  def ReadSamples(self, header, offset):
+    """Decodes the sample at offset and all samples directly following it.
+
+    The reader is advanced past the last decoded sample, so that runs of
+    samples between other events can be attributed in one batch.
+    """
+    samples = [self._DecodeSample(offset)]
+    trace = self.trace
+    limit = self.limit
+    unpack_header = PERF_EVENT_HEADER_DESC.struct.unpack_from
+    while self.offset < limit:
+      event_type, _, size = unpack_header(trace, self.offset)
+      if event_type != PERF_RECORD_SAMPLE:
+        break
+      samples.append(self._DecodeSample(self.offset))
+      self.offset += size
+    return samples
 
   def Dispose(self):
     self.trace.close()
@@ -663,6 +722,22 @@ class TraceReader(object):
               if (bit & sample_type) != 0]
     return Descriptor(fields)
 
+  def _DecodeSample(self, offset):
+    offset += self.header_size
+    body_struct = self.sample_event_body_desc.struct
+    values = body_struct.unpack_from(self.trace, offset)
+    if not self.callchain_supported:
+      return self.sample_type(*(values + ((),)))
+    nr = values[-1]
+    callchain_struct = self.callchain_structs.get(nr)
+    if callchain_struct is None:
+      callchain_struct = struct.Struct(
+          "=%d%s" % (nr, Descriptor.STRUCT_FORMAT_MAP[
+              PERF_SAMPLE_EVENT_IP_FORMAT]))
+      self.callchain_structs[nr] = callchain_struct
+    ips = callchain_struct.unpack_from(self.trace, offset + body_struct.size)
+    return self.sample_type(*(values + (ips,)))
+
 
 OBJDUMP_SECTION_HEADER_RE = re.compile(
   r"^\s*\d+\s(\.\S+)\s+[a-f0-9]")
@@ -937,25 +1012,36 @@ if __name__ == "__main__":
         library_repo.Load(mmap_info, code_map, options)
       mmap_time += time.time() - start
     elif header.type == PERF_RECORD_SAMPLE:
-      ticks += 1
       start = time.time()
-      sample = trace_reader.ReadSample(header, offset)
-      code = code_map.Find(sample.ip)
-      if code:
-        code.Tick(sample.ip)
-        if code.codetype == Code.OPTIMIZED:
-          optimized_ticks += 1
-        elif code.codetype == Code.FULL_CODEGEN:
-          generated_ticks += 1
-        elif code.codetype == Code.V8INTERNAL:
-          v8_internal_ticks += 1
-      else:
-        missed_ticks += 1
-      if not library_repo.Tick(sample.ip) and not code:
-        really_missed_ticks += 1
-      if trace_reader.callchain_supported:
+      samples = trace_reader.ReadSamples(header, offset)
+      events += len(samples) - 1
+      ticks += len(samples)
+      # The code map only changes on mmap events, so lookups can be shared
+      # by all samples of the batch.
+      found_code = {}
+      for sample in samples:
+        ip = sample.ip
+        if ip in found_code:
+          code = found_code[ip]
+        else:
+          code = found_code[ip] = code_map.Find(ip)
+        if code:
+          code.Tick(ip)
+          if code.codetype == Code.OPTIMIZED:
+            optimized_ticks += 1
+          elif code.codetype == Code.FULL_CODEGEN:
+            generated_ticks += 1
+          elif code.codetype == Code.V8INTERNAL:
+            v8_internal_ticks += 1
+        else:
+          missed_ticks += 1
+        if not library_repo.Tick(ip) and not code:
+          really_missed_ticks += 1
         for ip in sample.ips:
-          caller_code = code_map.Find(ip)
+          if ip in found_code:
+            caller_code = found_code[ip]
+          else:
+            caller_code = found_code[ip] = code_map.Find(ip)
           if caller_code:
             if code:
               caller_code.CalleeTick(code)
@@ -30,7 +30,8 @@ from testrunner.local import utils
 from testrunner.test_config import TestConfig
 from testrunner.testproc import progress
 from testrunner.testproc.rerun import RerunProc
-from testrunner.testproc.shard import ShardProc
+from testrunner.testproc.shard import DurationShardProc, ShardProc, \
+    load_durations, select_durations
 from testrunner.testproc.sigproc import SignalProc
 from testrunner.testproc.timeout import TimeoutProc
 
@@ -342,6 +343,13 @@ class BaseTestRunner(object):
                       help="Split tests into this number of shards")
     parser.add_option("--shard-run", default=1, type=int,
                       help="Run this shard from the split up tests.")
+    parser.add_option("--shard-durations",
+                      help="Path to a file with test durations as written by "
+                           "--test-durations. Shards are balanced by the "
+                           "recorded durations instead of the test count. "
+                           "Only the durations of tests selected by name and "
+                           "variant are balanced; tests skipped by status "
+                           "files still count.")
 
     # Progress
     parser.add_option("-p", "--progress",
@@ -350,6 +358,9 @@ class BaseTestRunner(object):
                            "color, mono)")
     parser.add_option("--json-test-results",
                       help="Path to a file for storing json results.")
+    parser.add_option("--test-durations",
+                      help="Path to a file for storing the duration of each "
+                           "test, see --shard-durations.")
     parser.add_option("--junitout", help="File name of the JUnit output")
     parser.add_option("--junittestsuite", default="v8tests",
                       help="The testsuite name in the JUnit output file")
@@ -754,10 +765,19 @@ class BaseTestRunner(object):
       procs[i].connect_to(procs[i + 1])
     procs[0].setup()
 
-  def _create_shard_proc(self, options):
+  def _create_shard_proc(self, options, name_filter=None, variants=None):
+    """
+    Args:
+      name_filter: NameFilterProc of the run, if any.
+      variants: Variants of the run, None if not known in advance.
+    """
     myid, count = self._get_shard_info(options)
     if count == 1:
       return None
+    if options.shard_durations:
+      durations = select_durations(
+          load_durations(options.shard_durations), name_filter, variants)
+      return DurationShardProc(myid - 1, count, durations)
     return ShardProc(myid - 1, count)
 
   def _get_shard_info(self, options):
@@ -802,6 +822,8 @@ class BaseTestRunner(object):
     if options.junitout:
       procs.append(progress.JUnitTestProgressIndicator(options.junitout,
                                                        options.junittestsuite))
+    if options.test_durations:
+      procs.append(progress.DurationsProgressIndicator(options.test_durations))
     if options.json_test_results:
       procs.append(progress.JsonTestProgressIndicator(
         self.framework_name,
@@ -78,22 +78,32 @@ class StatusFile(object):
     """
     with open(path) as f:
       self._rules, self._prefix_rules = ReadStatusFile(f.read(), variables)
+    self._prefix_tries = dict(
+        (variant, PrefixTrie(prefix_rules))
+        for variant, prefix_rules in self._prefix_rules.items())
+    # Merged outcomes by (testname, variant).
+    self._outcomes_cache = {}
 
   def get_outcomes(self, testname, variant=None):
     """Merges variant dependent and independent rules."""
-    outcomes = frozenset()
+    cache_key = (testname, variant or '')
+    outcomes = self._outcomes_cache.get(cache_key)
+    if outcomes is not None:
+      return outcomes
 
+    outcomes = frozenset()
     for key in set([variant or '', '']):
       rules = self._rules.get(key, {})
-      prefix_rules = self._prefix_rules.get(key, {})
 
       if testname in rules:
         outcomes |= rules[testname]
 
-      for prefix in prefix_rules:
-        if testname.startswith(prefix):
-          outcomes |= prefix_rules[prefix]
+      prefix_trie = self._prefix_tries.get(key)
+      if prefix_trie:
+        for _, prefix_outcomes in prefix_trie.matches(testname):
+          outcomes |= prefix_outcomes
 
+    self._outcomes_cache[cache_key] = outcomes
     return outcomes
 
   def warn_unused_rules(self, tests, check_variant_rules=False):
@@ -121,10 +131,11 @@ class StatusFile(object):
         if SKIP in self._rules[variant][testname]:
           continue
 
-      for prefix in self._prefix_rules.get(variant, {}):
-        if testname.startswith(prefix):
+      prefix_trie = self._prefix_tries.get(variant)
+      if prefix_trie:
+        for prefix, outcomes in prefix_trie.matches(testname):
           used_rules.add((prefix, variant))
-          if SKIP in self._prefix_rules[variant][prefix]:
+          if SKIP in outcomes:
             break
 
     for variant in variants:
@@ -139,6 +150,43 @@ class StatusFile(object):
           print('Unused rule: %s -> %s (%s)' % (rule, value, variant_desc))
 
 
+class PrefixTrie(object):
+  """Character trie over the prefixes of prefix rules. Finds all prefixes
+  matching a test name in O(length of the test name) instead of checking
+  every prefix rule.
+  """
+  def __init__(self, prefix_rules):
+    """
+    Args:
+      prefix_rules: {test name prefix: outcomes}
+    """
+    self._root = {}
+    self._size = len(prefix_rules)
+    for prefix, outcomes in prefix_rules.items():
+      node = self._root
+      for character in prefix:
+        node = node.setdefault(character, {})
+      # None can't clash with the characters used as keys.
+      node[None] = (prefix, outcomes)
+
+  def __len__(self):
+    return self._size
+
+  def matches(self, testname):
+    """Yields pairs (prefix, outcomes) of all prefix rules matching testname,
+    shortest prefix first.
+    """
+    node = self._root
+    if None in node:
+      yield node[None]
+    for character in testname:
+      node = node.get(character)
+      if node is None:
+        return
+      if None in node:
+        yield node[None]
+
+
 def _JoinsPassAndFail(outcomes1, outcomes2):
   """Indicates if we join PASS and FAIL from two different outcome sets and
   the first doesn't already contain both.
@@ -4,6 +4,8 @@
 # found in the LICENSE file.
 
 
+import os
+import tempfile
 import unittest
 
 import statusfile
@@ -160,5 +162,63 @@ class StatusFileTest(unittest.TestCase):
     )
 
 
+class PrefixTrieTest(unittest.TestCase):
+  def test_matches(self):
+    trie = statusfile.PrefixTrie({
+      'foo/': set(['SLOW']),
+      'foo/ba': set(['FAIL']),
+      'foo/bar': set(['SKIP']),
+      'baz/': set(['PASS']),
+    })
+    self.assertEquals(4, len(trie))
+    self.assertEquals(
+        [('foo/', set(['SLOW'])),
+         ('foo/ba', set(['FAIL'])),
+         ('foo/bar', set(['SKIP']))],
+        list(trie.matches('foo/bar/qux')))
+    self.assertEquals(
+        [('foo/', set(['SLOW'])), ('foo/ba', set(['FAIL']))],
+        list(trie.matches('foo/baz')))
+    self.assertEquals([], list(trie.matches('fo')))
+    self.assertEquals([], list(trie.matches('qux/foo/bar')))
+
+  def test_empty_prefix(self):
+    trie = statusfile.PrefixTrie({'': set(['SLOW'])})
+    self.assertEquals([('', set(['SLOW']))], list(trie.matches('foo')))
+
+
+class GetOutcomesTest(unittest.TestCase):
+  def setUp(self):
+    fd, self.path = tempfile.mkstemp()
+    with os.fdopen(fd, 'w') as f:
+      f.write(TEST_STATUS_FILE % 'system==linux and variant==default')
+
+  def tearDown(self):
+    os.remove(self.path)
+
+  def test_get_outcomes(self):
+    status_file = statusfile.StatusFile(self.path, make_variables())
+    self.assertEquals(
+        set(['PASS', 'SKIP', 'SLOW']),
+        status_file.get_outcomes('foo/bar'))
+    self.assertEquals(
+        set(['PASS', 'SKIP', 'SLOW', 'FAIL']),
+        status_file.get_outcomes('foo/bar', 'default'))
+    self.assertEquals(
+        set(['PASS', 'SLOW', 'FAIL']),
+        status_file.get_outcomes('foo/baz', 'default'))
+    self.assertEquals(
+        set(['PASS', 'FAIL', 'SLOW']),
+        status_file.get_outcomes('baz/bar', 'default'))
+    self.assertEquals(set(), status_file.get_outcomes('qux/foo'))
+    # Cached results are the same.
+    self.assertEquals(
+        set(['PASS', 'SLOW', 'FAIL']),
+        status_file.get_outcomes('foo/baz', 'default'))
+    self.assertEquals(
+        set(['PASS', 'SLOW']),
+        status_file.get_outcomes('foo/baz'))
+
+
 if __name__ == '__main__':
     unittest.main()
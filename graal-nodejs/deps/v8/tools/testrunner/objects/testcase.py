@@ -298,6 +298,14 @@ class TestCase(object):
     """
     return []
 
+  def get_result_cache_files(self):
+    """Returns the files that the result of the test case depends on, besides
+    the shell and the files named on its command line.
+
+    Used to key cached results, see --result-cache.
+    """
+    return self._get_resources()
+
   def skip_predictable(self):
     """Returns True if the test case is not suitable for predictable testing."""
     return True
@@ -68,6 +68,11 @@ class BaseOutProc(object):
   def expected_outcomes(self):
     raise NotImplementedError()
 
+  @property
+  def expectation_files(self):
+    """Files with expected output the outcome depends on."""
+    return []
+
 
 class Negative(object):
   @property
@@ -129,6 +134,10 @@ class ExpectedOutProc(OutProc):
     super(ExpectedOutProc, self).__init__(expected_outcomes)
     self._expected_filename = expected_filename
 
+  @property
+  def expectation_files(self):
+    return [self._expected_filename]
+
   def _is_failure_output(self, output):
     with open(self._expected_filename, 'r') as f:
       expected_lines = f.readlines()
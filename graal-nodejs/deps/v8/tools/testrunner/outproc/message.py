@@ -15,6 +15,10 @@ class OutProc(base.OutProc):
     self._basepath = basepath
     self._expected_fail = expected_fail
 
+  @property
+  def expectation_files(self):
+    return [self._basepath + '.out']
+
   def _is_failure_output(self, output):
     fail = output.exit_code != 0
     if fail != self._expected_fail:
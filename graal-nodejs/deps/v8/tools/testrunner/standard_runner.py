@@ -17,7 +17,7 @@ import base_runner
 from testrunner.local import utils
 from testrunner.local.variants import ALL_VARIANTS
 from testrunner.objects import predictable
-from testrunner.testproc.execution import ExecutionProc
+from testrunner.testproc.execution import ExecutionProc, ResultCache
 from testrunner.testproc.filter import StatusFileFilterProc, NameFilterProc
 from testrunner.testproc.loader import LoadProc
 from testrunner.testproc.seed import SeedProc
@@ -153,6 +153,14 @@ class StandardTestRunner(base_runner.BaseTestRunner):
     parser.add_option('--report', default=False, action='store_true',
                       help='Print a summary of the tests to be run')
 
+    # Result cache
+    parser.add_option('--result-cache',
+                      help='Directory for caching passed tests. Tests whose '
+                           'shell, resources, command line, variant and '
+                           'expected outcomes are unchanged since they '
+                           'last passed are reported as cached instead of '
+                           'being run')
+
   def _process_options(self, options):
     if options.sancov_dir:
       self.sancov_dir = options.sancov_dir
@@ -293,17 +301,19 @@ class StandardTestRunner(base_runner.BaseTestRunner):
     outproc_factory = None
     if self.build_config.predictable:
       outproc_factory = predictable.get_outproc
-    execproc = ExecutionProc(jobs, outproc_factory)
+    execproc = ExecutionProc(
+        jobs, outproc_factory, self._create_result_cache(options))
     sigproc = self._create_signal_proc()
+    name_filter = NameFilterProc(args) if args else None
 
     procs = [
       loader,
-      NameFilterProc(args) if args else None,
+      name_filter,
       StatusFileFilterProc(options.slow_tests, options.pass_fail_tests),
       VariantProc(self._variants),
       StatusFileFilterProc(options.slow_tests, options.pass_fail_tests),
       self._create_predictable_filter(),
-      self._create_shard_proc(options),
+      self._create_shard_proc(options, name_filter, self._variants),
       self._create_seed_proc(options),
       sigproc,
     ] + indicators + [
@@ -315,7 +325,9 @@ class StandardTestRunner(base_runner.BaseTestRunner):
 
     self._prepare_procs(procs)
 
-    loader.load_initial_tests(initial_batch_size=options.j * 2)
+    # Keep enough tests in flight to fill two batches for every worker.
+    loader.load_initial_tests(
+        initial_batch_size=options.j * 2 * execproc.max_batch_size)
 
     # This starts up worker processes and blocks until all tests are
     # processed.
@@ -334,6 +346,9 @@ class StandardTestRunner(base_runner.BaseTestRunner):
         tests.test_count_estimate, results.total, percentage, '%'))
 
     print('>>> %d tests ran' % (results.total - results.remaining))
+    if options.result_cache:
+      print('>>> %d of them passed in an earlier run and were not executed' %
+            results.cached)
 
     exit_code = utils.EXIT_CODE_PASS
     if results.failed:
@@ -344,6 +359,16 @@ class StandardTestRunner(base_runner.BaseTestRunner):
     # Indicate if a SIGINT or SIGTERM happened.
     return max(exit_code, sigproc.exit_code)
 
+  def _create_result_cache(self, options):
+    if not options.result_cache:
+      return None
+    # Unless fixed on the command line, the random seed changes with every
+    # run and doesn't tell tests apart.
+    return ResultCache(
+        os.path.abspath(options.result_cache),
+        ignore_random_seed=(not options.random_seed and
+                            options.random_seed_stress_count == 1))
+
   def _create_predictable_filter(self):
     if not self.build_config.predictable:
       return None
@@ -3,64 +3,240 @@
 # found in the LICENSE file.
 
 import collections
+import fnmatch
+import hashlib
+import json
+import os
+import tempfile
+import time
 import traceback
 
 from . import base
+from .result import CachedResult, Result
 from ..local import pool
+from ..local import statusfile
+
+
+# Jobs are sent to the workers in batches that take about this many seconds,
+# so that queue traffic and pickling don't dominate the time of short tests.
+BATCH_DURATION = 0.1
+MAX_BATCH_SIZE = 16
+
+# Files next to the shell that it loads at runtime. In component builds these
+# change without the shell being relinked.
+SHELL_RUNTIME_FILES = [
+  '*.so', '*.so.*', '*.dylib', '*.dll', 'snapshot_blob*.bin', 'icudt*.dat',
+]
 
 
 # Global function for multiprocessing, because pickling a static method doesn't
 # work on Windows.
-def run_job(job, process_context):
-  return job.run(process_context)
+def run_batch(batch, process_context):
+  return batch.run(process_context)
 
 
-def create_process_context(result_reduction):
-  return ProcessContext(result_reduction)
+def create_process_context(result_reduction, result_cache_dir=None):
+  return ProcessContext(result_reduction, result_cache_dir)
 
 
 JobResult = collections.namedtuple('JobResult', ['id', 'result'])
-ProcessContext = collections.namedtuple('ProcessContext', ['result_reduction'])
+BatchResult = collections.namedtuple('BatchResult', ['results', 'duration'])
+ProcessContext = collections.namedtuple(
+    'ProcessContext', ['result_reduction', 'result_cache_dir'])
 
 
 class Job(object):
-  def __init__(self, test_id, cmd, outproc, keep_output):
+  def __init__(self, test_id, cmd, outproc, keep_output, cache_key=None):
     self.test_id = test_id
     self.cmd = cmd
     self.outproc = outproc
     self.keep_output = keep_output
+    self.cache_key = cache_key
 
   def run(self, process_ctx):
     output = self.cmd.execute()
     reduction = process_ctx.result_reduction if not self.keep_output else None
     result = self.outproc.process(output, reduction)
+    if (self.cache_key and
+        self.outproc.get_outcome(output) == statusfile.PASS and
+        not self.outproc.has_unexpected_output(output)):
+      ResultCache.store(
+          process_ctx.result_cache_dir, self.cache_key, output.duration)
     return JobResult(self.test_id, result)
 
 
+class Batch(object):
+  """Jobs executed one after the other by the same worker. Parts shared by the
+  jobs, e.g. command prefix, environment and output processors, are pickled
+  only once per batch.
+  """
+  def __init__(self, jobs):
+    self.jobs = jobs
+
+  def run(self, process_ctx):
+    start_time = time.time()
+    results = [self._compact(job.run(process_ctx)) for job in self.jobs]
+    return BatchResult(results, time.time() - start_time)
+
+  @staticmethod
+  def _compact(job_result):
+    """Sends results without output, i.e. most results of passed tests, as
+    a plain has_unexpected_output flag.
+    """
+    result = job_result.result
+    if type(result) is Result and result.output is None and result.cmd is None:
+      return JobResult(job_result.id, result.has_unexpected_output)
+    return job_result
+
+
+class ResultCache(object):
+  """Content-addressed store of the tests that passed.
+
+  A test is keyed by the contents of the shell and the libraries and blobs
+  next to it, of the files named on its command line (e.g. harness files) and
+  of the files returned by the test's get_result_cache_files, by its command
+  line, environment and timeout, by its variant and by the expected outcomes
+  and expectation files of its output processor. Each passed test is
+  recorded in its own file named after the key, so that the workers can
+  record results concurrently.
+  """
+
+  def __init__(self, directory, ignore_random_seed=False):
+    """
+    Args:
+      directory: Directory holding the cached results.
+      ignore_random_seed: Leave the random seed out of the key. Used when the
+          seed is generated for each run and doesn't identify the test.
+    """
+    self.directory = directory
+    self._ignore_random_seed = ignore_random_seed
+    self._digests = {}
+    self._shell_runtime_files = {}
+
+  def _digest(self, path):
+    digest = self._digests.get(path)
+    if digest is None and path not in self._digests:
+      try:
+        with open(path, 'rb') as f:
+          sha = hashlib.sha1()
+          for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+        digest = sha.hexdigest()
+      except (IOError, OSError):
+        pass
+      self._digests[path] = digest
+    return digest
+
+  def _get_shell_runtime_files(self, shell_dir):
+    files = self._shell_runtime_files.get(shell_dir)
+    if files is None:
+      try:
+        names = os.listdir(shell_dir)
+      except OSError:
+        names = []
+      files = sorted(
+          os.path.join(shell_dir, name) for name in names
+          if any(fnmatch.fnmatch(name, pattern)
+                 for pattern in SHELL_RUNTIME_FILES))
+      self._shell_runtime_files[shell_dir] = files
+    return files
+
+  def key(self, test, cmd, outproc):
+    args = cmd.args
+    if self._ignore_random_seed:
+      seed_flag = '--random-seed=%d' % test.random_seed
+      args = [arg for arg in args if arg != seed_flag]
+    executables = [part for part in cmd.cmd_prefix + [cmd.shell]
+                   if os.path.isfile(part)]
+    files = executables + [arg for arg in args if os.path.isfile(arg)]
+    if os.path.isfile(cmd.shell):
+      files += self._get_shell_runtime_files(os.path.dirname(cmd.shell))
+    files += test.get_result_cache_files() + outproc.expectation_files
+    key = [
+      cmd.cmd_prefix, cmd.shell, args, sorted(cmd.env.items()), cmd.timeout,
+      test.variant, type(outproc).__name__, outproc.expected_outcomes,
+      [(path, self._digest(path)) for path in files],
+    ]
+    return hashlib.sha1(json.dumps(key).encode('utf-8')).hexdigest()
+
+  def _path(self, key):
+    return os.path.join(self.directory, key[:2], key)
+
+  def lookup(self, key):
+    """Returns the duration of the cached passed run or None."""
+    try:
+      with open(self._path(key)) as f:
+        return json.load(f)['duration']
+    except (IOError, OSError, ValueError, KeyError):
+      return None
+
+  @staticmethod
+  def store(directory, key, duration):
+    """Records a passed run. Called on the workers, failing to record only
+    means the test runs again next time.
+    """
+    subdir = os.path.join(directory, key[:2])
+    try:
+      if not os.path.isdir(subdir):
+        os.makedirs(subdir)
+    except OSError:
+      # Created by another worker in the meantime.
+      pass
+    tmp = None
+    try:
+      fd, tmp = tempfile.mkstemp(dir=subdir)
+      with os.fdopen(fd, 'w') as f:
+        json.dump({'duration': duration}, f)
+      os.rename(tmp, os.path.join(subdir, key))
+    except (IOError, OSError):
+      # E.g. recorded by another worker on Windows, where rename doesn't
+      # replace existing files.
+      if tmp and os.path.exists(tmp):
+        os.remove(tmp)
+
+
 class ExecutionProc(base.TestProc):
   """Last processor in the chain. Instead of passing tests further it creates
   commands and output processors, executes them in multiple worker processes and
   sends results to the previous processor.
   """
 
-  def __init__(self, jobs, outproc_factory=None):
+  def __init__(self, jobs, outproc_factory=None, result_cache=None,
+               max_batch_size=MAX_BATCH_SIZE):
     super(ExecutionProc, self).__init__()
     self._pool = pool.Pool(jobs, notify_fun=self.notify_previous)
     self._outproc_factory = outproc_factory or (lambda t: t.output_proc)
+    self._result_cache = result_cache
+    self._max_batch_size = max_batch_size
     self._tests = {}
+    self._cached_results = collections.deque()
+    self._pending_jobs = []
+    self._running_batches = 0
+    # Moving average of the time a worker spends per test, None until the
+    # first batch is done.
+    self._test_duration = None
+
+  @property
+  def max_batch_size(self):
+    return self._max_batch_size
 
   def connect_to(self, next_proc):
     assert False, 'ExecutionProc cannot be connected to anything'
 
   def run(self):
+    result_cache_dir = self._result_cache and self._result_cache.directory
+    self._send_cached_results()
+    self._send_pending_jobs()
     it = self._pool.imap_unordered(
-        fn=run_job,
+        fn=run_batch,
         gen=[],
         process_context_fn=create_process_context,
-        process_context_args=[self._prev_requirement],
+        process_context_args=[self._prev_requirement, result_cache_dir],
     )
     for pool_result in it:
       self._unpack_result(pool_result)
+      self._send_cached_results()
+      self._send_pending_jobs()
 
   def next_test(self, test):
     if self.is_stopped:
@@ -68,10 +244,20 @@ class ExecutionProc(base.TestProc):
 
     test_id = test.procid
     cmd = test.get_command()
-    self._tests[test_id] = test, cmd
-
     outproc = self._outproc_factory(test)
-    self._pool.add([Job(test_id, cmd, outproc, test.keep_output)])
+
+    cache_key = None
+    if self._result_cache:
+      cache_key = self._result_cache.key(test, cmd, outproc)
+      duration = self._result_cache.lookup(cache_key)
+      if duration is not None:
+        self._cached_results.append(
+            (test, CachedResult.create(cmd, duration)))
+        return True
+
+    self._tests[test_id] = test, cmd
+    self._pending_jobs.append(
+        Job(test_id, cmd, outproc, test.keep_output, cache_key))
 
     return True
 
@@ -87,9 +273,51 @@ class ExecutionProc(base.TestProc):
       self.heartbeat()
       return
 
-    job_result = pool_result.value
-    test_id, result = job_result
+    batch_result = pool_result.value
+    self._running_batches -= 1
+    self._update_test_duration(batch_result)
+
+    for test_id, result in batch_result.results:
+      if isinstance(result, bool):
+        result = Result(result, None)
+      test, result.cmd = self._tests.pop(test_id)
+      self._send_result(test, result)
+
+  def _update_test_duration(self, batch_result):
+    duration = batch_result.duration / len(batch_result.results)
+    if self._test_duration is None:
+      self._test_duration = duration
+    else:
+      self._test_duration = 0.8 * self._test_duration + 0.2 * duration
+
+  def _batch_size(self):
+    if self._test_duration is None:
+      # Nothing is known about the tests yet, they might be slow.
+      return 1
+    size = int(BATCH_DURATION / max(self._test_duration, 1e-6))
+    return max(1, min(size, self._max_batch_size))
+
+  def _send_pending_jobs(self):
+    """Sends the jobs collected by next_test to the workers in batches. Jobs
+    that don't fill a batch are kept back while all workers are busy.
+    """
+    if not self._pending_jobs or self.is_stopped:
+      return
+    size = self._batch_size()
+    idle_workers = self._pool.num_workers - self._running_batches
+    if idle_workers > 0:
+      # Spread the jobs over the idle workers before filling up batches.
+      size = min(size, -(-len(self._pending_jobs) // idle_workers))
+    while self._pending_jobs and (
+        len(self._pending_jobs) >= size or
+        self._running_batches < self._pool.num_workers):
+      self._pool.add([Batch(self._pending_jobs[:size])])
+      self._pending_jobs = self._pending_jobs[size:]
+      self._running_batches += 1
 
-    test, result.cmd = self._tests[test_id]
-    del self._tests[test_id]
-    self._send_result(test, result)
+  def _send_cached_results(self):
+    # Cached results are sent from the run loop rather than from next_test, as
+    # each of them makes the previous processors send the next test. Sending
+    # them right away would recurse once per cached test.
+    while self._cached_results and not self.is_stopped:
+      self._send_result(*self._cached_results.popleft())
@@ -74,10 +74,14 @@ class NameFilterProc(base.TestProcFilter):
         self._globs[s] = ['*']
 
   def _filter(self, test):
-    globs = self._globs.get(test.suite.name, [])
+    return not self.matches(test.suite.name, test.path)
+
+  def matches(self, suite_name, path):
+    """Returns True if the test `path` in suite `suite_name` is selected."""
+    globs = self._globs.get(suite_name, [])
     for g in globs:
-      if g == '*': return False
-      if fnmatch.fnmatch(test.path, g):
-        return False
-    exact_matches = self._exact_matches.get(test.suite.name, {})
-    return test.path not in exact_matches
+      if g == '*': return True
+      if fnmatch.fnmatch(path, g):
+        return True
+    exact_matches = self._exact_matches.get(suite_name, {})
+    return path in exact_matches
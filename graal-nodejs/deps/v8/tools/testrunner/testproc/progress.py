@@ -14,6 +14,7 @@ import sys
 import time
 
 from . import base
+from .shard import duration_key
 from ..local import junit_output
 
 
@@ -40,6 +41,7 @@ class ResultsTracker(base.TestProcObserver):
     self._requirement = base.DROP_OUTPUT
 
     self.failed = 0
+    self.cached = 0
     self.remaining = 0
     self.total = 0
     self.max_failures = max_failures
@@ -50,6 +52,8 @@ class ResultsTracker(base.TestProcObserver):
 
   def _on_result_for(self, test, result):
     self.remaining -= 1
+    if result.is_cached:
+      self.cached += 1
     if result.has_unexpected_output:
       self.failed += 1
       if self.max_failures and self.failed >= self.max_failures:
@@ -129,6 +133,8 @@ class VerboseProgressIndicator(SimpleProgressIndicator):
         outcome = 'CRASH'
       else:
         outcome = 'FAIL'
+    elif result.is_cached:
+      outcome = 'pass (cached)'
     else:
       outcome = 'pass'
     return 'Done running %s %s: %s' % (
@@ -207,6 +213,9 @@ class DotsProgressIndicator(SimpleProgressIndicator):
       else:
         sys.stdout.write('F')
         sys.stdout.flush()
+    elif result.is_cached:
+      sys.stdout.write(',')
+      sys.stdout.flush()
     else:
       sys.stdout.write('.')
       sys.stdout.flush()
@@ -234,7 +243,10 @@ class CompactProgressIndicator(ProgressIndicator):
     else:
       self._passed += 1
 
-    self._print_progress(str(test))
+    if result.is_cached:
+      self._print_progress('%s (cached)' % test)
+    else:
+      self._print_progress(str(test))
     if result.has_unexpected_output:
       output = result.output
       stdout = output.stdout.strip()
@@ -356,6 +368,33 @@ class JUnitTestProgressIndicator(ProgressIndicator):
       self.outfile.close()
 
 
+class DurationsProgressIndicator(ProgressIndicator):
+  """Records the duration of each test's first run, e.g. for balancing
+  shards with --shard-durations. Durations of earlier runs stored in the
+  same file are kept unless overwritten.
+  """
+  def __init__(self, durations_file):
+    super(DurationsProgressIndicator, self).__init__()
+    self._requirement = base.DROP_PASS_STDOUT
+
+    self.durations_file = durations_file
+    self.durations = {}
+
+  def _on_result_for(self, test, result):
+    if result.is_rerun:
+      result = result.results[0]
+    self.durations[duration_key(test)] = result.output.duration
+
+  def finished(self):
+    durations = {}
+    if os.path.exists(self.durations_file):
+      with open(self.durations_file, "r") as f:
+        durations = json.loads(f.read() or "{}")
+    durations.update(self.durations)
+    with open(self.durations_file, "w") as f:
+      f.write(json.dumps(durations, indent=0, sort_keys=True))
+
+
 class JsonTestProgressIndicator(ProgressIndicator):
   def __init__(self, framework_name, json_test_results, arch, mode):
     super(JsonTestProgressIndicator, self).__init__()
@@ -371,8 +410,11 @@ class JsonTestProgressIndicator(ProgressIndicator):
     self.mode = mode
     self.results = []
     self.tests = []
+    self.cached = 0
 
   def _on_result_for(self, test, result):
+    if result.is_cached:
+      self.cached += 1
     if result.is_rerun:
       self.process_results(test, result.results)
     else:
@@ -436,14 +478,19 @@ class JsonTestProgressIndicator(ProgressIndicator):
       } for (test, duration, cmd) in self.tests[:20]
     ]
 
-    complete_results.append({
+    summary = {
       "arch": self.arch,
       "mode": self.mode,
       "results": self.results,
       "slowest_tests": slowest_tests,
       "duration_mean": duration_mean,
       "test_total": len(self.tests),
-    })
+    }
+    if self.cached:
+      # Tests not run because they passed in an earlier run, see
+      # --result-cache. Their durations are the ones of that run.
+      summary["test_cached"] = self.cached
+    complete_results.append(summary)
 
     with open(self.json_test_results, "w") as f:
       f.write(json.dumps(complete_results))
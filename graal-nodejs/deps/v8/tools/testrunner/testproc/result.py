@@ -2,6 +2,8 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+from ..objects.output import Output
+
 
 class ResultBase(object):
   @property
@@ -16,6 +18,10 @@ class ResultBase(object):
   def is_rerun(self):
     return False
 
+  @property
+  def is_cached(self):
+    return False
+
 
 class Result(ResultBase):
   """Result created by the output processor."""
@@ -26,6 +32,22 @@ class Result(ResultBase):
     self.cmd = cmd
 
 
+class CachedResult(Result):
+  """Result of a test that passed in an earlier run with the same shell,
+  resources and command. The test wasn't executed, the output only carries the
+  duration of the earlier run.
+  """
+
+  @staticmethod
+  def create(cmd, duration):
+    return CachedResult(False, Output(duration=duration, stdout='', stderr=''),
+                        cmd)
+
+  @property
+  def is_cached(self):
+    return True
+
+
 class GroupedResult(ResultBase):
   """Result consisting of multiple results. It can be used by processors that
   create multiple subtests for each test and want to pass all results back.
@@ -2,6 +2,9 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import heapq
+import json
+
 from . import base
 
 
@@ -36,3 +39,73 @@ class ShardProc(base.TestProcFilter):
 
   def _filter(self, test):
     return self._myid != radix_hash(self._shards_count, test.procid)
+
+
+def duration_key(test):
+  """Identifies a test in a durations file, see DurationsProgressIndicator."""
+  return '%s:%s' % (test, test.variant)
+
+
+def load_durations(path):
+  with open(path) as f:
+    return json.load(f)
+
+
+def select_durations(durations, name_filter=None, variants=None):
+  """Returns the entries of `durations` for the tests that a run with the
+  given NameFilterProc and variants can select.
+
+  Packing the durations of tests that don't run would leave the shards of a
+  run over a subset of the tests unbalanced.
+  """
+  selected = {}
+  for key, duration in durations.items():
+    name, _, variant = key.rpartition(':')
+    if variants is not None and variant not in variants:
+      continue
+    suite_name, _, path = name.partition('/')
+    if name_filter and not name_filter.matches(suite_name, path):
+      continue
+    selected[key] = duration
+  return selected
+
+
+def bin_pack(durations, shards_count):
+  """Assigns each key of `durations` to a shard such that the sums of the
+  durations per shard are balanced (longest processing time first).
+
+  Ties are broken by key, so the assignment only depends on the durations
+  and is the same on every shard.
+
+  Returns: dict from key to shard id within [0; shards_count - 1]
+  """
+  assignment = {}
+  loads = [(0, shard) for shard in range(shards_count)]
+  for key, duration in sorted(
+      durations.items(), key=lambda item: (-item[1], item[0])):
+    load, shard = heapq.heappop(loads)
+    assignment[key] = shard
+    heapq.heappush(loads, (load + duration, shard))
+  return assignment
+
+
+class DurationShardProc(ShardProc):
+  """Processor distributing tests between shards by their recorded durations.
+  Tests with a known duration are bin-packed, so that all shards take about
+  the same time. Unknown tests fall back to hashing like in ShardProc.
+  """
+  def __init__(self, myid, shards_count, durations):
+    """
+    Args:
+      myid: id of the shard within [0; shards_count - 1]
+      shards_count: number of shards
+      durations: dict from duration_key to duration in seconds
+    """
+    super(DurationShardProc, self).__init__(myid, shards_count)
+    self._assignment = bin_pack(durations, shards_count)
+
+  def _filter(self, test):
+    shard = self._assignment.get(duration_key(test))
+    if shard is None:
+      return super(DurationShardProc, self)._filter(test)
+    return self._myid != shard
@@ -13,7 +13,8 @@ TOOLS_PATH = os.path.dirname(os.path.dirname(os.path.dirname(
     os.path.abspath(__file__))))
 sys.path.append(TOOLS_PATH)
 
-from testrunner.testproc.shard import radix_hash
+from testrunner.testproc.filter import NameFilterProc
+from testrunner.testproc.shard import bin_pack, radix_hash, select_durations
 
 
 class TestRadixHashing(unittest.TestCase):
@@ -50,5 +51,54 @@ class TestRadixHashing(unittest.TestCase):
       self.assertTrue(0 <= radix_hash(capacity=7, key=case) < 7)
 
 
+class TestBinPacking(unittest.TestCase):
+  def test_longest_first(self):
+    durations = {'a': 1, 'b': 5, 'c': 2, 'd': 2}
+    self.assertEqual(
+        {'b': 0, 'c': 1, 'd': 1, 'a': 1},
+        bin_pack(durations, shards_count=2))
+
+  def test_balanced(self):
+    durations = dict(('test%d' % i, (i * 37) % 11 + 1) for i in range(100))
+    assignment = bin_pack(durations, shards_count=7)
+    loads = [0] * 7
+    for key, shard in assignment.items():
+      loads[shard] += durations[key]
+    self.assertEqual(set(durations.keys()), set(assignment.keys()))
+    self.assertLessEqual(max(loads) - min(loads), max(durations.values()))
+
+  def test_deterministic_ties(self):
+    durations = dict(('test%d' % i, 1) for i in range(10))
+    self.assertEqual(
+        bin_pack(durations, shards_count=3),
+        bin_pack(dict(reversed(list(durations.items()))), shards_count=3))
+
+
+class TestSelectDurations(unittest.TestCase):
+  durations = {
+    'sweet/bananas:default': 1,
+    'sweet/bananas:stress': 2,
+    'sweet/apples:default': 3,
+    'sour/lemons:default': 4,
+  }
+
+  def test_all(self):
+    self.assertEqual(self.durations, select_durations(self.durations))
+
+  def test_name_filter(self):
+    self.assertEqual(
+        {'sweet/bananas:default': 1, 'sweet/bananas:stress': 2},
+        select_durations(self.durations, NameFilterProc(['sweet/ban*'])))
+    self.assertEqual(
+        {'sour/lemons:default': 4},
+        select_durations(self.durations, NameFilterProc(['sour'])))
+
+  def test_variants(self):
+    self.assertEqual(
+        {'sweet/bananas:stress': 2},
+        select_durations(self.durations, NameFilterProc(['sweet/bananas']),
+                         ['stress']))
+
+
 if __name__ == '__main__':
   unittest.main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# Copyright 2020 the V8 project authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""
+Throughput benchmark for dispatching tests from ExecutionProc to the worker
+processes.
+
+Runs synthetic tests, whose commands return immediately or after a fixed
+delay, through the real processor chain and worker pool, once with one job per
+queue message as before batching and once with adaptive batching, and prints
+the dispatch overhead per test.
+"""
+
+# for py2/py3 compatibility
+from __future__ import print_function
+
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+# Needed because the test runner contains relative imports.
+TOOLS_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(TOOLS_PATH)
+
+from testrunner.objects.output import Output
+from testrunner.outproc import base as outproc
+from testrunner.testproc.execution import ExecutionProc, MAX_BATCH_SIZE
+from testrunner.testproc.loader import LoadProc
+from testrunner.testproc.progress import ResultsTracker
+
+
+class FakeCommand(object):
+  def __init__(self, args, duration):
+    self.args = args
+    self.duration = duration
+
+  def execute(self):
+    if self.duration:
+      time.sleep(self.duration)
+    return Output(0, False, '', '', None, self.duration)
+
+
+class FakeTest(object):
+  def __init__(self, index, duration):
+    self.procid = 'fake/test-%d' % index
+    self.keep_output = False
+    self.output_proc = outproc.DEFAULT
+    self._duration = duration
+
+  def get_command(self):
+    # Roughly the size of a mjsunit command line.
+    args = ['--random-seed=123', '--test', '--no-arguments'] + [
+        '/path/to/v8/test/mjsunit/%s-%d.js' % (name, i)
+        for i, name in enumerate(['mjsunit', 'helper', self.procid])]
+    return FakeCommand(args, self._duration)
+
+
+def measure(label, tests, jobs, duration, max_batch_size):
+  loader = LoadProc(iter([FakeTest(i, duration) for i in range(tests)]))
+  results = ResultsTracker(max_failures=0)
+  execproc = ExecutionProc(jobs, max_batch_size=max_batch_size)
+  procs = [loader, results, execproc]
+  for i in range(0, len(procs) - 1):
+    procs[i].connect_to(procs[i + 1])
+  procs[0].setup()
+
+  start = time.time()
+  loader.load_initial_tests(initial_batch_size=jobs * 2 * max_batch_size)
+  execproc.run()
+  elapsed = time.time() - start
+
+  assert results.total == tests and results.remaining == 0
+  # Time per test beyond the work the workers do in parallel.
+  overhead = elapsed / tests - duration / jobs
+  print('%-10s %6d tests in %7.3fs: %8.0f tests/s, %7.1fus overhead/test' % (
+      label, tests, elapsed, tests / max(elapsed, 1e-9), overhead * 1e6))
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument('--tests', type=int, default=20000)
+  parser.add_argument('-j', type=int, default=multiprocessing.cpu_count())
+  parser.add_argument('--test-duration', type=float, default=0,
+                      help='seconds each synthetic test takes')
+  options = parser.parse_args()
+
+  measure('unbatched', options.tests, options.j, options.test_duration, 1)
+  measure('batched', options.tests, options.j, options.test_duration,
+          MAX_BATCH_SIZE)
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# Copyright 2020 the V8 project authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""
+Micro-benchmark for code object lookups in ll_prof.py.
+
+Generates a synthetic low-level code log with many code objects and moving
+GCs, replays it into ll_prof's CodeMap and measures tick attribution, and
+compares both against the previous map that bucketed code objects into 1M
+pages and scanned each page linearly.
+"""
+
+# for py2/py3 compatibility
+from __future__ import print_function
+
+import argparse
+import ctypes
+import os
+import random
+import sys
+import tempfile
+import time
+
+# Needed because ll_prof imports sibling modules.
+TOOLS_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(TOOLS_PATH)
+
+import ll_prof
+
+
+class PagedCodeMap(object):
+  """The code map before code objects were indexed by start address."""
+
+  SHIFT = 20
+
+  def __init__(self):
+    self.pages = {}
+    self.min_address = 1 << 64
+    self.max_address = -1
+
+  def _PageIds(self, code):
+    return range(code.start_address >> PagedCodeMap.SHIFT,
+                 (code.end_address + (1 << PagedCodeMap.SHIFT) - 1) >>
+                 PagedCodeMap.SHIFT)
+
+  def Add(self, code, max_pages=-1):
+    for page_id in self._PageIds(code):
+      self.pages.setdefault(page_id, []).append(code)
+    self.min_address = min(self.min_address, code.start_address)
+    self.max_address = max(self.max_address, code.end_address)
+
+  def Remove(self, code):
+    removed = False
+    for page_id in self._PageIds(code):
+      if page_id in self.pages:
+        self.pages[page_id].remove(code)
+        removed = True
+    return removed
+
+  def Find(self, pc):
+    if pc < self.min_address or pc >= self.max_address:
+      return None
+    code_objects = self.pages.get(pc >> PagedCodeMap.SHIFT)
+    if code_objects is None:
+      return None
+    for i, code in enumerate(code_objects):
+      if code.start_address <= pc < code.end_address:
+        code_objects[0], code_objects[i] = code, code_objects[0]
+        return code
+    return None
+
+
+def generate(rnd, path, code_objects, moves, gcs):
+  create_struct = ll_prof.LogReader._DefineStruct([
+      ("name_size", ctypes.c_int32),
+      ("code_address", ctypes.c_uint64),
+      ("code_size", ctypes.c_int32)])
+  move_struct = ll_prof.LogReader._DefineStruct([
+      ("from_address", ctypes.c_uint64),
+      ("to_address", ctypes.c_uint64)])
+  # Code objects, including moved ones, are laid out without overlaps.
+  base = 0x100000000
+  next_address = base
+  addresses = []
+  with open(path, 'wb') as log:
+    log.write(b'x64\0')
+    per_gc = code_objects // (gcs + 1)
+    for i in range(code_objects):
+      size = rnd.randint(16, 512)
+      name = ('LazyCompile:*f%d' % i).encode('ascii')
+      log.write(b'C')
+      log.write(bytes(bytearray(create_struct(len(name), next_address, size))))
+      log.write(name)
+      log.write(b'\xcc' * size)
+      addresses.append((next_address, size))
+      next_address += size + rnd.randint(0, 64)
+      if per_gc and i % per_gc == per_gc - 1:
+        for _ in range(moves // (gcs + 1)):
+          index = rnd.randrange(len(addresses))
+          old_address, size = addresses[index]
+          new_address = next_address
+          next_address += size
+          log.write(b'M')
+          log.write(bytes(bytearray(move_struct(old_address, new_address))))
+          addresses[index] = (new_address, size)
+        log.write(b'G')
+  return base, next_address
+
+
+def replay(label, code_map, path):
+  ll_prof.Code._id = 0
+  start = time.time()
+  reader = ll_prof.LogReader(path, code_map)
+  batches = 0
+  while reader.log_pos < reader.log.size():
+    reader.ReadUpToGC()
+    batches += 1
+  reader.Dispose()
+  print('%-10s %8d GC batches read in %7.3fs' % (
+      label, batches, time.time() - start))
+  return code_map
+
+
+def measure(label, code_map, pcs):
+  start = time.time()
+  found = [code_map.Find(pc) for pc in pcs]
+  elapsed = time.time() - start
+  print('%-10s %8d lookups in %7.3fs: %10.0f lookups/s' % (
+      label, len(pcs), elapsed, len(pcs) / max(elapsed, 1e-9)))
+  return [code.id if code else None for code in found]
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument('--code-objects', type=int, default=20000)
+  parser.add_argument('--moves', type=int, default=5000)
+  parser.add_argument('--gcs', type=int, default=20)
+  parser.add_argument('--ticks', type=int, default=20000)
+  parser.add_argument('--seed', type=int, default=42)
+  options = parser.parse_args()
+
+  rnd = random.Random(options.seed)
+  fd, path = tempfile.mkstemp(suffix='.ll')
+  os.close(fd)
+  try:
+    low, high = generate(
+        rnd, path, options.code_objects, options.moves, options.gcs)
+    paged = replay('paged', PagedCodeMap(), path)
+    indexed = replay('indexed', ll_prof.CodeMap(), path)
+  finally:
+    os.remove(path)
+
+  pcs = [rnd.randrange(low, high) for _ in range(options.ticks)]
+  expected = measure('paged', paged, pcs)
+  actual = measure('indexed', indexed, pcs)
+  assert expected == actual
+
+
+if __name__ == '__main__':
+  sys.exit(main())
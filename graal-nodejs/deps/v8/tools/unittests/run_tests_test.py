@@ -213,6 +213,139 @@ class SystemTest(unittest.TestCase):
             'sweet/blackberries stress: FAIL', result.stdout, result)
           self.assertEqual(1, result.returncode, result)
 
+  def testShardedProcByDurations(self):
+    """Test balancing shards with recorded test durations."""
+    with temp_base() as basedir:
+      durations = os.path.join(basedir, 'durations.json')
+      with open(durations, 'w') as f:
+        json.dump({
+          'sweet/blackberries:default': 10,
+          'sweet/blackberries:stress': 1,
+          'sweet/raspberries:default': 1,
+          'sweet/raspberries:stress': 8,
+        }, f)
+      for shard in [1, 2]:
+        result = run_tests(
+            basedir,
+            '--mode=Release',
+            '--progress=verbose',
+            '--variants=default,stress',
+            '--shard-count=2',
+            '--shard-run=%d' % shard,
+            '--shard-durations=%s' % durations,
+            'sweet/blackberries',
+            'sweet/raspberries',
+            infra_staging=False,
+        )
+        # The slowest test gets a shard on its own, the others share the
+        # second shard.
+        if shard == 1:
+          self.assertIn('1 tests ran', result.stdout, result)
+          self.assertIn(
+            'sweet/blackberries default: FAIL', result.stdout, result)
+        else:
+          self.assertIn('3 tests ran', result.stdout, result)
+          self.assertIn(
+            'sweet/blackberries stress: FAIL', result.stdout, result)
+          self.assertIn(
+            'Done running sweet/raspberries default', result.stdout, result)
+          self.assertIn(
+            'Done running sweet/raspberries stress', result.stdout, result)
+
+  def testTestDurations(self):
+    """Test recording durations for balancing shards."""
+    with temp_base() as basedir:
+      durations = os.path.join(basedir, 'durations.json')
+      result = run_tests(
+          basedir,
+          '--mode=Release',
+          '--progress=verbose',
+          '--variants=default,stress',
+          '--test-durations=%s' % durations,
+          'sweet/raspberries',
+          infra_staging=False,
+      )
+      self.assertEqual(0, result.returncode, result)
+      with open(durations) as f:
+        self.assertEqual(
+            ['sweet/raspberries:default', 'sweet/raspberries:stress'],
+            sorted(json.load(f).keys()))
+
+  def testResultCache(self):
+    """Test skipping tests that passed in an earlier run."""
+    with temp_base() as basedir:
+      cache = os.path.join(basedir, 'result_cache')
+      def run():
+        return run_tests(
+            basedir,
+            '--mode=Release',
+            '--progress=verbose',
+            '--variants=default',
+            '--result-cache=%s' % cache,
+            'sweet/bananas',
+            'sweet/blackberries',
+            'sweet/raspberries',
+            infra_staging=False,
+        )
+
+      result = run()
+      self.assertIn('0 of them passed in an earlier run', result.stdout, result)
+      self.assertIn('sweet/bananas default: pass\n', result.stdout, result)
+
+      # Only the passing test is cached. Expected and unexpected failures run
+      # again.
+      result = run()
+      self.assertIn('3 tests ran', result.stdout, result)
+      self.assertIn('1 of them passed in an earlier run', result.stdout, result)
+      self.assertIn(
+          'sweet/bananas default: pass (cached)', result.stdout, result)
+      self.assertIn('sweet/raspberries default: pass\n', result.stdout, result)
+      self.assertIn('sweet/blackberries default: FAIL', result.stdout, result)
+      self.assertEqual(1, result.returncode, result)
+
+      # A changed shell invalidates the cache.
+      with open(os.path.join(basedir, 'out', 'Release', 'd8_mocked.py'),
+                'a') as f:
+        f.write('\n')
+      result = run()
+      self.assertIn('0 of them passed in an earlier run', result.stdout, result)
+
+  def testResultCacheHarnessFiles(self):
+    """Test that changed files on the command line invalidate cached passes."""
+    with temp_base() as basedir:
+      cache = os.path.join(basedir, 'result_cache')
+      harness = os.path.join(basedir, 'test', 'sweet', 'harness.js')
+      def run():
+        return run_tests(
+            basedir,
+            '--mode=Release',
+            '--progress=verbose',
+            '--variants=default',
+            '--result-cache=%s' % cache,
+            'sweet/bananas',
+            infra_staging=False,
+        )
+
+      with open(harness, 'w') as f:
+        f.write('// harness\n')
+      run()
+      result = run()
+      self.assertIn(
+          'sweet/bananas default: pass (cached)', result.stdout, result)
+
+      with open(harness, 'a') as f:
+        f.write('// changed\n')
+      result = run()
+      self.assertIn('0 of them passed in an earlier run', result.stdout, result)
+      self.assertIn('sweet/bananas default: pass\n', result.stdout, result)
+
+      # Libraries and blobs next to the shell are part of the key as well.
+      with open(os.path.join(basedir, 'out', 'Release', 'snapshot_blob.bin'),
+                'w') as f:
+        f.write('blob')
+      result = run()
+      self.assertIn('0 of them passed in an earlier run', result.stdout, result)
+
   @unittest.skip("incompatible with test processors")
   def testSharded(self):
     """Test running a particular shard."""
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# Copyright 2020 the V8 project authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""
+Micro-benchmark for outcome lookups in status files.
+
+Generates a large synthetic status file and measures the throughput of
+StatusFile.get_outcomes for all tests in all variants, compared to the
+previous linear scan over all prefix rules.
+"""
+
+# for py2/py3 compatibility
+from __future__ import print_function
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+# Needed because the test runner contains relative imports.
+TOOLS_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(TOOLS_PATH)
+
+from testrunner.local import statusfile
+from testrunner.local.variants import ALL_VARIANTS
+
+
+def random_name(rnd, depth):
+  return '/'.join(
+      'dir%d' % rnd.randint(0, 20) for _ in range(depth - 1)) + (
+      '/test-%d' % rnd.randint(0, 100000))
+
+
+def generate(rnd, tests, exact_rules, prefix_rules):
+  names = [random_name(rnd, rnd.randint(1, 4)) for _ in range(tests)]
+  variants = sorted(ALL_VARIANTS)
+  sections = []
+  for section in range(4):
+    rules = {}
+    for _ in range(exact_rules // 4):
+      rules[rnd.choice(names)] = ['FAIL', 'SLOW']
+    for _ in range(prefix_rules // 4):
+      name = rnd.choice(names)
+      rules[name[:rnd.randint(1, len(name))] + '*'] = ['PASS', 'SLOW']
+    if section % 2:
+      condition = 'variant == %s' % rnd.choice(variants)
+    else:
+      condition = 'ALWAYS'
+    sections.append('[%r, %r],' % (condition, rules))
+  return names, '[\n%s\n]\n' % '\n'.join(sections)
+
+
+def linear_get_outcomes(status_file, testname, variant=None):
+  """The lookup before prefix rules were indexed in a trie."""
+  outcomes = frozenset()
+  for key in set([variant or '', '']):
+    rules = status_file._rules.get(key, {})
+    prefix_rules = status_file._prefix_rules.get(key, {})
+    if testname in rules:
+      outcomes |= rules[testname]
+    for prefix in prefix_rules:
+      if testname.startswith(prefix):
+        outcomes |= prefix_rules[prefix]
+  return outcomes
+
+
+def measure(label, lookup, names, variants):
+  start = time.time()
+  for name in names:
+    for variant in variants:
+      lookup(name, variant)
+  elapsed = time.time() - start
+  count = len(names) * len(variants)
+  print('%-10s %8d lookups in %7.3fs: %10.0f lookups/s' % (
+      label, count, elapsed, count / max(elapsed, 1e-9)))
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument('--tests', type=int, default=20000)
+  parser.add_argument('--exact-rules', type=int, default=4000)
+  parser.add_argument('--prefix-rules', type=int, default=2000)
+  parser.add_argument('--seed', type=int, default=42)
+  options = parser.parse_args()
+
+  rnd = random.Random(options.seed)
+  names, content = generate(
+      rnd, options.tests, options.exact_rules, options.prefix_rules)
+  fd, path = tempfile.mkstemp(suffix='.status')
+  try:
+    with os.fdopen(fd, 'w') as f:
+      f.write(content)
+    status_file = statusfile.StatusFile(path, {})
+  finally:
+    os.remove(path)
+
+  variants = [None] + sorted(ALL_VARIANTS)[:4]
+  for name in names[:1000]:
+    for variant in variants:
+      assert (status_file.get_outcomes(name, variant) ==
+              linear_get_outcomes(status_file, name, variant))
+  status_file._outcomes_cache.clear()
+
+  measure('linear', lambda name, variant: linear_get_outcomes(
+      status_file, name, variant), names, variants)
+  measure('trie', status_file.get_outcomes, names, variants)
+  measure('cached', status_file.get_outcomes, names, variants)
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -6,6 +6,8 @@
 Dummy test suite extension with some fruity tests.
 """
 
+import os
+
 from testrunner.local import testsuite
 from testrunner.objects import testcase
 
@@ -30,6 +32,9 @@ class TestCase(testcase.D8TestCase):
     return 'd8_mocked.py'
 
   def _get_files_params(self):
+    harness = os.path.join(self.suite.root, 'harness.js')
+    if os.path.exists(harness):
+      return [harness, self.name]
     return [self.name]
 
 def GetSuite(*args, **kwargs):
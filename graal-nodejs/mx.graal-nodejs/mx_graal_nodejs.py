@@ -26,7 +26,7 @@
 #
 # ----------------------------------------------------------------------------------------------------
 
-import mx, mx_gate, mx_subst, mx_sdk, mx_sdk_vm, mx_graal_js, os, tarfile, tempfile, subprocess, sys
+import mx, mx_gate, mx_subst, mx_sdk, mx_sdk_vm, mx_graal_js, os, tarfile, tempfile, subprocess, sys, hashlib, json, threading
 
 import mx_graal_nodejs_benchmark
 
@@ -251,7 +251,7 @@ class PreparsedCoreModulesProject(mx.ArchivableProject):
         super(PreparsedCoreModulesProject, self).__init__(suite, name, deps, workingSets, theLicense)
 
     def getBuildTask(self, args):
-        return PreparsedCoreModulesBuildTask(self, args, 1)
+        return PreparsedCoreModulesBuildTask(self, args, mx.cpu_count())
 
     def output_dir(self):
         return self.outputDir
@@ -320,6 +320,70 @@ class PreparsedCoreModulesBuildTask(mx.ArchivableBuildTask):
 
         return set(allModules).difference(set(brokenModules))
 
+    # Minimal number of modules snapshotted by one JVM, so that the JVM startup does not dominate.
+    minModulesPerSnapshotJvm = 8
+
+    def _hashes_file(self):
+        return join(self.subject.output_dir(), 'coremodules-hashes.json')
+
+    # Key of the tool hash in the hashes file, next to the module names.
+    toolHashKey = '<tools>'
+
+    def _tool_hash(self, snapshotToolDistribution, macroFiles):
+        """Changes whenever the snapshot tool, its dependencies, the module expansion or the macros change."""
+        h = hashlib.sha1()
+        with open(join(_suite.dir, 'tools', 'expand-js-modules.py'), 'rb') as f:
+            h.update(f.read())
+        for macroFile in macroFiles:
+            with open(join(_suite.dir, macroFile), 'rb') as f:
+                h.update('{}:{}\n'.format(macroFile.replace(os.sep, '/'), hashlib.sha1(f.read()).hexdigest()).encode('utf-8'))
+        for entry in mx.classpath([snapshotToolDistribution]).split(pathsep):
+            if exists(entry):
+                h.update('{}:{}:{}\n'.format(entry, os.path.getmtime(entry), os.path.getsize(entry)).encode('utf-8'))
+        return h.hexdigest()
+
+    def _module_hashes(self, moduleSet, toolHash):
+        hashes = {}
+        for m in moduleSet:
+            with open(join(_suite.dir, 'lib', m), 'rb') as f:
+                hashes[m] = hashlib.sha1(toolHash.encode('utf-8') + f.read()).hexdigest()
+        return hashes
+
+    def _load_hashes(self):
+        try:
+            with open(self._hashes_file(), 'r') as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def _save_hashes(self, hashes):
+        with open(self._hashes_file(), 'w') as f:
+            json.dump(hashes, f, indent=0, sort_keys=True)
+
+    def _snapshot_in_parallel(self, snapshotToolDistribution, modules, outputDirBin):
+        """Runs the snapshot tool over batches of modules in concurrent JVMs."""
+        batchCount = max(1, min(self.parallelism, len(modules) // self.minModulesPerSnapshotJvm))
+        # Deal the modules out largest first, so that batches get similar amounts of code.
+        bySize = sorted(modules, key=lambda m: (-os.path.getsize(join(outputDirBin, m)), m))
+        batches = [bySize[i::batchCount] for i in range(batchCount)]
+        results = [None] * batchCount
+
+        def snapshot(i):
+            results[i] = mx.run_java(['-cp', mx.classpath([snapshotToolDistribution]),
+                    mx.distribution(snapshotToolDistribution).mainClass,
+                    '--binary', '--wrapped', '--outdir=' + outputDirBin, '--indir=' + outputDirBin] + ['--file=' + m for m in batches[i]],
+                    cwd=outputDirBin, nonZeroIsFatal=False)
+
+        threads = [threading.Thread(target=snapshot, args=(i,)) for i in range(1, batchCount)]
+        for t in threads:
+            t.start()
+        snapshot(0)
+        for t in threads:
+            t.join()
+        failed = [i for i, rc in enumerate(results) if rc != 0]
+        if failed:
+            mx.abort('Snapshotting core modules failed for: {}'.format(', '.join(sorted(m for i in failed for m in batches[i]))))
+
     def build(self):
         outputDir = self.subject.output_dir()
         snapshotToolDistribution = 'graal-js:TRUFFLE_JS_SNAPSHOT_TOOL'
@@ -335,14 +399,28 @@ class PreparsedCoreModulesBuildTask(mx.ArchivableBuildTask):
         if not _is_windows:
             macroFiles.append(join('tools', 'js2c_macros', 'notrace_macros.py'))
 
-        mx.run(python_cmd() + [join('tools', 'expand-js-modules.py'), outputDir] + [join('lib', m) for m in moduleSet] + macroFiles,
-               cwd=_suite.dir)
-        if not (hasattr(self.args, "jdt") and self.args.jdt and not self.args.force_javac):
-            mx.run_java(['-cp', mx.classpath([snapshotToolDistribution]),
-                    mx.distribution(snapshotToolDistribution).mainClass,
-                    '--binary', '--wrapped', '--outdir=' + outputDirBin, '--indir=' + outputDirBin] + ['--file=' + m for m in moduleSet],
-                    cwd=outputDirBin)
-        mx.run(python_cmd() + [join(_suite.dir, 'tools', 'snapshot2c.py'), 'node_snapshots.h'] + [join('lib', m + '.bin') for m in moduleSet],
+        # Only modules whose source, or the tools processing it, changed since the last build are
+        # expanded and snapshotted again. The .bin files of the other modules are reused.
+        toolHash = self._tool_hash(snapshotToolDistribution, macroFiles)
+        newHashes = self._module_hashes(moduleSet, toolHash)
+        newHashes[self.toolHashKey] = toolHash
+        oldHashes = self._load_hashes()
+        staleModules = sorted(m for m in moduleSet if oldHashes.get(m) != newHashes[m] or not exists(join(outputDirBin, m + '.bin')))
+        if oldHashes and oldHashes.get(self.toolHashKey) != toolHash:
+            # Every module hash includes the tool hash, so all modules must be stale.
+            mx.logv('Snapshot tools or macros changed, snapshotting all core modules')
+            stillFresh = sorted(set(moduleSet).difference(staleModules))
+            if stillFresh:
+                mx.abort('Core modules not invalidated by the tool change: {}'.format(', '.join(stillFresh)))
+        mx.logv('{} of {} core modules need to be snapshotted'.format(len(staleModules), len(moduleSet)))
+
+        if staleModules:
+            mx.run(python_cmd() + [join('tools', 'expand-js-modules.py'), outputDir] + [join('lib', m) for m in staleModules] + macroFiles,
+                   cwd=_suite.dir)
+            if not (hasattr(self.args, "jdt") and self.args.jdt and not self.args.force_javac):
+                self._snapshot_in_parallel(snapshotToolDistribution, staleModules, outputDirBin)
+            self._save_hashes(newHashes)
+        mx.run(python_cmd() + [join(_suite.dir, 'tools', 'snapshot2c.py'), '-j', str(self.parallelism), 'node_snapshots.h'] + [join('lib', m + '.bin') for m in sorted(moduleSet)],
                cwd=outputDir)
 
     def clean(self, forBuild=False):
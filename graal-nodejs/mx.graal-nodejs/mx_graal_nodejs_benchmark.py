@@ -26,8 +26,19 @@
 #
 # ----------------------------------------------------------------------------------------------------
 
+import argparse
+import csv
+import os
+import re
+from os.path import join, isdir
+
 import mx, mx_benchmark, mx_graal_nodejs
 from mx_benchmark import GuestVm
+from mx_benchmark import add_bm_suite
+
+_suite = mx.suite('graal-nodejs')
+
+nodejs_vm_registry = mx_benchmark.VmRegistry('Node.js', 'nodejs-vm', known_host_registries=[mx_benchmark.java_vm_registry])
 
 class GraalNodeJsVm(GuestVm):
     def __init__(self, config_name, options, host_vm=None):
@@ -64,5 +75,123 @@ class GraalNodeJsVm(GuestVm):
 def register_nodejs_vms():
     if mx.suite('nodejs-benchmarks', fatalIfMissing=False):
         import mx_nodejs_benchmarks
-        _suite = mx.suite('graal-nodejs')
         mx_nodejs_benchmarks.add_vm(GraalNodeJsVm('default', []), _suite, 10)
+    nodejs_vm_registry.add_vm(GraalNodeJsVm('default', []), _suite, 10)
+
+
+class RunJsCsvRule(mx_benchmark.Rule):
+    """Turns the CSV rows printed by `benchmark/run.js --format csv` into datapoints.
+
+    Every configuration of a benchmark file reports once per iteration. run.js and
+    common.js fork a new process for every file and configuration, so each report
+    comes from a cold VM; there is no warmup to tell apart.
+    """
+    def __init__(self, benchmarks):
+        self.benchmarks = benchmarks
+
+    def parse(self, text):
+        datapoints = []
+        iterations = {}
+        rows = [line for line in text.splitlines() if line.startswith('"')]
+        for row in csv.reader(rows, skipinitialspace=True):
+            if len(row) != 4 or row[0] == 'filename':
+                continue
+            name, config, rate = row[0], row[1], float(row[2])
+            if self.benchmarks is not None and name not in self.benchmarks:
+                # also matched by the --filter of another benchmark
+                continue
+            iteration = iterations.get((name, config), 0)
+            iterations[(name, config)] = iteration + 1
+            datapoints.append({
+                "benchmark": name,
+                "extra.nodejs.config": config,
+                "metric.name": "throughput",
+                "metric.value": rate,
+                "metric.unit": "op/s",
+                "metric.type": "numeric",
+                "metric.score-function": "id",
+                "metric.better": "higher",
+                "metric.iteration": iteration,
+            })
+        return datapoints
+
+
+class NodeCoreBenchmarkSuite(mx_benchmark.VmBenchmarkSuite):
+    """The Node.js core benchmarks in graal-nodejs/benchmark, run with run.js.
+
+    The benchmarks are the benchmark files, e.g. `buffers/buffer-compare.js`.
+    Run arguments select the categories (`--category buffers`, repeatable) and
+    the number of `--iterations`; all other run arguments (e.g. `--set n=1000`,
+    `test`) are passed to run.js. Every iteration runs in fresh processes, so the
+    results are cold-process throughput, one datapoint per iteration.
+    """
+    def name(self):
+        return 'nodejs-core'
+
+    def group(self):
+        return 'Graal'
+
+    def subgroup(self):
+        return 'graal-js'
+
+    def get_vm_registry(self):
+        return nodejs_vm_registry
+
+    def benchmarkDir(self):
+        return join(_suite.dir, 'benchmark')
+
+    def workingDirectory(self, benchmarks, bmSuiteArgs):
+        return self.benchmarkDir()
+
+    def parseRunArgs(self, bmSuiteArgs):
+        parser = argparse.ArgumentParser(prog='mx benchmark {}'.format(self.name()), add_help=False)
+        parser.add_argument('--category', action='append', dest='categories', default=None)
+        parser.add_argument('--iterations', type=int, default=1)
+        return parser.parse_known_args(self.runArgs(bmSuiteArgs))
+
+    def categories(self, options):
+        # the same directories as in benchmark/_cli.js
+        categories = sorted(name for name in os.listdir(self.benchmarkDir())
+                            if name != 'fixtures' and isdir(join(self.benchmarkDir(), name)))
+        if options.categories is None:
+            return categories
+        for category in options.categories:
+            if category not in categories:
+                mx.abort("Unknown benchmark category '{}', expected one of: {}".format(category, ', '.join(categories)))
+        return options.categories
+
+    def benchmarkList(self, bmSuiteArgs):
+        options, _ = self.parseRunArgs(bmSuiteArgs)
+        return [join(category, script)
+                for category in self.categories(options)
+                for script in sorted(os.listdir(join(self.benchmarkDir(), category)))
+                if not script.startswith(('.', '_'))]
+
+    def createCommandLineArgs(self, benchmarks, bmSuiteArgs):
+        options, runJsArgs = self.parseRunArgs(bmSuiteArgs)
+        if options.iterations < 1:
+            mx.abort('Expected --iterations >= 1')
+        args = self.vmArgs(bmSuiteArgs) + ['run.js', '--format', 'csv']
+        if benchmarks is None:
+            categories = self.categories(options)
+        else:
+            categories = []
+            for benchmark in benchmarks:
+                category, script = os.path.split(benchmark)
+                if category not in categories:
+                    categories.append(category)
+                args += ['--filter', script]
+        # run.js runs a category once per occurrence, one iteration each
+        return args + runJsArgs + ['--'] + categories * options.iterations
+
+    def successPatterns(self):
+        return [re.compile(r'^"filename", "configuration", "rate", "time"$', re.MULTILINE)]
+
+    def failurePatterns(self):
+        return []
+
+    def rules(self, out, benchmarks, bmSuiteArgs):
+        return [RunJsCsvRule(benchmarks)]
+
+
+add_bm_suite(NodeCoreBenchmarkSuite())
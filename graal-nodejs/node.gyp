@@ -28,6 +28,8 @@
     'node_lib_target_name%': 'libnode',
     'node_intermediate_lib_type%': 'static_library',
     'node_builtin_modules_path%': '',
+    # How tools/js2c.py embeds the core modules: arrays, blob or compressed.
+    'node_js2c_mode%': 'arrays',
     'library_files': [
       'lib/internal/bootstrap/environment.js',
       'lib/internal/bootstrap/loaders.js',
@@ -976,6 +978,7 @@
           'action': [
             'python', '<@(_inputs)',
             '--target', '<@(_outputs)',
+            '--mode', '<(node_js2c_mode)',
           ],
         },
       ],
@@ -58,22 +58,46 @@ class NonOwningExternalTwoByteResource
 // via ToStringChecked. The data pointers are owned by the caller.
 class UnionBytes {
  public:
+  // Returns the code units of the lazily materialized source with the given
+  // index. The returned data must stay alive for the rest of the process.
+  using InflateCallback = const void* (*)(size_t index);
+
   UnionBytes(const uint16_t* data, size_t length)
       : one_bytes_(nullptr), two_bytes_(data), length_(length) {}
   UnionBytes(const uint8_t* data, size_t length)
       : one_bytes_(data), two_bytes_(nullptr), length_(length) {}
+  // Data that is stored compressed and only inflated on first use,
+  // see the `compressed` mode of tools/js2c.py.
+  UnionBytes(InflateCallback inflate, size_t index, bool one_byte,
+             size_t length)
+      : one_bytes_(nullptr),
+        two_bytes_(nullptr),
+        length_(length),
+        inflate_(inflate),
+        index_(index),
+        lazy_one_byte_(one_byte) {}
 
   UnionBytes(const UnionBytes&) = default;
   UnionBytes& operator=(const UnionBytes&) = default;
   UnionBytes(UnionBytes&&) = default;
   UnionBytes& operator=(UnionBytes&&) = default;
 
-  bool is_one_byte() const { return one_bytes_ != nullptr; }
+  bool is_one_byte() const {
+    return inflate_ != nullptr ? lazy_one_byte_ : one_bytes_ != nullptr;
+  }
   const uint16_t* two_bytes_data() const {
+    if (inflate_ != nullptr) {
+      CHECK(!lazy_one_byte_);
+      return static_cast<const uint16_t*>(inflate_(index_));
+    }
     CHECK_NOT_NULL(two_bytes_);
     return two_bytes_;
   }
   const uint8_t* one_bytes_data() const {
+    if (inflate_ != nullptr) {
+      CHECK(lazy_one_byte_);
+      return static_cast<const uint8_t*>(inflate_(index_));
+    }
     CHECK_NOT_NULL(one_bytes_);
     return one_bytes_;
   }
@@ -94,6 +118,9 @@ class UnionBytes {
   const uint8_t* one_bytes_;
   const uint16_t* two_bytes_;
   size_t length_;
+  InflateCallback inflate_ = nullptr;
+  size_t index_ = 0;
+  bool lazy_one_byte_ = false;
 };
 
 }  // namespace node
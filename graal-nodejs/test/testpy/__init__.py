@@ -92,6 +92,14 @@ class SimpleTestCase(test.TestCase):
   def GetSource(self):
     return open(self.file).read()
 
+  def CanReuseVm(self):
+    # Flags apply to the whole process and sequential tests rely on having
+    # the machine to themselves, so only run other tests in a shared VM.
+    if not self.parallel or self.disable_core_files:
+      return False
+    source = open(self.file, encoding='utf8').read()
+    return not FLAGS_PATTERN.search(source)
+
 
 class SimpleTestConfiguration(test.TestConfiguration):
   def __init__(self, context, root, section, additional=None):
@@ -136,7 +136,8 @@ def Load(build_files, format, default_variables={},
   result = gyp.input.Load(build_files, default_variables, includes[:],
                           depth, generator_input_info, check, circular_check,
                           duplicate_basename_check,
-                          params['parallel'], params['root_targets'])
+                          params['parallel'], params['root_targets'],
+                          params.get('cache_dir'))
   return [generator] + result
 
 def NameValueListToDict(name_value_list):
@@ -293,6 +294,13 @@ def gyp_main(args):
   parser = RegeneratableOptionParser(usage=usage.replace('%s', '%(prog)s'))
   parser.add_argument('--build', dest='configs', action='append',
                     help='configuration for build after project generation')
+  parser.add_argument('--cache-dir', dest='cache_dir', action='store',
+                    default=None, metavar='DIR', type='path',
+                    env_name='GYP_CACHE_DIR',
+                    help='cache parsed build files and the output of <!() '
+                    'commands in DIR across runs.  A command is rerun when '
+                    'its command line, directory, environment or the files '
+                    'named on its command line change.')
   parser.add_argument('--check', dest='check', action='store_true',
                     help='check format of gyp files')
   parser.add_argument('--config-dir', dest='config_dir', action='store',
@@ -408,6 +416,9 @@ def gyp_main(args):
     if g_o:
       options.generator_output = g_o
 
+  if not options.cache_dir and options.use_environment:
+    options.cache_dir = os.environ.get('GYP_CACHE_DIR') or None
+
   options.parallel = not options.no_parallel
 
   for mode in options.debug:
@@ -513,6 +524,7 @@ def gyp_main(args):
               'gyp_binary': sys.argv[0],
               'home_dot_gyp': home_dot_gyp,
               'parallel': options.parallel,
+              'cache_dir': options.cache_dir,
               'root_targets': options.root_targets,
               'target_arch': cmdline_default_variables.get('target_arch', '')}
 
@@ -1739,6 +1739,21 @@ def OpenOutput(path, mode='w'):
   return open(path, mode)
 
 
+def WriteOutputIfChanged(path, contents):
+  """Write |contents| to |path| unless it already holds them.
+
+  Leaving unchanged files alone keeps their mtimes, so ninja does not
+  consider the build files dirty after a no-op regeneration."""
+  try:
+    with open(path) as output_file:
+      if output_file.read() == contents:
+        return
+  except (IOError, OSError):
+    pass
+  with OpenOutput(path) as output_file:
+    output_file.write(contents)
+
+
 def CommandWithWrapper(cmd, wrappers, prog):
   wrapper = wrappers.get(cmd, '')
   if wrapper:
@@ -1856,8 +1871,51 @@ def _AddWinLinkRules(master_ninja, embed_manifest):
                     pool='link_pool')
 
 
+def TargetLevels(target_list, target_dicts):
+  """Group |target_list| into levels of targets that only depend on targets
+  of earlier levels.  Targets keep their relative order within a level."""
+  target_level = {}
+  levels = []
+  for qualified_target in target_list:
+    # target_list is in dependency order, so all dependencies in it have
+    # already been assigned a level.
+    level = 1 + max([target_level.get(dep, -1) for dep in
+                     target_dicts[qualified_target].get('dependencies', [])] +
+                    [-1])
+    target_level[qualified_target] = level
+    if level == len(levels):
+      levels.append([])
+    levels[level].append(qualified_target)
+  return levels
+
+
+def WriteTargetNinja(dependency_outputs, hash_for_rules, base_path, build_dir,
+                     toplevel_build, output_file, flavor, toplevel_dir, spec,
+                     config_name, generator_flags):
+  """Write the .ninja file contents for a single target.
+
+  Returns the contents, which are empty if the target has nothing to build,
+  and the Target object of the target, if any."""
+  ninja_output = StringIO()
+  writer = NinjaWriter(hash_for_rules, dependency_outputs, base_path, build_dir,
+                       ninja_output, toplevel_build, output_file, flavor,
+                       toplevel_dir=toplevel_dir)
+  target = writer.WriteSpec(spec, config_name, generator_flags)
+  ninja_contents = ninja_output.getvalue()
+  ninja_output.close()
+  return ninja_contents, target
+
+
+def CallWriteTargetNinja(arglist):
+  # Ignore the interrupt signal so that the parent process catches it and
+  # kills all multiprocessing children.
+  signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+  return WriteTargetNinja(*arglist)
+
+
 def GenerateOutputForConfig(target_list, target_dicts, data, params,
-                            config_name):
+                            config_name, pool=None):
   options = params['options']
   flavor = gyp.common.GetFlavor(params)
   generator_flags = params.get('generator_flags', {})
@@ -1869,7 +1927,7 @@ def GenerateOutputForConfig(target_list, target_dicts, data, params,
 
   toplevel_build = os.path.join(options.toplevel_dir, build_dir)
 
-  master_ninja_file = OpenOutput(os.path.join(toplevel_build, 'build.ninja'))
+  master_ninja_file = StringIO()
   master_ninja = ninja_syntax.Writer(master_ninja_file, width=120)
 
   # Put build-time support tools in out/{config_name}.
@@ -2366,6 +2424,9 @@ def GenerateOutputForConfig(target_list, target_dicts, data, params,
   # NOTE: there may be overlap between this an empty_target_names.
   non_empty_target_names = set()
 
+  # Arguments to WriteTargetNinja for each target, minus the outputs of its
+  # dependencies.
+  target_args = {}
   for qualified_target in target_list:
     # qualified_target is like: third_party/icu/icu.gyp:icui18n#target
     build_file, name, toolset = \
@@ -2397,19 +2458,39 @@ def GenerateOutputForConfig(target_list, target_dicts, data, params,
       obj += '.' + toolset
     output_file = os.path.join(obj, base_path, name + '.ninja')
 
-    ninja_output = StringIO()
-    writer = NinjaWriter(hash_for_rules, target_outputs, base_path, build_dir,
-                         ninja_output,
-                         toplevel_build, output_file,
-                         flavor, toplevel_dir=options.toplevel_dir)
+    target_args[qualified_target] = (
+        hash_for_rules, base_path, build_dir, toplevel_build, output_file,
+        flavor, options.toplevel_dir, spec, config_name, generator_flags)
+
+  # Write the targets.  A NinjaWriter only looks at the outputs of the direct
+  # dependencies of its target, so all targets of a dependency level can be
+  # written in parallel once the previous levels are done.
+  results = {}
+  for level in TargetLevels(target_list, target_dicts):
+    arglists = []
+    for qualified_target in level:
+      dependency_outputs = dict(
+          (dep, results[dep][1])
+          for dep in target_dicts[qualified_target].get('dependencies', [])
+          if dep in results and results[dep][1])
+      arglists.append((dependency_outputs,) + target_args[qualified_target])
+    if pool and len(arglists) > 1:
+      level_results = pool.map(CallWriteTargetNinja, arglists)
+    else:
+      level_results = [WriteTargetNinja(*arglist) for arglist in arglists]
+    results.update(zip(level, level_results))
 
-    target = writer.WriteSpec(spec, config_name, generator_flags)
+  # Hook the targets up in the master build.ninja in their original order.
+  for qualified_target in target_list:
+    _, name, _ = gyp.common.ParseQualifiedTarget(qualified_target)
+    spec = target_dicts[qualified_target]
+    output_file = target_args[qualified_target][4]
+    ninja_contents, target = results[qualified_target]
 
-    if ninja_output.tell() > 0:
+    if ninja_contents:
       # Only create files for ninja files that actually have contents.
-      with OpenOutput(os.path.join(toplevel_build, output_file)) as ninja_file:
-        ninja_file.write(ninja_output.getvalue())
-      ninja_output.close()
+      WriteOutputIfChanged(os.path.join(toplevel_build, output_file),
+                           ninja_contents)
       master_ninja.subninja(output_file)
 
     if target:
@@ -2447,6 +2528,8 @@ def GenerateOutputForConfig(target_list, target_dicts, data, params,
     master_ninja.build('all', 'phony', sorted(all_outputs))
     master_ninja.default(generator_flags.get('default_target', 'all'))
 
+  WriteOutputIfChanged(os.path.join(toplevel_build, 'build.ninja'),
+                       master_ninja_file.getvalue())
   master_ninja_file.close()
 
 
@@ -2459,15 +2542,6 @@ def PerformBuild(data, configurations, params):
     subprocess.check_call(arguments)
 
 
-def CallGenerateOutputForConfig(arglist):
-  # Ignore the interrupt signal so that the parent process catches it and
-  # kills all multiprocessing children.
-  signal.signal(signal.SIGINT, signal.SIG_IGN)
-
-  (target_list, target_dicts, data, params, config_name) = arglist
-  GenerateOutputForConfig(target_list, target_dicts, data, params, config_name)
-
-
 def GenerateOutput(target_list, target_dicts, data, params):
   # Update target_dicts for iOS device builds.
   target_dicts = gyp.xcode_emulation.CloneConfigurationForDeviceAndEmulator(
@@ -2480,22 +2554,23 @@ def GenerateOutput(target_list, target_dicts, data, params):
         target_list, target_dicts, generator_default_variables)
 
   if user_config:
-    GenerateOutputForConfig(target_list, target_dicts, data, params,
-                            user_config)
+    config_names = [user_config]
   else:
     config_names = target_dicts[target_list[0]]['configurations'].keys()
-    if params['parallel']:
-      try:
-        pool = multiprocessing.Pool(len(config_names))
-        arglists = []
-        for config_name in config_names:
-          arglists.append(
-              (target_list, target_dicts, data, params, config_name))
-        pool.map(CallGenerateOutputForConfig, arglists)
-      except KeyboardInterrupt as e:
-        pool.terminate()
-        raise e
-    else:
-      for config_name in config_names:
-        GenerateOutputForConfig(target_list, target_dicts, data, params,
-                                config_name)
+
+  # The configurations are generated one after the other, with the targets of
+  # each one written in parallel.
+  pool = None
+  if params['parallel'] and multiprocessing.cpu_count() > 1:
+    pool = multiprocessing.Pool()
+  try:
+    for config_name in config_names:
+      GenerateOutputForConfig(target_list, target_dicts, data, params,
+                              config_name, pool)
+  except KeyboardInterrupt as e:
+    if pool:
+      pool.terminate()
+    raise e
+  if pool:
+    pool.close()
+    pool.join()
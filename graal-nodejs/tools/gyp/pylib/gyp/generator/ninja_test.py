@@ -42,5 +42,22 @@ class TestPrefixesAndSuffixes(unittest.TestCase):
     self.assertTrue(writer.ComputeOutputFileName(spec, 'static_library').
         endswith('.a'))
 
+class TestTargetLevels(unittest.TestCase):
+  def test_TargetLevels(self):
+    target_dicts = {
+      'a.gyp:a#target': {},
+      'a.gyp:b#target': {'dependencies': ['a.gyp:a#target']},
+      'a.gyp:c#target': {},
+      'a.gyp:d#target': {'dependencies': ['a.gyp:b#target',
+                                          'a.gyp:c#target']},
+      'a.gyp:e#target': {'dependencies': ['a.gyp:a#target']},
+    }
+    target_list = ['a.gyp:a#target', 'a.gyp:b#target', 'a.gyp:c#target',
+                   'a.gyp:d#target', 'a.gyp:e#target']
+    self.assertEqual([['a.gyp:a#target', 'a.gyp:c#target'],
+                      ['a.gyp:b#target', 'a.gyp:e#target'],
+                      ['a.gyp:d#target']],
+                     ninja.TargetLevels(target_list, target_dicts))
+
 if __name__ == '__main__':
   unittest.main()
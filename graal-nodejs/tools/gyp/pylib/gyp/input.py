@@ -8,6 +8,8 @@ import ast
 
 import gyp.common
 import gyp.simple_copy
+import hashlib
+import marshal
 import multiprocessing
 import optparse
 import os.path
@@ -16,6 +18,7 @@ import shlex
 import signal
 import subprocess
 import sys
+import tempfile
 import threading
 import time
 import traceback
@@ -217,25 +220,124 @@ def CheckNode(node, keypath):
         "': " + repr(node))
 
 
-def LoadOneBuildFile(build_file_path, data, aux_data, includes,
-                     is_target, check):
-  if build_file_path in data:
-    return data[build_file_path]
+# Directory holding the persistent cache of parsed build files and command
+# outputs, or None if the cache is disabled.  Entries are named after a hash of
+# everything they depend on, so stale entries are never read; they are simply
+# left behind.
+build_cache_dir = None
 
-  if os.path.exists(build_file_path):
-    # Open the build file for read ('r') with universal-newlines mode ('U')
-    # to make sure platform specific newlines ('\r\n' or '\r') are converted to '\n'
-    # which otherwise will fail eval()
-    if sys.platform == 'zos':
-      # On z/OS, universal-newlines mode treats the file as an ascii file. But since
-      # node-gyp produces ebcdic files, do not use that mode.
-      build_file_contents = open(build_file_path, 'r').read()
-    else:
-      build_file_contents = open(build_file_path, 'rU').read()
+# Bump this whenever the format of cache entries or their keys changes.
+BUILD_CACHE_VERSION = 1
+
+
+def BuildCacheKey(*parts):
+  """Returns the name of the cache entry for a value depending on |parts|."""
+  key = repr((BUILD_CACHE_VERSION, sys.version) + parts)
+  if PY3:
+    key = key.encode('utf-8')
+  return hashlib.sha1(key).hexdigest()
+
+
+def ReadBuildCache(key):
+  """Returns the value cached under |key|, or None if there is none."""
+  if not build_cache_dir:
+    return None
+  try:
+    with open(os.path.join(build_cache_dir, key), 'rb') as cache_file:
+      return marshal.load(cache_file)
+  except (IOError, OSError, EOFError, ValueError, TypeError):
+    # Missing or truncated entries are cache misses.
+    return None
+
+
+def WriteBuildCache(key, value):
+  """Caches |value| under |key|.  Failing to do so is not an error."""
+  if not build_cache_dir:
+    return
+  temp_path = None
+  try:
+    if not os.path.isdir(build_cache_dir):
+      os.makedirs(build_cache_dir)
+    # Parallel loads may write the same entry concurrently, so write to a
+    # temporary file and move it in place.
+    fd, temp_path = tempfile.mkstemp(dir=build_cache_dir, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as cache_file:
+      marshal.dump(value, cache_file)
+    os.rename(temp_path, os.path.join(build_cache_dir, key))
+  except (IOError, OSError, ValueError):
+    if temp_path and os.path.exists(temp_path):
+      os.remove(temp_path)
+
+
+def FileDigest(path):
+  with open(path, 'rb') as f:
+    return hashlib.sha1(f.read()).hexdigest()
+
+
+def PymodModuleFile(module_name, build_file_dir):
+  """Returns the source file that pymod_do_main imports for |module_name|.
+
+  Resolves the module the way __import__ does when run from |build_file_dir|:
+  an already imported module wins, then sys.path is searched, followed by
+  |build_file_dir| itself.
+  """
+  module = sys.modules.get(module_name)
+  if module is not None:
+    path = getattr(module, '__file__', None)
+    if path and path.endswith(('.pyc', '.pyo')):
+      path = path[:-1]
+    return path if path and os.path.isfile(path) else None
+  for directory in sys.path + [build_file_dir or '']:
+    # Relative entries are relative to |build_file_dir| during the import.
+    directory = os.path.join(build_file_dir or '', directory)
+    for candidate in (module_name + '.py',
+                      os.path.join(module_name, '__init__.py')):
+      path = os.path.join(directory, candidate)
+      if os.path.isfile(path):
+        return path
+  return None
+
+
+def CommandInputFiles(contents, command_string, build_file_dir):
+  """Returns the files a command names among its arguments.
+
+  These are the files a cached output of the command is assumed to depend on,
+  beyond the command line, the directory it runs in and the environment.
+  """
+  if type(contents) is list:
+    args = contents
   else:
-    raise GypError("%s not found (cwd: %s)" % (build_file_path, os.getcwd()))
+    # shlex.split is too slow for the long argument lists of some commands,
+    # and finding the file names does not need exact shell semantics.
+    args = [arg.strip('"\'') for arg in contents.split()]
+  inputs = []
+  if command_string == 'pymod_do_main' and args:
+    module_file = PymodModuleFile(args[0], build_file_dir)
+    if module_file:
+      inputs.append(module_file)
+    args = args[1:]
+  for arg in args:
+    path = os.path.join(build_file_dir or '', arg)
+    if os.path.isfile(path):
+      inputs.append(path)
+  return inputs
+
+
+def ParseBuildFile(build_file_path, build_file_contents, check):
+  """Returns the dict |build_file_contents| evaluates to.
+
+  The parsed data only depends on the contents of the build file, so cached
+  entries are shared by identical files.
+  """
+  cache_key = None
+  if build_cache_dir:
+    cache_key = BuildCacheKey('build_file', check, build_file_contents)
+    build_file_data = ReadBuildCache(cache_key)
+    if build_file_data is not None:
+      gyp.DebugOutput(gyp.DEBUG_INCLUDES,
+                      "Had cache value for build file '%s'", build_file_path)
+      return build_file_data
 
-  build_file_data = None
   try:
     if check:
       build_file_data = CheckedEval(build_file_contents)
@@ -252,6 +354,31 @@ def LoadOneBuildFile(build_file_path, data, aux_data, includes,
   if type(build_file_data) is not dict:
     raise GypError("%s does not evaluate to a dictionary." % build_file_path)
 
+  if cache_key:
+    WriteBuildCache(cache_key, build_file_data)
+  return build_file_data
+
+
+def LoadOneBuildFile(build_file_path, data, aux_data, includes,
+                     is_target, check):
+  if build_file_path in data:
+    return data[build_file_path]
+
+  if os.path.exists(build_file_path):
+    # Open the build file for read ('r') with universal-newlines mode ('U')
+    # to make sure platform specific newlines ('\r\n' or '\r') are converted to '\n'
+    # which otherwise will fail eval()
+    if sys.platform == 'zos':
+      # On z/OS, universal-newlines mode treats the file as an ascii file. But since
+      # node-gyp produces ebcdic files, do not use that mode.
+      build_file_contents = open(build_file_path, 'r').read()
+    else:
+      build_file_contents = open(build_file_path, 'rU').read()
+  else:
+    raise GypError("%s not found (cwd: %s)" % (build_file_path, os.getcwd()))
+
+  build_file_data = ParseBuildFile(build_file_path, build_file_contents, check)
+
   data[build_file_path] = build_file_data
   aux_data[build_file_path] = {}
 
@@ -596,7 +723,8 @@ def LoadTargetBuildFilesParallel(build_files, data, variables, includes, depth,
       global_flags = {
         'path_sections': globals()['path_sections'],
         'non_configuration_keys': globals()['non_configuration_keys'],
-        'multiple_toolsets': globals()['multiple_toolsets']}
+        'multiple_toolsets': globals()['multiple_toolsets'],
+        'build_cache_dir': globals()['build_cache_dir']}
 
       if not parallel_state.pool:
         parallel_state.pool = multiprocessing.Pool(multiprocessing.cpu_count())
@@ -689,7 +817,8 @@ latelate_variable_re = re.compile(
     r'(?P<content>.*?)(\]?)\))')
 
 # Global cache of results from running commands so they don't have to be run
-# more then once.
+# more then once.  Results are also kept in the build cache across runs, see
+# build_cache_dir.
 cached_command_results = {}
 
 
@@ -865,6 +994,19 @@ def ExpandVariables(input, phase, variables, build_file):
       # command's output so it is run every time.
       cache_key = (str(contents), build_file_dir)
       cached_value = cached_command_results.get(cache_key, None)
+      persistent_cache_key = None
+      if cached_value is None and build_cache_dir:
+        # Across runs, the output is also assumed to depend on the environment
+        # and on the contents of the files named on the command line.
+        inputs = CommandInputFiles(contents, command_string, build_file_dir)
+        persistent_cache_key = BuildCacheKey(
+            'command', command_string, str(contents),
+            os.path.abspath(build_file_dir or os.getcwd()),
+            sorted(os.environ.items()),
+            [(os.path.abspath(path), FileDigest(path)) for path in inputs])
+        cached_value = ReadBuildCache(persistent_cache_key)
+        if cached_value is not None:
+          cached_command_results[cache_key] = cached_value
       if cached_value is None:
         gyp.DebugOutput(gyp.DEBUG_VARIABLES,
                         "Executing command '%s' in directory '%s'",
@@ -925,6 +1067,8 @@ def ExpandVariables(input, phase, variables, build_file):
           replacement = p_stdout.rstrip()
 
         cached_command_results[cache_key] = replacement
+        if persistent_cache_key:
+          WriteBuildCache(persistent_cache_key, replacement)
       else:
         gyp.DebugOutput(gyp.DEBUG_VARIABLES,
                         "Had cache value for command '%s' in directory '%s'",
@@ -2764,8 +2908,11 @@ def SetGeneratorGlobals(generator_input_info):
 
 
 def Load(build_files, variables, includes, depth, generator_input_info, check,
-         circular_check, duplicate_basename_check, parallel, root_targets):
+         circular_check, duplicate_basename_check, parallel, root_targets,
+         cache_dir=None):
   SetGeneratorGlobals(generator_input_info)
+  global build_cache_dir
+  build_cache_dir = cache_dir
   # A generator can have other lists (in addition to sources) be processed
   # for rules.
   extra_sources_for_rules = generator_input_info['extra_sources_for_rules']
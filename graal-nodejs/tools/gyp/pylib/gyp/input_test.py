@@ -7,6 +7,9 @@
 """Unit tests for the input.py file."""
 
 import gyp.input
+import os
+import shutil
+import tempfile
 import unittest
 import sys
 
@@ -86,5 +89,87 @@ class TestFindCycles(unittest.TestCase):
                       self.nodes['a'].FindCycles())
 
 
+class TestBuildCache(unittest.TestCase):
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    self.cache_dir = os.path.join(self.temp_dir, 'cache')
+    gyp.input.build_cache_dir = self.cache_dir
+    gyp.input.cached_command_results.clear()
+
+  def tearDown(self):
+    gyp.input.build_cache_dir = None
+    gyp.input.cached_command_results.clear()
+    shutil.rmtree(self.temp_dir)
+
+  def _write(self, name, contents):
+    path = os.path.join(self.temp_dir, name)
+    with open(path, 'w') as f:
+      f.write(contents)
+    return path
+
+  def test_build_file_is_cached(self):
+    contents = "{'variables': {'foo': 'bar'}, 'targets': []}"
+    data = gyp.input.ParseBuildFile('a.gyp', contents, False)
+    key = gyp.input.BuildCacheKey('build_file', False, contents)
+    self.assertEqual(data, gyp.input.ReadBuildCache(key))
+
+    # A cache hit returns a fresh copy of the parsed data.
+    data['variables']['foo'] = 'baz'
+    self.assertEqual({'variables': {'foo': 'bar'}, 'targets': []},
+                     gyp.input.ParseBuildFile('a.gyp', contents, False))
+
+  def test_command_output_is_cached(self):
+    self._write('input.txt', 'one')
+    build_file = os.path.join(self.temp_dir, 'a.gyp')
+    expand = lambda: gyp.input.ExpandVariables(
+        '<!(cat input.txt)', gyp.input.PHASE_EARLY, {}, build_file)
+    self.assertEqual('one', expand())
+    self.assertEqual(1, len(os.listdir(self.cache_dir)))
+
+    # A new run reuses the output from the cache.
+    gyp.input.cached_command_results.clear()
+    self.assertEqual('one', expand())
+    self.assertEqual(1, len(os.listdir(self.cache_dir)))
+
+    # Changing a file named on the command line reruns the command.
+    gyp.input.cached_command_results.clear()
+    self._write('input.txt', 'two')
+    self.assertEqual('two', expand())
+    self.assertEqual(2, len(os.listdir(self.cache_dir)))
+
+  def test_pymod_module_is_an_input(self):
+    # The module is found on sys.path, not next to the build file.
+    module = 'input_test_pymod'
+    os.mkdir(os.path.join(self.temp_dir, 'pymod'))
+    sys.path.insert(0, os.path.join(self.temp_dir, 'pymod'))
+    self.addCleanup(sys.path.pop, 0)
+    module_file = os.path.join('pymod', module + '.py')
+    self._write(module_file, 'def DoMain(args):\n  return "one"\n')
+    build_file = os.path.join(self.temp_dir, 'a.gyp')
+    def expand():
+      # Every gyp run imports the module afresh.
+      gyp.input.cached_command_results.clear()
+      sys.modules.pop(module, None)
+      return gyp.input.ExpandVariables(
+          '<!pymod_do_main(%s)' % module, gyp.input.PHASE_EARLY, {},
+          build_file)
+    self.assertEqual('one', expand())
+    self.assertEqual('one', expand())
+    self.assertEqual(1, len(os.listdir(self.cache_dir)))
+
+    # Changing the module reruns it.
+    self._write(module_file, 'def DoMain(args):\n  return "three"\n')
+    self.assertEqual('three', expand())
+    self.assertEqual(2, len(os.listdir(self.cache_dir)))
+
+  def test_corrupt_entries_are_ignored(self):
+    key = gyp.input.BuildCacheKey('test')
+    gyp.input.WriteBuildCache(key, ['value'])
+    self.assertEqual(['value'], gyp.input.ReadBuildCache(key))
+    with open(os.path.join(self.cache_dir, key), 'wb') as f:
+      f.write(b'\xff')
+    self.assertEqual(None, gyp.input.ReadBuildCache(key))
+
+
 if __name__ == '__main__':
   unittest.main()
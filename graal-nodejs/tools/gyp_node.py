@@ -34,6 +34,10 @@ def run_gyp(args):
 
   args.append('--depth=' + node_root)
 
+  # Reusing parsed build files and command outputs from earlier runs is opt-in
+  # through GYP_CACHE_DIR (e.g. out/.gyp-cache): cached command outputs are only
+  # invalidated by changes to the files the commands name or import.
+
   # There's a bug with windows which doesn't allow this feature.
   if sys.platform != 'win32' and 'ninja' not in args:
     # Tell gyp to write the Makefiles into output_dir
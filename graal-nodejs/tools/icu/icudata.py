@@ -0,0 +1,787 @@
+#
+# Reads and writes ICU common data (.dat) packages in-process.
+#
+# This covers what icutrim.py used to run icupkg, iculslocs and genrb for:
+# listing and removing package items, finding the dependencies that icupkg
+# checks between items, and rewriting res_index.res bundles byte for byte
+# the way genrb writes them.  Anything else raises DataError, and the caller
+# is expected to fall back to the ICU tools.
+#
+# References (ICU source tree):
+#  source/tools/toolutil/package.cpp   - .dat package layout
+#  source/tools/toolutil/pkgitems.cpp  - item dependencies
+#  source/common/uresdata.h            - .res resource bundle layout
+#  source/tools/genrb/reslist.cpp      - .res writer
+
+from __future__ import print_function
+
+import functools
+import os
+import struct
+import sys
+
+
+class DataError(Exception):
+    """The data cannot be handled in-process."""
+
+
+ASCII_FAMILY = 0
+
+# Data formats (UDataInfo.dataFormat) of the items we look into.
+PACKAGE_FORMAT = b'CmnD'
+RESOURCE_FORMAT = b'ResB'
+CONVERTER_FORMAT = b'cnvt'
+
+# Resource types, see source/common/uresdata.h
+URES_STRING = 0
+URES_TABLE = 2
+URES_ALIAS = 3
+URES_TABLE32 = 4
+URES_TABLE16 = 5
+URES_STRING_V2 = 6
+URES_ARRAY = 8
+URES_ARRAY16 = 9
+
+URES_INDEX_LENGTH = 0
+URES_INDEX_KEYS_TOP = 1
+URES_INDEX_MAX_TABLE_LENGTH = 4
+URES_INDEX_ATTRIBUTES = 5
+URES_INDEX_16BIT_TOP = 6
+URES_INDEX_POOL_CHECKSUM = 7
+
+URES_ATT_NO_FALLBACK = 1
+URES_ATT_IS_POOL_BUNDLE = 2
+URES_ATT_USES_POOL_BUNDLE = 4
+
+# genrb writes strings up to this length without an explicit length
+MAX_IMPLICIT_STRING_LENGTH = 40
+
+# Converter constants, see source/common/ucnv_bld.h and ucnvmbcs.h
+UCNV_MBCS = 2
+MBCS_OUTPUT_EXT_ONLY = 0xe
+MBCS_HEADER_V4_LENGTH = 8
+MBCS_OPT_LENGTH_MASK = 0x3f
+MBCS_OPT_UNKNOWN_INCOMPATIBLE_MASK = 0xff80
+
+INSTALLED_LOCALES = "InstalledLocales"
+
+
+def byteOrder(isBigEndian):
+    return '>' if isBigEndian else '<'
+
+
+def readCString(data, offset):
+    end = data.index(b'\0', offset)
+    return data[offset:end].decode('ascii')
+
+
+def utf16Units(s):
+    """Returns the UTF-16 code units of s as a tuple."""
+    data = s.encode('utf-16-le')
+    return struct.unpack('<%dH' % (len(data) // 2), data)
+
+
+def readDataHeader(data):
+    """Returns (headerSize, isBigEndian, charsetFamily, dataFormat, formatVersion)
+    from the DataHeader at the start of an ICU data file or package item."""
+    if len(data) < 24 or data[2] != 0xda or data[3] != 0x27:
+        raise DataError("not an ICU data file")
+    isBigEndian = data[8] != 0
+    headerSize, = struct.unpack_from(byteOrder(isBigEndian) + 'H', data, 0)
+    if headerSize < 24 or len(data) < headerSize:
+        raise DataError("malformed ICU data header")
+    return (headerSize, isBigEndian, data[9], bytes(data[12:16]),
+            tuple(data[16:20]))
+
+
+def packageName(filename):
+    """Returns the package name (item name prefix) for a .dat file name,
+    the way icupkg derives it."""
+    basename = os.path.basename(filename)
+    if not basename.endswith(".dat"):
+        raise DataError("%s is not a package filename (must end with .dat)" % filename)
+    return basename[:-4]
+
+
+def treeName(itemName, name):
+    """Returns name in the same tree (directory) as itemName."""
+    return itemName[:itemName.rfind('/') + 1] + name
+
+
+def parentName(itemName):
+    """Returns the truncation parent of a locale item, or None for root."""
+    basename = itemName[itemName.rfind('/') + 1:]
+    suffix = basename.rfind('.')
+    if suffix < 0:
+        suffix = len(basename)
+    stem = basename[:suffix]
+    limit = stem.rfind('_')
+    if limit > 0:
+        return treeName(itemName, stem[:limit] + basename[suffix:])
+    if stem == "root":
+        return None
+    return treeName(itemName, "root" + basename[suffix:])
+
+
+class Package(object):
+    """An ICU common data package: a table of contents and named items."""
+
+    def __init__(self, header, isBigEndian, items):
+        self.header = header
+        self.isBigEndian = isBigEndian
+        self.items = items
+
+    @classmethod
+    def read(cls, filename):
+        with open(filename, 'rb') as fi:
+            data = bytearray(fi.read())
+        headerSize, isBigEndian, charsetFamily, dataFormat, formatVersion = readDataHeader(data)
+        if dataFormat != PACKAGE_FORMAT or formatVersion[0] != 1:
+            raise DataError("%s is not an ICU .dat package" % filename)
+        if charsetFamily != ASCII_FAMILY:
+            raise DataError("%s is not an ASCII-family package" % filename)
+        # icupkg pads the file to a multiple of 16, and the last item with it
+        if len(data) & 15:
+            data += b'\xaa' * (16 - (len(data) & 15))
+        e = byteOrder(isBigEndian)
+        count, = struct.unpack_from(e + 'i', data, headerSize)
+        toc = struct.unpack_from(e + '%dI' % (2 * count), data, headerSize + 4)
+        prefix = packageName(filename) + '/'
+        items = {}
+        for i in range(count):
+            name = readCString(data, headerSize + toc[2 * i])
+            if not name.startswith(prefix) or name == prefix:
+                # old-style packages use '_' instead of the tree separator
+                raise DataError("item name \"%s\" does not start with \"%s\"" % (name, prefix))
+            start = headerSize + toc[2 * i + 1]
+            limit = headerSize + toc[2 * i + 3] if i + 1 < count else len(data)
+            items[name[len(prefix):]] = data[start:limit]
+        return cls(bytes(data[:headerSize]), isBigEndian, items)
+
+    def write(self, filename):
+        """Writes the package with the same layout that icupkg uses."""
+        e = byteOrder(self.isBigEndian)
+        prefix = (packageName(filename) + '/').encode('ascii')
+        names = sorted(self.items)
+        stringsOffset = 4 + 8 * len(names)
+        strings = bytearray()
+        nameOffsets = []
+        for name in names:
+            nameOffsets.append(stringsOffset + len(strings))
+            strings += prefix + name.encode('ascii') + b'\0'
+        # align only the first item; each item's length is a multiple of 16
+        offset = stringsOffset + len(strings)
+        if offset & 15:
+            strings += b'\xaa' * (16 - (offset & 15))
+            offset = stringsOffset + len(strings)
+        toc = [len(names)]
+        for i, name in enumerate(names):
+            toc += [nameOffsets[i], offset]
+            offset += len(self.items[name])
+        with open(filename, 'wb') as fo:
+            fo.write(self.header)
+            fo.write(struct.pack(e + '%dI' % len(toc), *toc))
+            fo.write(strings)
+            for name in names:
+                fo.write(self.items[name])
+
+    def names(self):
+        return sorted(self.items)
+
+    def __contains__(self, name):
+        return name in self.items
+
+    def setItem(self, name, data):
+        """Adds or replaces an item, padded like icupkg pads added files."""
+        data = bytearray(data)
+        if len(data) & 15:
+            data += b'\xaa' * (16 - (len(data) & 15))
+        self.items[name] = data
+
+    def findItems(self, pattern):
+        """Returns the item names matching an icupkg list entry,
+        which may contain one '*' wildcard."""
+        if '*' not in pattern:
+            return [pattern] if pattern in self.items else []
+        prefix, suffix = pattern.split('*', 1)
+        if '*' in suffix:
+            raise DataError("more than one '*' in item pattern \"%s\"" % pattern)
+        return [name for name in self.names()
+                if len(name) >= len(prefix) + len(suffix) and
+                name.startswith(prefix) and name.endswith(suffix)]
+
+    def removeItems(self, names):
+        for name in names:
+            self.items.pop(name, None)
+
+    def dependencies(self):
+        """Returns {item name: [names of the items it depends on]} for all items,
+        following the same rules as icupkg's dependency check."""
+        graph = {}
+        for name in self.names():
+            data = self.items[name]
+            headerSize, isBigEndian, charsetFamily, dataFormat, formatVersion = readDataHeader(data)
+            if dataFormat == RESOURCE_FORMAT:
+                graph[name] = self.bundleDependencies(name)
+            elif dataFormat == CONVERTER_FORMAT:
+                graph[name] = self.converterDependencies(name, data, headerSize,
+                                                         isBigEndian, formatVersion)
+            else:
+                graph[name] = []
+        return graph
+
+    def bundleDependencies(self, name):
+        bundle = ResourceBundle(self.items[name])
+        deps = []
+        if bundle.usesPoolBundle:
+            poolName = treeName(name, "pool.res")
+            deps.append(poolName)
+            if poolName not in self.items:
+                return deps
+            if not bundle.setPoolBundle(ResourceBundle(self.items[poolName])):
+                print("icudata: %s is not a matching pool bundle for %s" % (poolName, name),
+                      file=sys.stderr)
+                return deps
+        # bundles without attributes cannot tell whether they use fallback
+        if bundle.formatVersion >= (1, 1) and not bundle.noFallback:
+            parent = bundle.parent()
+            if parent is not None:
+                parent = treeName(name, parent + ".res")
+            elif not bundle.isAlias():
+                parent = parentName(name)
+            if parent is not None:
+                deps.insert(0, parent)
+        for target, useResSuffix in bundle.aliases():
+            deps.append(treeName(name, target + (".res" if useResSuffix else "")))
+        return deps
+
+    def converterDependencies(self, name, data, headerSize, isBigEndian, formatVersion):
+        """An extension-only converter depends on its base table."""
+        if not (formatVersion[0] == 6 and formatVersion[1] >= 2):
+            raise DataError("%s: .cnv format version %d.%d not supported" % (name, formatVersion[0], formatVersion[1]))
+        e = byteOrder(isBigEndian)
+        staticDataSize, = struct.unpack_from(e + 'I', data, headerSize)
+        if data[headerSize + 69] != UCNV_MBCS:
+            return []
+        mbcs = headerSize + staticDataSize
+        version = data[mbcs:mbcs + 2]
+        flags, = struct.unpack_from(e + 'I', data, mbcs + 24)
+        if version[0] == 4 and version[1] >= 1:
+            headerLength = MBCS_HEADER_V4_LENGTH
+        else:
+            mbcsOptions, = struct.unpack_from(e + 'I', data, mbcs + 32)
+            if not (version[0] == 5 and version[1] >= 3 and
+                    (mbcsOptions & MBCS_OPT_UNKNOWN_INCOMPATIBLE_MASK) == 0):
+                raise DataError("%s: unsupported _MBCSHeader.version %d.%d" % (name, version[0], version[1]))
+            headerLength = mbcsOptions & MBCS_OPT_LENGTH_MASK
+        if (flags & 0xff) != MBCS_OUTPUT_EXT_ONLY:
+            return []
+        return [treeName(name, readCString(data, mbcs + headerLength * 4) + ".cnv")]
+
+
+class ResourceBundle(object):
+    """Read access to a .res resource bundle (formatVersion 1.0 to 3.x)."""
+
+    def __init__(self, data):
+        headerSize, isBigEndian, charsetFamily, dataFormat, formatVersion = readDataHeader(data)
+        if dataFormat != RESOURCE_FORMAT or not 1 <= formatVersion[0] <= 3:
+            raise DataError(".res format version %d.%d not supported" % formatVersion[:2])
+        if charsetFamily != ASCII_FAMILY:
+            raise DataError("not an ASCII-family resource bundle")
+        self.data = data
+        self.base = headerSize
+        self.e = byteOrder(isBigEndian)
+        self.utf16 = 'utf-16-be' if isBigEndian else 'utf-16-le'
+        self.formatVersion = formatVersion[:2]
+        self.root, = struct.unpack_from(self.e + 'I', data, headerSize)
+        if self.resType(self.root) not in (URES_TABLE, URES_TABLE32, URES_TABLE16):
+            raise DataError("the root resource is not a table")
+        self.indexes = []
+        self.localKeyLimit = 0
+        self.poolStringIndexLimit = 0
+        self.poolStringIndex16Limit = 0
+        self.noFallback = self.isPoolBundle = self.usesPoolBundle = False
+        self.units16 = None
+        self.poolKeys = self.poolStrings = None
+        if self.formatVersion == (1, 0):
+            self.localKeyLimit = 0x10000
+            return
+        indexLength = self.int32(4) & 0xff
+        if indexLength <= URES_INDEX_MAX_TABLE_LENGTH:
+            raise DataError("too few resource bundle indexes")
+        self.indexes = [self.int32(4 + 4 * i) for i in range(indexLength)]
+        keysTop = self.indexes[URES_INDEX_KEYS_TOP]
+        if keysTop > 1 + indexLength:
+            self.localKeyLimit = keysTop << 2
+        if self.formatVersion[0] >= 3:
+            self.poolStringIndexLimit = (self.indexes[URES_INDEX_LENGTH] & 0xffffffff) >> 8
+        if indexLength > URES_INDEX_ATTRIBUTES:
+            att = self.indexes[URES_INDEX_ATTRIBUTES] & 0xffffffff
+            self.noFallback = bool(att & URES_ATT_NO_FALLBACK)
+            self.isPoolBundle = bool(att & URES_ATT_IS_POOL_BUNDLE)
+            self.usesPoolBundle = bool(att & URES_ATT_USES_POOL_BUNDLE)
+            self.poolStringIndexLimit |= (att & 0xf000) << 12
+            self.poolStringIndex16Limit = att >> 16
+        if (self.isPoolBundle or self.usesPoolBundle) and indexLength <= URES_INDEX_POOL_CHECKSUM:
+            raise DataError("pool bundle attributes without a checksum")
+        if indexLength > URES_INDEX_16BIT_TOP and self.indexes[URES_INDEX_16BIT_TOP] > keysTop:
+            self.units16 = keysTop << 2
+
+    def setPoolBundle(self, pool):
+        """Makes the shared keys and strings of pool available.
+        Returns False if pool is not the pool bundle this bundle was built with."""
+        if (pool.formatVersion[0] <= 1 or len(pool.indexes) <= URES_INDEX_POOL_CHECKSUM or
+                not pool.isPoolBundle or
+                pool.indexes[URES_INDEX_POOL_CHECKSUM] != self.indexes[URES_INDEX_POOL_CHECKSUM]):
+            return False
+        self.poolKeys = (pool, 4 + 4 * len(pool.indexes))
+        self.poolStrings = (pool, pool.indexes[URES_INDEX_KEYS_TOP] << 2)
+        return True
+
+    @staticmethod
+    def resType(res):
+        return res >> 28
+
+    def int32(self, offset):
+        return struct.unpack_from(self.e + 'i', self.data, self.base + offset)[0]
+
+    def uint16s(self, offset, count):
+        return struct.unpack_from(self.e + '%dH' % count, self.data, self.base + offset)
+
+    def uint32s(self, offset, count):
+        return struct.unpack_from(self.e + '%dI' % count, self.data, self.base + offset)
+
+    def key16(self, offset):
+        if offset < self.localKeyLimit:
+            return readCString(self.data, self.base + offset)
+        return self.poolKey(offset - self.localKeyLimit)
+
+    def key32(self, offset):
+        if offset >= 0:
+            return readCString(self.data, self.base + offset)
+        return self.poolKey(offset & 0x7fffffff)
+
+    def poolKey(self, offset):
+        if self.poolKeys is None:
+            raise DataError("key in a missing pool bundle")
+        pool, keys = self.poolKeys
+        return readCString(pool.data, pool.base + keys + offset)
+
+    def resource16(self, res16):
+        if res16 >= self.poolStringIndex16Limit:
+            res16 = res16 - self.poolStringIndex16Limit + self.poolStringIndexLimit
+        return (URES_STRING_V2 << 28) | res16
+
+    def table(self, res, withKeys=True):
+        """Returns the [(key, resource)] items of a table resource.
+        Without keys, the keys are all None."""
+        resType = self.resType(res)
+        offset = res & 0x0fffffff
+        if resType == URES_TABLE16:
+            if self.units16 is None:
+                return []
+            start = self.units16 + 2 * offset
+            count, = self.uint16s(start, 1)
+            keys = self.uint16s(start + 2, count) if withKeys else None
+            values = [self.resource16(r) for r in self.uint16s(start + 2 + 2 * count, count)]
+            key = self.key16
+        elif offset == 0:
+            return []
+        elif resType == URES_TABLE:
+            start = offset << 2
+            count, = self.uint16s(start, 1)
+            keys = self.uint16s(start + 2, count) if withKeys else None
+            values = self.uint32s(start + 2 + 2 * (count + (~count & 1)), count)
+            key = self.key16
+        else:
+            start = offset << 2
+            count = self.int32(start)
+            keys = struct.unpack_from(self.e + '%di' % count, self.data,
+                                      self.base + start + 4) if withKeys else None
+            values = self.uint32s(start + 4 + 4 * count, count)
+            key = self.key32
+        if not withKeys:
+            return [(None, value) for value in values]
+        return [(key(keys[i]), values[i]) for i in range(count)]
+
+    def array(self, res):
+        offset = res & 0x0fffffff
+        if self.resType(res) == URES_ARRAY16:
+            if self.units16 is None:
+                return []
+            start = self.units16 + 2 * offset
+            count, = self.uint16s(start, 1)
+            return [self.resource16(r) for r in self.uint16s(start + 2, count)]
+        if offset == 0:
+            return []
+        count = self.int32(offset << 2)
+        return self.uint32s((offset << 2) + 4, count)
+
+    def string(self, res):
+        """Returns the value of a string or alias resource."""
+        offset = res & 0x0fffffff
+        if self.resType(res) != URES_STRING_V2:
+            if offset == 0:
+                return u""
+            start = self.base + (offset << 2)
+            length, = struct.unpack_from(self.e + 'i', self.data, start)
+            return bytes(self.data[start + 4:start + 4 + 2 * length]).decode(self.utf16)
+        if offset < self.poolStringIndexLimit:
+            if self.poolStrings is None:
+                raise DataError("string in a missing pool bundle")
+            bundle, start = self.poolStrings
+        else:
+            bundle, start = self, self.units16
+            offset -= self.poolStringIndexLimit
+            if start is None:
+                return u""
+        data = bundle.data
+        start = bundle.base + start + 2 * offset
+        first, = struct.unpack_from(bundle.e + 'H', data, start)
+        if not 0xdc00 <= first <= 0xdfff:
+            end = start
+            while data[end] != 0 or data[end + 1] != 0:
+                end += 2
+            return bytes(data[start:end]).decode(bundle.utf16)
+        if first < 0xdfef:
+            length = first & 0x3ff
+            start += 2
+        elif first < 0xdfff:
+            second, = struct.unpack_from(bundle.e + 'H', data, start + 2)
+            length = ((first - 0xdfef) << 16) | second
+            start += 4
+        else:
+            high, low = struct.unpack_from(bundle.e + '2H', data, start + 2)
+            length = (high << 16) | low
+            start += 6
+        return bytes(data[start:start + 2 * length]).decode(bundle.utf16)
+
+    def aliases(self):
+        """Yields (locale ID, useResSuffix) for each bundle that this one refers to
+        through %%ALIAS, %%DEPENDENCY or alias resources."""
+        # (resource, key, parent key, depth); keys are only needed near the root
+        stack = [(self.root, None, None, 0)]
+        while stack:
+            res, key, parentKey, depth = stack.pop()
+            resType = self.resType(res)
+            if resType in (URES_STRING, URES_STRING_V2):
+                if depth == 1 and key is not None:
+                    if key != "%%ALIAS":
+                        continue
+                    useResSuffix = True
+                elif depth == 2 and parentKey is not None:
+                    if parentKey != "%%DEPENDENCY":
+                        continue
+                    useResSuffix = False
+                else:
+                    continue
+                alias = self.string(res)
+                if '/' in alias:
+                    raise DataError("%%ALIAS contains a '/'")
+                yield self.checkAlias(alias), useResSuffix
+            elif resType == URES_ALIAS:
+                alias = self.string(res)
+                slash = alias.find('/')
+                if slash == 0:
+                    # /ICUDATA/..., /pkgname/... and /LOCALE/... do not refer
+                    # to a fixed bundle in this package
+                    continue
+                if slash > 0:
+                    alias = alias[:slash]
+                yield self.checkAlias(alias), True
+            elif resType in (URES_TABLE, URES_TABLE32, URES_TABLE16):
+                # Table16 values are all strings, which only matter in the
+                # root table and below %%DEPENDENCY
+                if resType == URES_TABLE16 and not (
+                        depth == 0 or depth == 1 and key == "%%DEPENDENCY"):
+                    continue
+                items = self.table(res, withKeys=depth == 0)
+                stack.extend((value, itemKey, key, depth + 1)
+                             for itemKey, value in reversed(items))
+            elif resType in (URES_ARRAY, URES_ARRAY16):
+                if resType == URES_ARRAY16 and not (depth == 1 and key == "%%DEPENDENCY"):
+                    continue
+                stack.extend((child, None, key, depth + 1)
+                             for child in reversed(self.array(res)))
+
+    def topLevelString(self, key):
+        for itemKey, value in self.table(self.root):
+            if itemKey == key and self.resType(value) in (URES_STRING, URES_STRING_V2):
+                return self.string(value)
+        return None
+
+    def parent(self):
+        """Returns the explicit %%Parent locale ID, if any."""
+        parent = self.topLevelString("%%Parent")
+        return parent and self.checkAlias(parent)
+
+    def isAlias(self):
+        """Returns True for a bundle that only points to another one with %%ALIAS."""
+        return self.topLevelString("%%ALIAS") is not None
+
+    @staticmethod
+    def checkAlias(alias):
+        if len(alias) >= 32 or any(ord(c) > 0x7e for c in alias):
+            raise DataError("unsupported alias \"%s\"" % alias)
+        return str(alias)
+
+    def toTable(self, res=None):
+        """Returns a table of tables and strings as [(key, value)]."""
+        if res is None:
+            res = self.root
+        items = []
+        for key, value in self.table(res):
+            resType = self.resType(value)
+            if resType in (URES_STRING, URES_STRING_V2):
+                items.append((key, self.string(value)))
+            elif resType in (URES_TABLE, URES_TABLE32, URES_TABLE16):
+                items.append((key, self.toTable(value)))
+            else:
+                raise DataError("unhandled type %d for key %s" % (resType, key))
+        return items
+
+
+def readResIndex(data):
+    """Returns (everything besides InstalledLocales, the InstalledLocales)
+    from a res_index.res item, like iculslocs reads it."""
+    bundle = ResourceBundle(data)
+    others = []
+    locales = None
+    for key, value in bundle.toTable():
+        if key == INSTALLED_LOCALES:
+            if isinstance(value, list):
+                locales = [locale for locale, _ in value]
+        else:
+            others.append((key, value))
+    if locales is None:
+        raise DataError("no %s table" % INSTALLED_LOCALES)
+    return others, locales
+
+
+def writeResIndex(others, locales, isBigEndian):
+    """Returns the res_index.res that genrb compiles from the res_index.txt
+    written by iculslocs for these contents."""
+    return writeBundle(others + [(INSTALLED_LOCALES, [(locale, u"") for locale in locales])],
+                       isBigEndian, noFallback=True)
+
+
+def compareKeySuffixes(left, right):
+    """genrb's key order: each key is immediately followed by its suffixes."""
+    (lKey, lPos), (rKey, rPos) = left, right
+    for l, r in zip(reversed(lKey), reversed(rKey)):
+        if l != r:
+            return ord(l) - ord(r)
+    if len(lKey) != len(rKey):
+        return len(rKey) - len(lKey)
+    return lPos - rPos
+
+
+def compactKeys(keys, keysBottom):
+    """Lays out the table keys (in parsing order) like genrb, sharing equal
+    keys and keys that are suffixes of others.
+    Returns (key bytes, [offset of each key])."""
+    oldpos = []
+    pos = keysBottom
+    for key in keys:
+        oldpos.append(pos)
+        pos += len(key) + 1
+    order = sorted(zip(keys, oldpos), key=functools.cmp_to_key(compareKeySuffixes))
+    # map each key's old position to (old position of the kept key, offset into it)
+    target = {}
+    i = 0
+    while i < len(order):
+        key, headPos = order[i]
+        target[headPos] = (headPos, 0)
+        j = i + 1
+        while j < len(order) and key.endswith(order[j][0]):
+            target[order[j][1]] = (headPos, len(key) - len(order[j][0]))
+            j += 1
+        i = j
+    data = bytearray()
+    newpos = {}
+    for key, pos in zip(keys, oldpos):
+        if target[pos][0] == pos:
+            newpos[pos] = keysBottom + len(data)
+            data += key.encode('ascii') + b'\0'
+    return data, [newpos[target[pos][0]] + target[pos][1] for pos in oldpos]
+
+
+def compareStringSuffixes(left, right):
+    """genrb's string order: each string is immediately followed by its suffixes."""
+    for l, r in zip(reversed(left), reversed(right)):
+        if l != r:
+            return l - r
+    return len(right) - len(left)
+
+
+def compactStrings(copies, units):
+    """Appends the distinct non-empty strings to the 16-bit units like genrb,
+    sharing the ones that are suffixes of others where possible.
+    copies maps each string, as a tuple of UTF-16 units, to its number of uses.
+    Returns {string: resource}."""
+    numCharsForLength = {}
+    for s in copies:
+        if len(s) <= MAX_IMPLICIT_STRING_LENGTH and not 0xdc00 <= s[0] < 0xe000 and 0 not in s:
+            numCharsForLength[s] = 0  # found by its NUL terminator
+        elif len(s) <= 0x3ee:
+            numCharsForLength[s] = 1
+        elif len(s) <= 0xfffff:
+            numCharsForLength[s] = 2
+        else:
+            numCharsForLength[s] = 3
+    # the suffixes of a string point into it, unless they need an explicit length
+    same = {}
+    saved = {}
+    order = sorted(copies, key=functools.cmp_to_key(compareStringSuffixes))
+    i = 0
+    while i < len(order):
+        s = order[i]
+        saved[s] = (copies[s] - 1) * (numCharsForLength[s] + len(s) + 1)
+        j = i + 1
+        while j < len(order) and s[len(s) - len(order[j]):] == order[j]:
+            suffix = order[j]
+            if numCharsForLength[suffix] == 0:
+                same[suffix] = s
+                saved[s] += copies[suffix] * (len(suffix) + 1)
+            j += 1
+        i = j
+    # shorter strings first, to keep as many as possible in reach of 16-bit resources
+    order.sort(key=lambda s: (s in same, len(s), -saved.get(s, 0), s))
+    resources = {}
+    for s in order:
+        if s in same:
+            longer = same[s]
+            resources[s] = (resources[longer] + numCharsForLength[longer] +
+                            len(longer) - len(s))
+            continue
+        resources[s] = (URES_STRING_V2 << 28) | len(units)
+        length = len(s)
+        if numCharsForLength[s] == 1:
+            units.append(0xdc00 + length)
+        elif numCharsForLength[s] == 2:
+            units.extend([0xdfef + (length >> 16), length & 0xffff])
+        elif numCharsForLength[s] == 3:
+            units.extend([0xdfff, length >> 16, length & 0xffff])
+        units.extend(s)
+        units.append(0)
+    return resources
+
+
+class TableNode(object):
+    """A table being written by writeBundle()."""
+
+    def __init__(self, items, keyOffsets):
+        self.items = []
+        for key, value in items:
+            keyOffset = next(keyOffsets)
+            if isinstance(value, list):
+                value = TableNode(value, keyOffsets)
+            self.items.append((key, keyOffset, value))
+        # genrb keeps table items sorted by key
+        self.items.sort(key=lambda item: item[0])
+        self.res = None
+        self.tableType = None
+
+
+def writeBundle(table, isBigEndian, noFallback=False):
+    """Returns a formatVersion 2 .res bundle for a table of tables and strings,
+    laid out exactly as genrb writes it.
+    table is [(key, value)] in the order of the source file."""
+    e = byteOrder(isBigEndian)
+    indexLength = URES_INDEX_16BIT_TOP + 1
+    keysBottom = (1 + indexLength) * 4
+
+    # every table item has a key; collect them in parsing order
+    keys = []
+    copies = {}
+    def collectKeys(items):
+        for key, value in items:
+            keys.append(key)
+            if isinstance(value, list):
+                collectKeys(value)
+            elif value:
+                s = utf16Units(value)
+                copies[s] = copies.get(s, 0) + 1
+    collectKeys(table)
+    keyBytes, keyOffsets = compactKeys(keys, keysBottom)
+    while len(keyBytes) & 3:
+        keyBytes += b'\xaa'
+    keysTop = keysBottom + len(keyBytes)
+    localKeyLimit = min(keysTop, 0x10000) if keysTop > keysBottom else 0
+    root = TableNode(table, iter(keyOffsets))
+
+    # the 16-bit units start with a zero for empty resources
+    units = [0]
+    maxTableLength = [0]
+    strings = compactStrings(copies, units)
+
+    def stringResource(value):
+        return strings[utf16Units(value)] if value else 0
+
+    def write16(node):
+        """Returns the Resource16 value of a table item, or -1 if there is none."""
+        if not isinstance(node, TableNode):
+            res = stringResource(node)
+            return res & 0xfffffff if res & 0xfffffff <= 0xffff else -1
+        if not node.items:
+            node.res = URES_TABLE << 28
+            return -1
+        values16 = [write16(value) for key, offset, value in node.items]
+        maxTableLength[0] = max(maxTableLength[0], len(node.items))
+        if len(node.items) > 0xffff or any(offset >= localKeyLimit for key, offset, value in node.items):
+            node.tableType = URES_TABLE32
+        elif any(value < 0 for value in values16):
+            node.tableType = URES_TABLE
+        else:
+            node.res = (URES_TABLE16 << 28) | len(units)
+            units.append(len(node.items))
+            units.extend(offset for key, offset, value in node.items)
+            units.extend(values16)
+        return -1
+
+    def preWrite(node, byteOffset):
+        if not isinstance(node, TableNode) or node.tableType is None:
+            return byteOffset
+        for key, offset, value in node.items:
+            byteOffset = preWrite(value, byteOffset)
+        node.res = (node.tableType << 28) | (byteOffset >> 2)
+        if node.tableType == URES_TABLE:
+            byteOffset += 2 + len(node.items) * 6
+        else:
+            byteOffset += 4 + len(node.items) * 8
+        return (byteOffset + 3) & ~3
+
+    def write(node, out):
+        if not isinstance(node, TableNode) or node.tableType is None:
+            return
+        for key, offset, value in node.items:
+            write(value, out)
+        count = len(node.items)
+        offsets = [offset for key, offset, value in node.items]
+        if node.tableType == URES_TABLE:
+            out += struct.pack(e + '%dH' % (1 + count), count, *offsets)
+            if count & 1 == 0:
+                out += b'\xaa\xaa'
+        else:
+            out += struct.pack(e + '%di' % (1 + count), count, *offsets)
+        out += struct.pack(e + '%dI' % count, *[value.res if isinstance(value, TableNode)
+                                               else stringResource(value)
+                                               for key, offset, value in node.items])
+
+    write16(root)
+    if len(units) & 1:
+        units.append(0xaaaa)  # pad to a multiple of 4 bytes
+    top = preWrite(root, keysTop + 2 * len(units))
+
+    indexes = [indexLength, keysTop >> 2, top >> 2, top >> 2, maxTableLength[0],
+               URES_ATT_NO_FALLBACK if noFallback else 0, (keysTop >> 2) + (len(units) >> 1)]
+    out = bytearray(struct.pack(e + 'HBBHH', 32, 0xda, 0x27, 20, 0))
+    out += bytearray([1 if isBigEndian else 0, ASCII_FAMILY, 2, 0])
+    out += RESOURCE_FORMAT + bytearray([2, 0, 0, 0, 1, 4, 0, 0])
+    out += b'\0' * (32 - len(out))
+    out += struct.pack(e + 'I', root.res)
+    out += struct.pack(e + '%di' % indexLength, *indexes)
+    out += keyBytes
+    out += struct.pack(e + '%dH' % len(units), *units)
+    write(root, out)
+    return out
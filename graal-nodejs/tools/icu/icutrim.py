@@ -21,6 +21,8 @@ import re
 import shutil
 import sys
 
+import icudata
+
 try:
     # for utf-8 on Python 2
     reload(sys)
@@ -82,6 +84,12 @@ parser.add_option('-L',"--locales",
                   help="sets the 'locales.only' variable",
                   default=None)
 
+parser.add_option("--use-tools",
+                    action="store_true",
+                    dest="usetools",
+                    help="always use the ICU tools instead of editing the data file in-process",
+                    default=False)
+
 parser.add_option('-e', '--endian', action='store', dest='endian', help='endian, big, little or host, your default is "%s".' % endian, default=endian, metavar='endianness')
 
 (options, args) = parser.parse_args()
@@ -142,6 +150,7 @@ if not options.outfile.endswith(".dat"):
 
 dataname=options.outfile[0:-4]
 
+RES_INDX = "res_index.res"
 
 ## TODO: need to improve this. Quotes, etc.
 def runcmd(tool, cmd, doContinue=False):
@@ -178,14 +187,50 @@ if "comment" in config:
 ## The first letter of endian_letter will be 'b' or 'l' for big or little
 endian_letter = options.endian[0]
 
-runcmd("icupkg", "-t%s %s %s""" % (endian_letter, options.datfile, outfile))
+def readPackage(filename):
+    """Reads a data file for in-process editing.
+    Returns (package, dependencies), or (None, None) if only the ICU tools can handle it."""
+    try:
+        pkg = icudata.Package.read(filename)
+        # make sure that every res_index can be regenerated
+        for item in pkg.names():
+            if item.endswith(RES_INDX):
+                others, locales = icudata.readResIndex(pkg.items[item])
+                icudata.writeResIndex(others, locales, pkg.isBigEndian)
+        return pkg, pkg.dependencies()
+    except icudata.DataError as e:
+        print("Using the ICU tools for %s: %s" % (filename, e))
+        return None, None
+
+pkg = None
+if not options.usetools:
+    pkg, dependencies = readPackage(options.datfile)
+    if pkg is not None and pkg.isBigEndian != (options.endian == "big"):
+        # swapping needs the swapper for each data format; leave that to icupkg
+        runcmd("icupkg", "-t%s %s %s""" % (endian_letter, options.datfile, outfile))
+        pkg, dependencies = readPackage(outfile)
+
+if pkg is not None:
+    # icupkg refuses to work with a package that has missing dependencies
+    missing = [(item, dep) for item in sorted(dependencies)
+               for dep in dependencies[item] if dep not in pkg]
+    for item, dep in missing:
+        print("Item %s depends on missing item %s" % (item, dep))
+    if missing:
+        print("FAILED: %s has missing dependencies" % options.datfile)
+        sys.exit(1)
+elif not os.path.isfile(outfile):
+    runcmd("icupkg", "-t%s %s %s""" % (endian_letter, options.datfile, outfile))
 
 ## STEP 2 - get listing
-listfile = os.path.join(options.tmpdir,"icudata.lst")
-runcmd("icupkg", "-l %s > %s""" % (outfile, listfile))
+if pkg is not None:
+    items = pkg.names()
+else:
+    listfile = os.path.join(options.tmpdir,"icudata.lst")
+    runcmd("icupkg", "-l %s > %s""" % (outfile, listfile))
 
-with open(listfile, 'rb') as fi:
-    items = [line.strip() for line in fi.read().decode("utf-8").splitlines()]
+    with open(listfile, 'rb') as fi:
+        items = [line.strip() for line in fi.read().decode("utf-8").splitlines()]
 itemset = set(items)
 
 if options.verbose > 1:
@@ -193,7 +238,6 @@ if options.verbose > 1:
 
 # list of all trees
 trees = {}
-RES_INDX = "res_index.res"
 remove = None
 # remove - always remove these
 if "remove" in config:
@@ -283,11 +327,16 @@ for i in range(len(items)):
             print("procesing %s" % (tree))
         trees[tree] = { "extension": ".res", "treeprefix": treeprefix, "hasIndex": True }
         # read in the resource list for the tree
-        treelistfile = os.path.join(options.tmpdir,"%s.lst" % tree)
-        runcmd("iculslocs", "-i %s -N %s -T %s -l > %s" % (outfile, dataname, tree, treelistfile))
-        with io.open(treelistfile, 'r', encoding='utf-8') as fi:
-            treeitems = fi.readlines()
-            trees[tree]["locs"] = [line.strip() for line in treeitems]
+        if pkg is not None:
+            others, locales = icudata.readResIndex(pkg.items[item])
+            trees[tree]["index"] = (others, locales)
+            trees[tree]["locs"] = [loc for loc in locales if "%s%s.res" % (treeprefix, loc) in itemset]
+        else:
+            treelistfile = os.path.join(options.tmpdir,"%s.lst" % tree)
+            runcmd("iculslocs", "-i %s -N %s -T %s -l > %s" % (outfile, dataname, tree, treelistfile))
+            with io.open(treelistfile, 'r', encoding='utf-8') as fi:
+                treeitems = fi.readlines()
+                trees[tree]["locs"] = [line.strip() for line in treeitems]
         if tree not in config.get("trees", {}):
             print(" Warning: filter file %s does not mention trees.%s - will be kept as-is" % (options.filterfile, tree))
         else:
@@ -335,14 +384,53 @@ def removeList(count=0):
                 sys.exit(1)
             removeList(count+1)
 
+def removeWithDependents():
+    # same as removeList(), but in-process, with the dependencies resolved up front
+    global remove
+    remove = remove - keep
+    removed = set()
+    for pattern in remove:
+        removed.update(pkg.findItems(pattern))
+    dependents = {}
+    for item in dependencies:
+        for dep in dependencies[item]:
+            dependents.setdefault(dep, []).append(item)
+    pending = list(removed)
+    while pending:
+        for item in dependents.get(pending.pop(), []):
+            if item in removed:
+                continue
+            if item in keep:
+                print(" ERROR: %s is to be kept but depends on a removed item. Fail." % item)
+                sys.exit(1)
+            if(options.verbose > 5):
+                print("<< %s added to delete" % item)
+            removed.add(item)
+            pending.append(item)
+    if(options.verbose>1):
+        print("%d items to remove, %d with their dependents" % (len(remove), len(removed)))
+    pkg.removeItems(removed)
+
 # fire it up
-removeList(1)
+if pkg is not None:
+    removeWithDependents()
+else:
+    removeList(1)
 
 # now, fixup res_index, one at a time
 for tree in trees:
     # skip trees that don't have res_index
     if "hasIndex" not in trees[tree]:
         continue
+    if pkg is not None:
+        # keep only the installed locales that are still in the package
+        others, locales = trees[tree]["index"]
+        treeprefix = trees[tree]["treeprefix"]
+        valid = [loc for loc in locales if "%s%s.res" % (treeprefix, loc) in pkg]
+        if(options.verbose>1):
+            print("%s: %d/%d locales" % (tree, len(valid), len(locales)))
+        pkg.setItem(treeprefix + RES_INDX, icudata.writeResIndex(others, valid, pkg.isBigEndian))
+        continue
     treebunddir = options.tmpdir
     if(trees[tree]["treeprefix"]):
         treebunddir = os.path.join(treebunddir, trees[tree]["treeprefix"])
@@ -353,3 +441,6 @@ for tree in trees:
     runcmd("iculslocs", "-i %s -N %s -T %s -b %s" % (outfile, dataname, tree, treebundtxt))
     runcmd("genrb","-d %s -s %s res_index.txt" % (treebunddir, treebunddir))
     runcmd("icupkg","-s %s -a %s%s %s" % (options.tmpdir, trees[tree]["treeprefix"], RES_INDX, outfile))
+
+if pkg is not None:
+    pkg.write(outfile)
@@ -8,6 +8,8 @@ import sys
 import argparse
 import collections
 import functools
+import hashlib
+import multiprocessing
 import re
 import copy
 try:
@@ -68,11 +70,13 @@ def read_config():
         cmdline_parser.add_argument("--jinja_dir", type=unicode, required=True)
         cmdline_parser.add_argument("--config", type=unicode, required=True)
         cmdline_parser.add_argument("--config_value", default=[], action="append")
+        cmdline_parser.add_argument("--jobs", type=int, default=0)
         arg_options = cmdline_parser.parse_args()
         jinja_dir = arg_options.jinja_dir
         output_base = arg_options.output_base
         config_file = arg_options.config
         config_values = arg_options.config_value
+        jobs = arg_options.jobs or multiprocessing.cpu_count()
     except Exception:
         # Work with python 2 and 3 http://docs.python.org/py3k/howto/pyporting.html
         exc = sys.exc_info()[1]
@@ -108,7 +112,7 @@ def read_config():
             parts = key_value.split("=")
             if len(parts) == 2:
                 defaults["." + parts[0]] = parts[1]
-        return (jinja_dir, config_file, init_defaults(config_partial, "", defaults))
+        return (jinja_dir, config_file, jobs, init_defaults(config_partial, "", defaults))
     except Exception:
         # Work with python 2 and 3 http://docs.python.org/py3k/howto/pyporting.html
         exc = sys.exc_info()[1]
@@ -558,10 +562,91 @@ class Protocol(object):
         return domain in self.generate_domains or domain in self.imported_domains
 
 
+# Name of the file in the protocol output directory which records the
+# fingerprint each output was last generated from.
+STATE_FILE_NAME = ".code_generator_state.json"
+
+
+def hash_files(file_names):
+    digest = hashlib.sha1()
+    for file_name in file_names:
+        with open(file_name, "rb") as input_file:
+            digest.update(input_file.read())
+    return digest.hexdigest()
+
+
+def domain_fingerprint(protocol, domain):
+    """Returns everything the templates read from |protocol| for |domain|."""
+    name = domain["domain"]
+    return [
+        domain,
+        name in protocol.generate_domains,
+        name in protocol.imported_domains,
+        name in protocol.exported_domains,
+        sorted(t for t in protocol.used_types if t.startswith(name + ".")),
+        dict((ref, protocol.type_definitions.get(ref)) for ref in protocol.all_references(domain)),
+        [(dependency, protocol.is_imported_dependency(dependency)) for dependency in domain.get("dependencies", [])],
+    ]
+
+
+# Templates and protocol shared with the rendering processes, which inherit
+# them when forked.
+render_state = None
+
+
+def render_output(task):
+    jinja_env, protocol, config = render_state
+    template_names, domain_name = task
+    if domain_name is None:
+        template_context = {
+            "config": config,
+            "format_include": functools.partial(format_include, config),
+        }
+    else:
+        template_context = {
+            "protocol": protocol,
+            "config": config,
+            "domain": protocol.domains_by_name[domain_name],
+            "join_arrays": join_arrays,
+            "format_include": functools.partial(format_include, config),
+            "format_domain_include": functools.partial(format_domain_include, config),
+        }
+    parts = [jinja_env.get_template(name).render(template_context) for name in template_names]
+    return "\n\n".join(parts)
+
+
+def render_outputs(tasks, jobs):
+    # Forking keeps the already loaded templates, so the processes never write
+    # to the bytecode cache concurrently.
+    if jobs > 1 and len(tasks) > 1 and hasattr(os, "fork"):
+        try:
+            context = multiprocessing.get_context("fork")
+        except AttributeError:
+            context = multiprocessing
+        pool = context.Pool(min(jobs, len(tasks)))
+        try:
+            return pool.map(render_output, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    return [render_output(task) for task in tasks]
+
+
+def write_if_changed(file_name, content):
+    if os.path.exists(file_name):
+        with open(file_name, "r") as out_file:
+            if out_file.read() == content:
+                return
+    with open(file_name, "w") as out_file:
+        out_file.write(content)
+
+
 def main():
-    jinja_dir, config_file, config = read_config()
+    global render_state
+    jinja_dir, config_file, jobs, config = read_config()
 
     protocol = Protocol(config)
+    protocol.domains_by_name = dict((domain["domain"], domain) for domain in protocol.json_api["domains"])
 
     if not config.exported and len(protocol.exported_domains):
         sys.stderr.write("Domains [%s] are exported, but config is missing export entry\n\n" % ", ".join(protocol.exported_domains))
@@ -573,52 +658,23 @@ def main():
         os.mkdir(config.exported.output)
     jinja_env = initialize_jinja_env(jinja_dir, config.protocol.output, config)
 
-    inputs = []
-    inputs.append(__file__)
-    inputs.append(config_file)
-    inputs.append(config.protocol.path)
-    if config.imported:
-        inputs.append(config.imported.path)
-    templates_dir = os.path.join(module_path, "templates")
-    inputs.append(os.path.join(templates_dir, "TypeBuilder_h.template"))
-    inputs.append(os.path.join(templates_dir, "TypeBuilder_cpp.template"))
-    inputs.append(os.path.join(templates_dir, "Exported_h.template"))
-    inputs.append(os.path.join(templates_dir, "Imported_h.template"))
-
-    h_template = jinja_env.get_template("templates/TypeBuilder_h.template")
-    cpp_template = jinja_env.get_template("templates/TypeBuilder_cpp.template")
-    exported_template = jinja_env.get_template("templates/Exported_h.template")
-    imported_template = jinja_env.get_template("templates/Imported_h.template")
-
-    outputs = dict()
+    # Each output is described by the templates it is rendered from and the
+    # domain it is rendered for, if any.
+    outputs = collections.OrderedDict()
 
     for domain in protocol.json_api["domains"]:
         class_name = domain["domain"]
         file_name = config.protocol.file_name_prefix + class_name
-        template_context = {
-            "protocol": protocol,
-            "config": config,
-            "domain": domain,
-            "join_arrays": join_arrays,
-            "format_include": functools.partial(format_include, config),
-            "format_domain_include": functools.partial(format_domain_include, config),
-        }
 
         if domain["domain"] in protocol.generate_domains:
-            outputs[os.path.join(config.protocol.output, to_file_name(config, file_name + ".h"))] = h_template.render(template_context)
-            outputs[os.path.join(config.protocol.output, to_file_name(config, file_name + ".cpp"))] = cpp_template.render(template_context)
+            outputs[os.path.join(config.protocol.output, to_file_name(config, file_name + ".h"))] = (["templates/TypeBuilder_h.template"], class_name)
+            outputs[os.path.join(config.protocol.output, to_file_name(config, file_name + ".cpp"))] = (["templates/TypeBuilder_cpp.template"], class_name)
             if domain["domain"] in protocol.exported_domains:
-                outputs[os.path.join(config.exported.output, to_file_name(config, file_name + ".h"))] = exported_template.render(template_context)
+                outputs[os.path.join(config.exported.output, to_file_name(config, file_name + ".h"))] = (["templates/Exported_h.template"], class_name)
         if domain["domain"] in protocol.imported_domains:
-            outputs[os.path.join(config.protocol.output, to_file_name(config, file_name + ".h"))] = imported_template.render(template_context)
+            outputs[os.path.join(config.protocol.output, to_file_name(config, file_name + ".h"))] = (["templates/Imported_h.template"], class_name)
 
     if config.lib:
-        template_context = {
-            "config": config,
-            "format_include": functools.partial(format_include, config),
-        }
-
-        lib_templates_dir = os.path.join(module_path, "lib")
         # Note these should be sorted in the right order.
         # TODO(dgozman): sort them programmatically based on commented includes.
         protocol_h_templates = [
@@ -657,34 +713,54 @@ def main():
             "base_string_adapter_cc.template",
         ]
 
-        def generate_lib_file(file_name, template_files):
-            parts = []
-            for template_file in template_files:
-                inputs.append(os.path.join(lib_templates_dir, template_file))
-                template = jinja_env.get_template("lib/" + template_file)
-                parts.append(template.render(template_context))
-            outputs[file_name] = "\n\n".join(parts)
-
-        generate_lib_file(os.path.join(config.lib.output, to_file_name(config, "Forward.h")), forward_h_templates)
-        generate_lib_file(os.path.join(config.lib.output, to_file_name(config, "Protocol.h")), protocol_h_templates)
-        generate_lib_file(os.path.join(config.lib.output, to_file_name(config, "Protocol.cpp")), protocol_cpp_templates)
-        generate_lib_file(os.path.join(config.lib.output, to_file_name(config, "base_string_adapter.h")), base_string_adapter_h_templates)
-        generate_lib_file(os.path.join(config.lib.output, to_file_name(config, "base_string_adapter.cc")), base_string_adapter_cc_templates)
-
-    # Make gyp / make generatos happy, otherwise make rebuilds world.
-    inputs_ts = max(map(os.path.getmtime, inputs))
-    up_to_date = True
-    for output_file in outputs.keys():
-        if not os.path.exists(output_file) or os.path.getmtime(output_file) < inputs_ts:
-            up_to_date = False
-            break
-    if up_to_date:
+        def lib_output(file_name, template_files):
+            outputs[file_name] = (["lib/" + template_file for template_file in template_files], None)
+
+        lib_output(os.path.join(config.lib.output, to_file_name(config, "Forward.h")), forward_h_templates)
+        lib_output(os.path.join(config.lib.output, to_file_name(config, "Protocol.h")), protocol_h_templates)
+        lib_output(os.path.join(config.lib.output, to_file_name(config, "Protocol.cpp")), protocol_cpp_templates)
+        lib_output(os.path.join(config.lib.output, to_file_name(config, "base_string_adapter.h")), base_string_adapter_h_templates)
+        lib_output(os.path.join(config.lib.output, to_file_name(config, "base_string_adapter.cc")), base_string_adapter_cc_templates)
+
+    # An output only needs to be rendered again when the generator, the config,
+    # its templates or the part of the protocol it is rendered from changed.
+    common_fingerprint = [hash_files([os.path.realpath(__file__)]), repr(config)]
+    domain_fingerprints = {}
+    fingerprints = {}
+    for file_name, (template_names, domain_name) in outputs.items():
+        fingerprint = common_fingerprint + [hash_files(os.path.join(module_path, name) for name in template_names)]
+        if domain_name is not None:
+            if domain_name not in domain_fingerprints:
+                domain_fingerprints[domain_name] = domain_fingerprint(protocol, protocol.domains_by_name[domain_name])
+            fingerprint.append(domain_fingerprints[domain_name])
+        fingerprints[file_name] = hashlib.sha1(json.dumps(fingerprint, sort_keys=True).encode("utf-8")).hexdigest()
+
+    state_file_name = os.path.join(config.protocol.output, STATE_FILE_NAME)
+    try:
+        with open(state_file_name, "r") as state_file:
+            state = json.load(state_file)
+    except (IOError, OSError, ValueError):
+        state = {}
+
+    stale_outputs = [file_name for file_name in outputs
+                     if state.get(file_name) != fingerprints[file_name] or not os.path.exists(file_name)]
+    if not stale_outputs:
         sys.exit()
 
-    for file_name, content in outputs.items():
-        out_file = open(file_name, "w")
-        out_file.write(content)
-        out_file.close()
+    # Load the templates before forking, see render_outputs.
+    for template_names, _ in outputs.values():
+        for name in template_names:
+            jinja_env.get_template(name)
+    render_state = (jinja_env, protocol, config)
+    contents = render_outputs([outputs[file_name] for file_name in stale_outputs], jobs)
+
+    # Leave unchanged outputs alone, so the build does not recompile them.
+    for file_name, content in zip(stale_outputs, contents):
+        write_if_changed(file_name, content)
+
+    state.update(fingerprints)
+    with open(state_file_name, "w") as state_file:
+        json.dump(state, state_file, indent=2, sort_keys=True)
 
 
 main()
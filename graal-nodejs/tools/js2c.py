@@ -30,12 +30,18 @@
 """
 This is a utility for converting JavaScript source code into uint16_t[],
 that are used for embedding JavaScript code into the Node.js binary.
+
+With `--mode blob` all modules are concatenated into one array per string
+width and registered from an index table, and with `--mode compressed` each
+module is zlib-compressed into a single blob and only inflated the first
+time its source is requested.
 """
 import argparse
 import os
 import re
 import functools
 import codecs
+import zlib
 
 def ReadFile(filename):
   if is_verbose:
@@ -49,7 +55,7 @@ TEMPLATE = """
 #include "env-inl.h"
 #include "node_native_module.h"
 #include "node_internals.h"
-
+{3}
 namespace node {{
 
 namespace native_module {{
@@ -83,12 +89,106 @@ static const uint16_t {0}[] = {{
 
 INITIALIZER = 'source_.emplace("{0}", UnionBytes{{{1}, {2}}});'
 
+# The `blob` and `compressed` modes keep all module sources in a single
+# array and register them from an index table instead of emitting one
+# array and one initializer per module.
+BLOB_DEFINITIONS = """
+struct SourceIndexEntry {{
+  const char* id;
+  size_t offset;  // In code units of the blob, bytes when compressed.
+  size_t size;  // Size of the compressed data, 0 if not compressed.
+  size_t length;  // In code units of the source.
+  bool one_byte;
+}};
+
+static const SourceIndexEntry source_index[] = {{
+{0}
+}};
+{1}{2}"""
+
+BLOB_EMPTY_DEFINITION = """
+static const {0}* const {1} = nullptr;
+"""
+
+BLOB_INITIALIZER = """for (const SourceIndexEntry& entry : source_index) {
+    if (entry.one_byte) {
+      source_.emplace(entry.id,
+                      UnionBytes{one_byte_sources + entry.offset,
+                                 entry.length});
+    } else {
+      source_.emplace(entry.id,
+                      UnionBytes{two_byte_sources + entry.offset,
+                                 entry.length});
+    }
+  }"""
+
+COMPRESSED_DEFINITIONS = """
+// Modules are stored zlib-compressed and inflated on first use.
+static const void* InflateSource(size_t index) {
+  static Mutex mutex;
+  static const void* inflated[arraysize(source_index)] = {};
+  Mutex::ScopedLock lock(mutex);
+  CHECK_LT(index, arraysize(source_index));
+  if (inflated[index] == nullptr) {
+    const SourceIndexEntry& entry = source_index[index];
+    uLongf size = entry.length * (entry.one_byte ? 1 : 2);
+    uint8_t* bytes = new uint8_t[size > 0 ? size : 1];
+    CHECK_EQ(uncompress(bytes, &size,
+                        compressed_sources + entry.offset, entry.size),
+             Z_OK);
+    CHECK_EQ(size, entry.length * (entry.one_byte ? 1 : 2));
+    if (entry.one_byte) {
+      inflated[index] = bytes;
+    } else {
+      // Two-byte sources are compressed as UTF-16LE.
+      uint16_t* code_units = new uint16_t[entry.length > 0 ? entry.length : 1];
+      for (size_t i = 0; i < entry.length; i++)
+        code_units[i] = bytes[2 * i] | (bytes[2 * i + 1] << 8);
+      delete[] bytes;
+      inflated[index] = code_units;
+    }
+  }
+  return inflated[index];
+}
+"""
+
+COMPRESSED_INITIALIZER = """for (size_t i = 0; i < arraysize(source_index); i++) {
+    const SourceIndexEntry& entry = source_index[i];
+    source_.emplace(entry.id,
+                    UnionBytes{InflateSource, i, entry.one_byte,
+                               entry.length});
+  }"""
+
+MODES = ('arrays', 'blob', 'compressed')
+
 CONFIG_GYPI_ID = 'config_raw'
 
 SLUGGER_RE =re.compile('[.\-/]')
 
 is_verbose = False
 
+def GetCodeUnits(source):
+  """Returns the code units of `source` and whether they fit in one byte."""
+  try:
+    return bytearray(source, 'ascii'), True
+  except UnicodeEncodeError:
+    pass
+  # Treat non-ASCII as UTF-8 and encode as UTF-16 Little Endian.
+  encoded_source = bytearray(source, 'utf-16le')
+  code_units = [
+    encoded_source[i] + (encoded_source[i + 1] * 256)
+    for i in range(0, len(encoded_source), 2)
+  ]
+  return code_units, False
+
+
+def FormatArray(code_units, step):
+  # Put no more then `step` code-points in a line.
+  return ',\n'.join(
+      ','.join(map(str, code_units[i:i + step]))
+      for i in range(0, len(code_units), step))
+
+
 def GetDefinition(var, source, step=30):
   template = ONE_BYTE_STRING
   code_points = [ord(c) for c in source]
@@ -133,13 +233,66 @@ def NormalizeFileName(filename):
   return os.path.splitext(filename)[0]
 
 
-def JS2C(source_files, target):
+def GetBlobDefinitions(source_files, compress, step=30):
+  """Returns the definitions for all modules in a single blob per width."""
+  one_byte = bytearray()
+  two_byte = []
+  compressed = bytearray()
+  entries = []
+  for filename in source_files:
+    code = ReadFile(filename)
+    code_units, is_one_byte = GetCodeUnits(code)
+    if compress:
+      if is_one_byte:
+        data = bytes(code_units)
+      else:
+        data = code.encode('utf-16le')
+      deflated = zlib.compress(data, 9)
+      offset, size = len(compressed), len(deflated)
+      compressed.extend(deflated)
+    elif is_one_byte:
+      offset, size = len(one_byte), 0
+      one_byte.extend(code_units)
+    else:
+      offset, size = len(two_byte), 0
+      two_byte.extend(code_units)
+    entries.append('  {"%s", %d, %d, %d, %s},' % (
+        NormalizeFileName(filename), offset, size, len(code_units),
+        'true' if is_one_byte else 'false'))
+
+  if compress:
+    blobs = [('uint8_t', 'compressed_sources', compressed)]
+  else:
+    blobs = [('uint8_t', 'one_byte_sources', one_byte),
+             ('uint16_t', 'two_byte_sources', two_byte)]
+  definitions = []
+  for c_type, var, code_units in blobs:
+    if not code_units:
+      definitions.append(BLOB_EMPTY_DEFINITION.format(c_type, var))
+    elif c_type == 'uint8_t':
+      definitions.append(ONE_BYTE_STRING.format(
+          var, FormatArray(code_units, step)))
+    else:
+      definitions.append(TWO_BYTE_STRING.format(
+          var, FormatArray(code_units, step)))
+  return BLOB_DEFINITIONS.format(
+      '\n'.join(entries), ''.join(definitions),
+      COMPRESSED_DEFINITIONS if compress else '')
+
+
+def JS2C(source_files, target, mode='arrays'):
   # Build source code lines
   definitions = []
   initializers = []
 
-  for filename in source_files['.js']:
-    AddModule(filename, definitions, initializers)
+  if mode == 'arrays':
+    for filename in source_files['.js']:
+      AddModule(filename, definitions, initializers)
+  else:
+    compress = mode == 'compressed'
+    definitions.append(GetBlobDefinitions(source_files['.js'], compress))
+    initializers.append(
+        COMPRESSED_INITIALIZER if compress else BLOB_INITIALIZER)
 
   config_def, config_size = handle_config_gypi(source_files['config.gypi'])
   definitions.append(config_def)
@@ -147,7 +300,8 @@ def JS2C(source_files, target):
   # Emit result
   definitions = ''.join(definitions)
   initializers = '\n  '.join(initializers)
-  out = TEMPLATE.format(definitions, initializers, config_size)
+  includes = '#include "zlib.h"\n' if mode == 'compressed' else ''
+  out = TEMPLATE.format(definitions, initializers, config_size, includes)
   write_if_chaged(out, target)
 
 
@@ -201,6 +355,13 @@ def main():
   )
   parser.add_argument('--target', help='output file')
   parser.add_argument('--verbose', action='store_true', help='output file')
+  parser.add_argument(
+    '--mode',
+    choices=MODES,
+    default='arrays',
+    help='emit one array per module (arrays), all modules in one blob '
+         '(blob), or one blob of modules compressed with zlib that are '
+         'inflated on first use (compressed)')
   parser.add_argument('sources', nargs='*', help='input files')
   options = parser.parse_args()
   global is_verbose
@@ -211,7 +372,7 @@ def main():
   # Currently config.gypi is the only `.gypi` file allowed
   assert source_files['.gypi'] == ['config.gypi']
   source_files['config.gypi'] = source_files.pop('.gypi')[0]
-  JS2C(source_files, options.target)
+  JS2C(source_files, options.target, options.mode)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,82 @@
+'use strict';
+// Long-lived test server used by `tools/test.py --reuse-vm`.
+//
+// Reads one JSON request per line from stdin of the form
+//   { "file": "<path>", "env": { ... } }
+// runs the file in a fresh worker thread and writes one JSON line
+//   { "exitCode": <n>, "stdout": "<...>", "stderr": "<...>" }
+// to stdout once the worker has exited. Requests are processed one at a time.
+
+const path = require('path');
+const readline = require('readline');
+const util = require('util');
+const { Worker } = require('worker_threads');
+
+const queue = [];
+let running = false;
+
+function respond(result) {
+  process.stdout.write(`${JSON.stringify(result)}\n`);
+}
+
+function runNext() {
+  if (running || queue.length === 0)
+    return;
+  running = true;
+  const { file, env } = queue.shift();
+  const stdout = [];
+  const stderr = [];
+  let exitCode = null;
+  let pending = 3;
+
+  function done() {
+    if (--pending > 0)
+      return;
+    respond({
+      exitCode,
+      stdout: stdout.join(''),
+      stderr: stderr.join('')
+    });
+    running = false;
+    runNext();
+  }
+
+  let worker;
+  try {
+    worker = new Worker(path.resolve(process.cwd(), file), {
+      env: Object.assign({}, process.env, env),
+      stdout: true,
+      stderr: true
+    });
+  } catch (err) {
+    respond({ exitCode: 1, stdout: '', stderr: `${util.inspect(err)}\n` });
+    running = false;
+    runNext();
+    return;
+  }
+  worker.stdout.setEncoding('utf8');
+  worker.stderr.setEncoding('utf8');
+  worker.stdout.on('data', (chunk) => stdout.push(chunk));
+  worker.stderr.on('data', (chunk) => stderr.push(chunk));
+  worker.stdout.on('end', done);
+  worker.stderr.on('end', done);
+  worker.on('error', (err) => stderr.push(`${util.inspect(err)}\n`));
+  worker.on('exit', (code) => {
+    exitCode = code;
+    done();
+  });
+}
+
+readline.createInterface({ input: process.stdin })
+  .on('line', (line) => {
+    if (line.trim() === '')
+      return;
+    queue.push(JSON.parse(line));
+    runNext();
+  })
+  .on('close', () => {
+    // The runner closes stdin to ask for a graceful shutdown.
+    queue.length = 0;
+    if (!running)
+      process.exit(0);
+  });
@@ -43,6 +43,11 @@
 # into a C++ header file. The resulting snapshots are thus embedded in the resulting
 # Node.js binary.
 
+from __future__ import print_function
+
+import hashlib
+import multiprocessing
+import optparse
 import os
 import re
 import sys
@@ -92,33 +97,124 @@ SNAPSHOT_DATA_DECLARATION = """\
 SNAPSHOT_MAP_ENTRY = """\
     snapshots_map.insert({ "%(id)s", { %(escaped_id)s_snapshot, sizeof(%(escaped_id)s_snapshot) } });"""
 
+# Decimal representation of every byte value, so that encoding a snapshot is
+# a single table lookup per byte.
+BYTE_STRINGS = [str(b) for b in range(256)]
 
-def JS2C(modules, target):
-  # Build source code lines
-  data_lines = []
-  record_lines = []
+# Fragments are cached in a directory next to the target. The first line of
+# every fragment holds the hash of the snapshot it was generated from, mixed
+# with the hash of this script, so that template changes regenerate them.
+CACHE_SUFFIX = '.cache'
+HASH_PREFIX = '// sha1: '
 
-  for m in modules:
-    contents = ReadBinaryFile(m)
 
-    data = ','.join(str(ord(c)) for c in contents)
+def GetIds(m):
+  # On Windows, "./foo.bar" in the .gyp file is passed as "foo.bar"
+  # so don't assume there is always a slash in the file path.
+  if '/' in m or '\\' in m:
+    id = '/'.join(re.split('/|\\\\', m)[1:])
+  else:
+    id = m
 
-    # On Windows, "./foo.bar" in the .gyp file is passed as "foo.bar"
-    # so don't assume there is always a slash in the file path.
-    if '/' in m or '\\' in m:
-      id = '/'.join(re.split('/|\\\\', m)[1:])
-    else:
-      id = m
+  if id.endswith('.bin'):
+    id = id[:-4]
 
-    if id.endswith('.bin'):
-      id = id[:-4]
+  escaped_id = id.replace('.', '_').replace('-', '_').replace('/', '_')
+  return id, escaped_id
 
-    escaped_id = id.replace('.', '_').replace('-', '_').replace('/', '_')
 
-    data_lines.append(SNAPSHOT_DATA_DECLARATION % {
-      'escaped_id': escaped_id,
-      'data': data
-    })
+def HashFile(filename):
+  return hashlib.sha1(ReadBinaryFile(filename)).hexdigest()
+
+
+def ScriptPath():
+  script = os.path.abspath(__file__)
+  if script.endswith('.pyc'):
+    script = script[:-1]
+  return script
+
+
+def EncodeSnapshot(contents, escaped_id):
+  data = ','.join([BYTE_STRINGS[b] for b in bytearray(contents)])
+  return SNAPSHOT_DATA_DECLARATION % {
+    'escaped_id': escaped_id,
+    'data': data
+  }
+
+
+def WriteFragment(args):
+  """Encodes one snapshot into its cached fragment file."""
+  (m, escaped_id, digest, fragment_path) = args
+  fragment = EncodeSnapshot(ReadBinaryFile(m), escaped_id)
+  with open(fragment_path, "w") as output:
+    output.write(HASH_PREFIX + digest + '\n')
+    output.write(fragment)
+
+
+def ReadFragmentHash(fragment_path):
+  if not os.path.exists(fragment_path):
+    return None
+  with open(fragment_path, "r") as f:
+    line = f.readline()
+  if not line.startswith(HASH_PREFIX):
+    return None
+  return line[len(HASH_PREFIX):].strip()
+
+
+def ReadFragment(fragment_path):
+  with open(fragment_path, "r") as f:
+    f.readline()
+    return f.read()
+
+
+def JS2C(modules, target, jobs=None):
+  cache_dir = target + CACHE_SUFFIX
+  if not os.path.isdir(cache_dir):
+    os.makedirs(cache_dir)
+
+  script = ScriptPath()
+  script_digest = HashFile(script)
+
+  # Determine which fragments need to be (re)generated.
+  entries = []
+  stale = []
+  # Sorting makes the header independent of the order of the arguments.
+  for m in sorted(modules, key=lambda m: GetIds(m)[0]):
+    id, escaped_id = GetIds(m)
+    digest = hashlib.sha1((script_digest + HashFile(m)).encode('ascii')).hexdigest()
+    fragment_path = os.path.join(cache_dir, escaped_id + '.inc')
+    if ReadFragmentHash(fragment_path) != digest:
+      stale.append((m, escaped_id, digest, fragment_path))
+    entries.append((id, escaped_id, digest, fragment_path))
+
+  if len(stale) > 1 and jobs != 1:
+    pool = multiprocessing.Pool(jobs)
+    try:
+      pool.map(WriteFragment, stale)
+    finally:
+      pool.close()
+      pool.join()
+  else:
+    for args in stale:
+      WriteFragment(args)
+
+  # The manifest lists the snapshots the current target was built from, so
+  # that an unchanged module set does not need to reassemble the header.
+  manifest = 'script %s\n' % script_digest + ''.join(
+      '%s %s\n' % (id, digest) for (id, _, digest, _) in entries)
+  manifest_path = os.path.join(cache_dir, 'manifest')
+  if (os.path.exists(target) and os.path.exists(manifest_path) and
+      os.path.getmtime(target) > os.path.getmtime(script)):
+    with open(manifest_path, "r") as f:
+      if f.read() == manifest:
+        print('%s is already up-to-date' % target)
+        return
+
+  # Build source code lines
+  data_lines = []
+  record_lines = []
+  for (id, escaped_id, _, fragment_path) in entries:
+    data_lines.append(ReadFragment(fragment_path))
     record_lines.append(SNAPSHOT_MAP_ENTRY % {
       'id': id,
       'escaped_id': escaped_id
@@ -137,17 +233,26 @@ def JS2C(modules, target):
   }
 
   if new_content != old_content:
-    print 'creating %s' % target
+    print('creating %s' % target)
     with open(target, "w") as output:
       output.write(new_content)
   else:
-    print '%s is already up-to-date' % target
+    print('%s is already up-to-date' % target)
+  with open(manifest_path, "w") as f:
+    f.write(manifest)
 
 
 def main():
-  target = sys.argv[1]
-  snapshot_files = sys.argv[2:]
-  JS2C(snapshot_files, target)
+  parser = optparse.OptionParser(
+      usage='%prog [options] target snapshot_files...')
+  parser.add_option('-j', '--jobs', type='int', default=None,
+      help='Number of processes encoding snapshots (default: all cores)')
+  (options, args) = parser.parse_args()
+  if len(args) < 1:
+    parser.error('missing target')
+  target = args[0]
+  snapshot_files = args[1:]
+  JS2C(snapshot_files, target, options.jobs)
 
 
 if __name__ == "__main__":
@@ -43,6 +43,8 @@ import utils
 import multiprocessing
 import errno
 import copy
+import heapq
+import json
 
 
 if sys.version_info >= (3, 5):
@@ -75,6 +77,11 @@ except ImportError:
 
 from functools import reduce
 
+try:
+  import selectors  # Python 3
+except ImportError:
+  selectors = None  # Python 2
+
 try:
   from urllib.parse import unquote    # Python 3
 except ImportError:
@@ -101,7 +108,9 @@ class ProgressIndicator(object):
     self.flaky_tests_mode = flaky_tests_mode
     self.parallel_queue = Queue(len(cases))
     self.sequential_queue = Queue(len(cases))
-    for case in cases:
+    # Start the tests that are expected to take longest first, so that the
+    # run does not end with a few long tests on otherwise idle cores.
+    for case in SortByExpectedDuration(cases):
       if case.parallel:
         self.parallel_queue.put_nowait(case)
       else:
@@ -200,6 +209,107 @@ class ProgressIndicator(object):
       self.lock.release()
 
 
+def GetDefaultDuration(cases):
+  # Tests without history are assumed to take an average amount of time.
+  known = [c.expected_duration for c in cases
+           if c.expected_duration is not None]
+  if not known:
+    return None
+  return sum(known) / len(known)
+
+
+def SortByExpectedDuration(cases):
+  default = GetDefaultDuration(cases)
+  if default is None:
+    return list(cases)
+  def ExpectedDuration(case):
+    if case.expected_duration is None:
+      return default
+    return case.expected_duration
+  # sorted() is stable, so ties keep the discovery order.
+  return sorted(cases, key=ExpectedDuration, reverse=True)
+
+
+class TimingDatabase(object):
+  """Per-test durations of previous runs, persisted as a JSON file that maps
+  arch/mode/test path to an exponential moving average in seconds."""
+
+  # Weight of the newest measurement in the moving average.
+  SMOOTHING = 0.5
+
+  def __init__(self, path):
+    self.path = path
+    self.durations = {}
+    if exists(path):
+      try:
+        with open(path, encoding='utf8') as f:
+          self.durations = json.load(f)
+      except ValueError:
+        print("Ignoring malformed timing database %s" % path)
+
+  def GetKey(self, case):
+    return "/".join([case.arch, case.mode] + case.path)
+
+  def Get(self, case):
+    return self.durations.get(self.GetKey(case))
+
+  def Update(self, cases):
+    for case in cases:
+      if case.duration is None:
+        continue
+      measured = TimedeltaToSeconds(case.duration)
+      key = self.GetKey(case)
+      previous = self.durations.get(key)
+      if previous is None:
+        self.durations[key] = measured
+      else:
+        self.durations[key] = (self.SMOOTHING * measured +
+                               (1 - self.SMOOTHING) * previous)
+
+  def Save(self):
+    directory = dirname(self.path)
+    if directory and not exists(directory):
+      os.makedirs(directory)
+    data = json.dumps(self.durations, indent=0, sort_keys=True,
+                      separators=(',', ': '))
+    if isinstance(data, bytes):  # Python 2
+      data = data.decode('utf8')
+    # Write to a temporary file and rename it over the database, so that an
+    # interrupted or concurrent run never leaves a truncated file behind.
+    (fd, tmp) = tempfile.mkstemp(dir=directory or '.',
+                                 prefix=basename(self.path) + '.')
+    try:
+      with open(fd, 'w', encoding='utf8') as f:
+        f.write(data)
+      if sys.platform == 'win32' and exists(self.path):
+        # rename doesn't replace existing files on Windows.
+        os.remove(self.path)
+      os.rename(tmp, self.path)
+    except:
+      if exists(tmp):
+        os.remove(tmp)
+      raise
+
+
+def SplitIntoBalancedShards(cases, count):
+  """Distributes the cases over `count` shards by greedily assigning the
+  longest remaining test to the shard with the least predicted time."""
+  shards = [[] for i in range(count)]
+  heap = [(0.0, i) for i in range(count)]
+  # Without any history this degrades to balancing the number of tests.
+  default = GetDefaultDuration(cases) or 1.0
+  ordered = SortByExpectedDuration(
+      sorted(cases, key=lambda c: (c.arch, c.mode, c.file)))
+  for case in ordered:
+    (total, index) = heapq.heappop(heap)
+    shards[index].append(case)
+    expected = case.expected_duration
+    if expected is None:
+      expected = default
+    heapq.heappush(heap, (total + expected, index))
+  return shards
+
+
 def EscapeCommand(command):
   parts = []
   for part in command:
@@ -521,6 +631,7 @@ class TestCase(object):
     self.path = path
     self.context = context
     self.duration = None
+    self.expected_duration = None
     self.arch = arch
     self.mode = mode
     self.parallel = False
@@ -541,6 +652,9 @@ class TestCase(object):
   def GetSource(self):
     return "(no source available)"
 
+  def CanReuseVm(self):
+    return False
+
   def RunCommand(self, command, env):
     full_command = self.context.processor(command)
     output = Execute(full_command,
@@ -554,11 +668,15 @@ class TestCase(object):
                       self.context.store_unexpected_output)
 
   def Run(self):
+    env = {
+      "TEST_THREAD_ID": "%d" % self.thread_id,
+      "TEST_PARALLEL" : "%d" % self.parallel
+    }
     try:
-      result = self.RunCommand(self.GetCommand(), {
-        "TEST_THREAD_ID": "%d" % self.thread_id,
-        "TEST_PARALLEL" : "%d" % self.parallel
-      })
+      if self.context.vm_pool is not None and self.CanReuseVm():
+        result = self.context.vm_pool.RunTest(self, env)
+      else:
+        result = self.RunCommand(self.GetCommand(), env)
     finally:
       # Tests can leave the tty in non-blocking mode. If the test runner
       # tries to print to stdout/stderr after that and the tty buffer is
@@ -619,10 +737,6 @@ def KillProcessWithID(pid, signal_to_send=signal.SIGTERM):
     os.kill(pid, signal_to_send)
 
 
-MAX_SLEEP_TIME = 0.1
-INITIAL_SLEEP_TIME = 0.0001
-SLEEP_TIME_FACTOR = 1.25
-
 SEM_INVALID_VALUE = -1
 SEM_NOGPFAULTERRORBOX = 0x0002 # Microsoft Platform SDK WinBase.h
 
@@ -646,7 +760,130 @@ def KillTimedOutProcess(context, pid):
   KillProcessWithID(pid, signal_to_send)
 
 
-def RunProcess(context, timeout, args, **rest):
+class ProcessWaiter(object):
+
+  def __init__(self, context, process):
+    self.context = context
+    self.process = process
+    self.exit_code = None
+    self.timed_out = False
+    self.done = threading.Event()
+
+  def Finish(self, exit_code):
+    self.exit_code = exit_code
+    self.done.set()
+
+
+class ProcessReaper(object):
+  """Waits for the exit of all test processes from a single thread and
+  enforces their timeouts from a heap of deadlines, so that the runner
+  threads are woken up as soon as their process exits instead of polling.
+
+  On Linux exits are observed through pidfds. Elsewhere every process gets
+  a helper thread blocking in wait() and the reaper only handles timeouts."""
+
+  def __init__(self):
+    self.lock = threading.Condition()
+    self.deadlines = []
+    self.sequence = 0
+    self.pending = []
+    self.selector = None
+    if selectors is not None and hasattr(os, 'pidfd_open'):
+      self.selector = selectors.DefaultSelector()
+      (self.wakeup_read, self.wakeup_write) = os.pipe()
+      self.selector.register(self.wakeup_read, selectors.EVENT_READ, None)
+    thread = threading.Thread(target=self._Loop)
+    thread.daemon = True
+    thread.start()
+
+  def Wait(self, context, process, timeout):
+    waiter = ProcessWaiter(context, process)
+    with self.lock:
+      if timeout is not None:
+        self.sequence += 1
+        heapq.heappush(self.deadlines,
+                       (time.time() + timeout, self.sequence, waiter))
+      if self.selector is not None:
+        self.pending.append(waiter)
+      self._Wakeup()
+    if self.selector is None:
+      self._WaitInThread(waiter)
+    # Wait with a timeout so that signals (ctrl-c) will be processed.
+    while not waiter.done.wait(1000000):
+      pass
+    return (waiter.exit_code, waiter.timed_out)
+
+  def _WaitInThread(self, waiter):
+    def WaitForExit():
+      waiter.Finish(waiter.process.wait())
+    thread = threading.Thread(target=WaitForExit)
+    thread.daemon = True
+    thread.start()
+
+  def _Wakeup(self):
+    if self.selector is not None:
+      os.write(self.wakeup_write, b'x')
+    else:
+      self.lock.notify()
+
+  def _ExpireDeadlines(self):
+    # Must be called with the lock held. Returns the number of seconds
+    # until the next deadline, or None if there is none.
+    now = time.time()
+    while self.deadlines:
+      (deadline, _, waiter) = self.deadlines[0]
+      if waiter.done.is_set():
+        heapq.heappop(self.deadlines)
+      elif deadline <= now:
+        heapq.heappop(self.deadlines)
+        waiter.timed_out = True
+        KillTimedOutProcess(waiter.context, waiter.process.pid)
+      else:
+        return deadline - now
+    return None
+
+  def _Loop(self):
+    while True:
+      with self.lock:
+        timeout = self._ExpireDeadlines()
+        if self.selector is None:
+          self.lock.wait(timeout)
+          continue
+        pending = self.pending
+        self.pending = []
+      for waiter in pending:
+        try:
+          pidfd = os.pidfd_open(waiter.process.pid)
+        except OSError:
+          # pidfds are not supported by the kernel or the sandbox.
+          self._WaitInThread(waiter)
+          continue
+        self.selector.register(pidfd, selectors.EVENT_READ, waiter)
+      if pending:
+        continue
+      for (key, _) in self.selector.select(timeout):
+        if key.data is None:
+          os.read(self.wakeup_read, 4096)
+          continue
+        self.selector.unregister(key.fd)
+        os.close(key.fd)
+        # The pidfd is readable, so the process has exited and wait() will
+        # not block.
+        key.data.Finish(key.data.process.wait())
+
+
+process_reaper = None
+process_reaper_lock = threading.Lock()
+
+def GetProcessReaper():
+  global process_reaper
+  with process_reaper_lock:
+    if process_reaper is None:
+      process_reaper = ProcessReaper()
+    return process_reaper
+
+
+def RunProcess(context, timeout, args, on_start=None, **rest):
   if context.verbose: print("#", " ".join(args))
   popen_args = args
   prev_error_mode = SEM_INVALID_VALUE
@@ -665,28 +902,11 @@ def RunProcess(context, timeout, args, **rest):
   )
   if utils.IsWindows() and context.suppress_dialogs and prev_error_mode != SEM_INVALID_VALUE:
     Win32SetErrorMode(prev_error_mode)
-  # Compute the end time - if the process crosses this limit we
-  # consider it timed out.
-  if timeout is None: end_time = None
-  else: end_time = time.time() + timeout
-  timed_out = False
-  # Repeatedly check the exit code from the process in a
-  # loop and keep track of whether or not it times out.
-  exit_code = None
-  sleep_time = INITIAL_SLEEP_TIME
-
-  while exit_code is None:
-    if (not end_time is None) and (time.time() >= end_time):
-      # Kill the process and wait for it to exit.
-      KillTimedOutProcess(context, process.pid)
-      exit_code = process.wait()
-      timed_out = True
-    else:
-      exit_code = process.poll()
-      time.sleep(sleep_time)
-      sleep_time = sleep_time * SLEEP_TIME_FACTOR
-      if sleep_time > MAX_SLEEP_TIME:
-        sleep_time = MAX_SLEEP_TIME
+  if on_start is not None:
+    on_start(process)
+  # If the process exceeds the timeout it is killed and we consider it timed
+  # out.
+  (exit_code, timed_out) = GetProcessReaper().Wait(context, process, timeout)
   return (process, exit_code, timed_out)
 
 
@@ -709,12 +929,7 @@ def CheckedUnlink(name):
       PrintError("os.unlink() " + str(e))
     break
 
-def Execute(args, context, timeout=None, env=None, disable_core_files=False, stdin=None):
-  (fd_out, outname) = tempfile.mkstemp()
-  (fd_err, errname) = tempfile.mkstemp()
-
-  if env is None:
-    env = {}
+def GetTestEnvironment(env=None):
   env_copy = os.environ.copy()
 
   # Remove NODE_PATH
@@ -726,8 +941,73 @@ def Execute(args, context, timeout=None, env=None, disable_core_files=False, std
     del env_copy["NODE_REPL_EXTERNAL_MODULE"]
 
   # Extend environment
-  for key, value in env.items():
-    env_copy[key] = value
+  if env is not None:
+    for key, value in env.items():
+      env_copy[key] = value
+  return env_copy
+
+
+# Time to wait for the output pipes to be closed after the process exited.
+# Background processes spawned by a test may keep them open indefinitely.
+OUTPUT_DRAIN_TIMEOUT = 1.0
+DEFAULT_OUTPUT_BUFFER_SIZE = 16 * 1024 * 1024
+
+class OutputCapture(object):
+  """Drains a pipe into an in-memory buffer from a helper thread. Once more
+  than `limit` bytes have been read, the buffer and all further output are
+  spilled into a temporary file."""
+
+  def __init__(self, pipe, limit):
+    self.pipe = pipe
+    self.limit = limit
+    self.chunks = []
+    self.size = 0
+    self.spill_fd = None
+    self.spill_name = None
+    self.abandoned = False
+    self.lock = threading.Lock()
+    self.thread = threading.Thread(target=self._Drain)
+    self.thread.daemon = True
+    self.thread.start()
+
+  def _Drain(self):
+    fd = self.pipe.fileno()
+    while True:
+      chunk = os.read(fd, 65536)
+      if not chunk:
+        break
+      with self.lock:
+        if self.abandoned:
+          continue
+        if self.spill_fd is not None:
+          os.write(self.spill_fd, chunk)
+          continue
+        self.chunks.append(chunk)
+        self.size += len(chunk)
+        if self.size > self.limit:
+          (self.spill_fd, self.spill_name) = tempfile.mkstemp()
+          os.write(self.spill_fd, b''.join(self.chunks))
+          self.chunks = []
+    self.pipe.close()
+
+  def Get(self, deadline):
+    self.thread.join(max(0, deadline - time.time()))
+    with self.lock:
+      # Anything written after this point, e.g. by a background process
+      # spawned by the test, is dropped.
+      self.abandoned = True
+      if self.spill_fd is None:
+        data = b''.join(self.chunks).decode('utf8')
+        # Match the universal newlines mode used when reading files.
+        return data.replace('\r\n', '\n').replace('\r', '\n')
+      os.close(self.spill_fd)
+      result = open(self.spill_name, encoding='utf8').read()
+      CheckedUnlink(self.spill_name)
+      return result
+
+
+def Execute(args, context, timeout=None, env=None, disable_core_files=False, stdin=None):
+  env_copy = GetTestEnvironment(env)
 
   preexec_fn = None
 
@@ -737,26 +1017,142 @@ def Execute(args, context, timeout=None, env=None, disable_core_files=False, std
       resource.setrlimit(resource.RLIMIT_CORE, (0,0))
     preexec_fn = disableCoreFiles
 
+  captures = []
+  def CaptureOutput(process):
+    for pipe in (process.stdout, process.stderr):
+      captures.append(OutputCapture(pipe, context.output_buffer_size))
+
   (process, exit_code, timed_out) = RunProcess(
     context,
     timeout,
+    on_start = CaptureOutput,
     args = args,
     stdin = stdin,
-    stdout = fd_out,
-    stderr = fd_err,
+    stdout = subprocess.PIPE,
+    stderr = subprocess.PIPE,
     env = env_copy,
     preexec_fn = preexec_fn
   )
-  os.close(fd_out)
-  os.close(fd_err)
-  output = open(outname, encoding='utf8').read()
-  errors = open(errname, encoding='utf8').read()
-  CheckedUnlink(outname)
-  CheckedUnlink(errname)
+  drain_deadline = time.time() + OUTPUT_DRAIN_TIMEOUT
+  (output, errors) = [capture.Get(drain_deadline) for capture in captures]
 
   return CommandOutput(exit_code, timed_out, output, errors)
 
 
+class VmServer(object):
+  """A long-lived node process that runs test files in fresh worker threads
+  (see tools/run-worker-server.js), so that the VM startup is paid once per
+  server rather than once per test."""
+
+  def __init__(self, context, command):
+    self.context = context
+    self.command = command
+    self.tests_run = 0
+    self.responses = Queue()
+    self.stderr = []
+    if context.verbose: print("#", " ".join(command))
+    self.process = subprocess.Popen(
+      args = command,
+      stdin = subprocess.PIPE,
+      stdout = subprocess.PIPE,
+      stderr = subprocess.PIPE,
+      env = GetTestEnvironment()
+    )
+    for target in (self._ReadResponses, self._ReadStderr):
+      thread = threading.Thread(target=target)
+      thread.daemon = True
+      thread.start()
+
+  def _ReadResponses(self):
+    for line in iter(self.process.stdout.readline, b''):
+      self.responses.put(json.loads(line.decode('utf8')))
+    # None signals that the server is gone.
+    self.responses.put(None)
+
+  def _ReadStderr(self):
+    for line in iter(self.process.stderr.readline, b''):
+      self.stderr.append(line.decode('utf8', 'replace'))
+
+  def Run(self, file, timeout, env):
+    self.tests_run += 1
+    del self.stderr[:]
+    request = json.dumps({'file': file, 'env': env}) + '\n'
+    try:
+      self.process.stdin.write(request.encode('utf8'))
+      self.process.stdin.flush()
+      response = self.responses.get(timeout=timeout)
+    except Empty:
+      KillTimedOutProcess(self.context, self.process.pid)
+      exit_code = self.process.wait()
+      return CommandOutput(exit_code, True, '', ''.join(self.stderr))
+    except (IOError, OSError):
+      response = None
+    if response is None:
+      # The whole server died, e.g. the test called process.abort().
+      exit_code = self.process.wait()
+      return CommandOutput(exit_code, False, '', ''.join(self.stderr))
+    return CommandOutput(response['exitCode'], False, response['stdout'],
+                         response['stderr'] + ''.join(self.stderr))
+
+  def IsAlive(self):
+    return self.process.poll() is None
+
+  def Shutdown(self):
+    if not self.IsAlive():
+      return
+    try:
+      self.process.stdin.close()
+      self.process.wait()
+    except (IOError, OSError):
+      pass
+
+
+class VmServerPool(object):
+  """Hands out one VmServer per runner thread and recycles servers after a
+  crash, a timeout or a fixed number of tests."""
+
+  def __init__(self, context, recycle_after):
+    self.context = context
+    self.recycle_after = recycle_after
+    self.servers = {}
+    self.lock = threading.Lock()
+
+  def GetCommand(self, test):
+    vm = test.context.GetVm(test.arch, test.mode)
+    server = join(self.context.workspace, 'tools', 'run-worker-server.js')
+    return self.context.processor([vm] + self.context.node_args + [server])
+
+  def GetServer(self, test):
+    command = self.GetCommand(test)
+    key = (test.thread_id, tuple(command))
+    with self.lock:
+      server = self.servers.get(key)
+    if server is not None and (not server.IsAlive() or
+                               server.tests_run >= self.recycle_after):
+      server.Shutdown()
+      server = None
+    if server is None:
+      server = VmServer(self.context, command)
+      with self.lock:
+        self.servers[key] = server
+    return server
+
+  def RunTest(self, test, env):
+    server = self.GetServer(test)
+    output = server.Run(test.file, self.context.GetTimeout(test.mode), env)
+    return TestOutput(test,
+                      server.command + [test.file],
+                      output,
+                      self.context.store_unexpected_output)
+
+  def Shutdown(self):
+    with self.lock:
+      servers = list(self.servers.values())
+      self.servers.clear()
+    for server in servers:
+      server.Shutdown()
+
+
 def CarCdr(path):
   if len(path) == 0:
     return (None, [ ])
@@ -888,6 +1284,8 @@ class Context(object):
     self.abort_on_timeout = abort_on_timeout
     self.v8_enable_inspector = True
     self.node_has_crypto = True
+    self.vm_pool = None
+    self.output_buffer_size = DEFAULT_OUTPUT_BUFFER_SIZE
 
   def GetVm(self, arch, mode):
     if self.vm is not None:
@@ -1187,9 +1585,10 @@ class Configuration(object):
     sections = [ s for s in self.sections if s.condition.Evaluate(env, self.defs) ]
     all_rules = reduce(list.__add__, [s.rules for s in sections], [])
     unused_rules = set(all_rules)
+    index = RuleIndex(all_rules)
     result = []
     for case in cases:
-      matches = [ r for r in all_rules if r.Contains(case.path) ]
+      matches = index.GetMatchingRules(case.path)
       outcomes_list = [ r.GetOutcomes(env, self.defs) for r in matches ]
       outcomes = reduce(set.union, outcomes_list, set())
       unused_rules.difference_update(matches)
@@ -1234,6 +1633,62 @@ class Rule(object):
     return True
 
 
+class RuleIndex(object):
+  """A trie over the path components of a set of rules. Literal components
+  are looked up by hashing, components containing wildcards are matched
+  against the remaining path component one by one. GetMatchingRules(path)
+  returns the same rules as filtering with Rule.Contains(path)."""
+
+  def __init__(self, rules):
+    self.root = RuleIndexNode()
+    for rule in rules:
+      node = self.root
+      for pattern in rule.path:
+        node = node.GetChild(pattern)
+      node.rules.append(rule)
+
+  def GetMatchingRules(self, path):
+    result = []
+    nodes = [self.root]
+    for component in path:
+      next_nodes = []
+      for node in nodes:
+        result += node.rules
+        child = node.literals.get(component)
+        if child is not None:
+          next_nodes.append(child)
+        for (pattern, child) in node.wildcards:
+          if pattern.match(component):
+            next_nodes.append(child)
+      nodes = next_nodes
+      if not nodes:
+        return result
+    for node in nodes:
+      result += node.rules
+    return result
+
+
+class RuleIndexNode(object):
+
+  def __init__(self):
+    self.rules = []
+    self.literals = {}
+    self.wildcards = []
+
+  def GetChild(self, pattern):
+    if pattern.IsLiteral():
+      child = self.literals.get(pattern.pattern)
+      if child is None:
+        child = self.literals[pattern.pattern] = RuleIndexNode()
+      return child
+    for (existing, child) in self.wildcards:
+      if existing.pattern == pattern.pattern:
+        return child
+    child = RuleIndexNode()
+    self.wildcards.append((pattern, child))
+    return child
+
+
 HEADER_PATTERN = re.compile(r'\[([^]]+)\]')
 RULE_PATTERN = re.compile(r'\s*([^: ]*)\s*:(.*)')
 DEF_PATTERN = re.compile(r'^def\s*(\w+)\s*=(.*)$')
@@ -1315,6 +1770,12 @@ def BuildOptions():
       default=False, action="store_true")
   result.add_option("--worker", help="Run parallel tests inside a worker context",
       default=False, action="store_true")
+  result.add_option("--reuse-vm",
+      help="Run parallel tests without flags in long-lived node processes, each test in a fresh worker context",
+      default=False, action="store_true", dest="reuse_vm")
+  result.add_option("--reuse-vm-recycle",
+      help="Number of tests after which a long-lived node process is replaced (default: 50)",
+      default=50, type="int", dest="reuse_vm_recycle")
   result.add_option("--check-deopts", help="Check tests for permanent deoptimizations",
       default=False, action="store_true")
   result.add_option("--cat", help="Print the source of the tests",
@@ -1338,6 +1799,9 @@ def BuildOptions():
   result.add_option("--no-suppress-dialogs", help="Display Windows dialogs for crashing tests",
         dest="suppress_dialogs", action="store_false")
   result.add_option("--shell", help="Path to node executable", default=None)
+  result.add_option("--output-buffer-size",
+      help="Bytes of test output kept in memory before spilling to a temporary file",
+      default=DEFAULT_OUTPUT_BUFFER_SIZE, type="int", dest="output_buffer_size")
   result.add_option("--store-unexpected-output",
       help="Store the temporary JS files from tests that fails",
       dest="store_unexpected_output", default=True, action="store_true")
@@ -1347,6 +1811,12 @@ def BuildOptions():
   result.add_option("-r", "--run",
       help="Divide the tests in m groups (interleaved) and run tests from group n (--run=n,m with n < m)",
       default="")
+  result.add_option("--balance-shards",
+      help="With --run, divide the tests into groups of equal predicted duration according to the timing database instead of interleaving them. All groups must use the same database",
+      default=False, action="store_true", dest="balance_shards")
+  result.add_option("--timing-database",
+      help="File in which test durations are recorded and from which they are predicted to schedule long tests first (default: out/test-timings.json, empty to disable)",
+      default=None, dest="timing_database")
   result.add_option('--temp-dir',
       help='Optional path to change directory used for tests', default=False)
   result.add_option('--test-root',
@@ -1393,6 +1863,13 @@ def ProcessOptions(options):
     # tends to exaggerate the number of available cpus/cores.
     cores = os.environ.get('JOBS')
     options.j = int(cores) if cores is not None else multiprocessing.cpu_count()
+  if options.reuse_vm and (options.worker or options.check_deopts or
+                           options.valgrind):
+    print("--reuse-vm cannot be combined with --worker, --check-deopts or --valgrind")
+    return False
+  if options.reuse_vm_recycle < 1:
+    print("--reuse-vm-recycle must be a positive integer.")
+    return False
   if options.flaky_tests not in [RUN, SKIP, DONTCARE]:
     print("Unknown flaky-tests mode %s" % options.flaky_tests)
     return False
@@ -1408,12 +1885,19 @@ Total: %(total)i tests
 """
 
 
+LITERAL_BREAKING_CHARACTERS = re.compile(r'[*.?+^$|()\[\]{}\\]')
+
 class Pattern(object):
 
   def __init__(self, pattern):
     self.pattern = pattern
     self.compiled = None
 
+  def IsLiteral(self):
+    # Patterns are regular expressions with '*' as the wildcard, so only
+    # patterns without any special characters can be compared as strings.
+    return not LITERAL_BREAKING_CHARACTERS.search(self.pattern)
+
   def match(self, str):
     if not self.compiled:
       pattern = "^" + self.pattern.replace('*', '.*') + "$"
@@ -1464,12 +1948,15 @@ def FormatTime(d):
   return time.strftime("%M:%S.", time.gmtime(d)) + ("%03i" % millis)
 
 
-def FormatTimedelta(td):
+def TimedeltaToSeconds(td):
   if hasattr(td, 'total_seconds'):
-    d = td.total_seconds()
+    return td.total_seconds()
   else: # python2.6 compat
-    d =  td.seconds + (td.microseconds / 10.0**6)
-  return FormatTime(d)
+    return td.seconds + (td.microseconds / 10.0**6)
+
+
+def FormatTimedelta(td):
+  return FormatTime(TimedeltaToSeconds(td))
 
 
 def PrintCrashed(code):
@@ -1575,6 +2062,7 @@ def Main():
                     options.store_unexpected_output,
                     options.repeat,
                     options.abort_on_timeout)
+  context.output_buffer_size = options.output_buffer_size
 
   # Get status for tests
   sections = [ ]
@@ -1678,7 +2166,18 @@ def Main():
       'fail': len([t for t in cases_to_run if t.outcomes == set([FAIL])])
     })
 
-  if options.run is not None:
+  timing_database = None
+  if options.timing_database is None:
+    options.timing_database = join(workspace, 'out', 'test-timings.json')
+  if options.timing_database:
+    timing_database = TimingDatabase(options.timing_database)
+    for case in cases_to_run:
+      case.expected_duration = timing_database.Get(case)
+
+  if options.run is not None and options.balance_shards:
+    cases_to_run = SplitIntoBalancedShards(cases_to_run,
+                                           options.run[1])[options.run[0]]
+  elif options.run is not None:
     # Must ensure the list of tests is sorted before selecting, to avoid
     # silent errors if this file is changed to list the tests in a way that
     # can be different in different machines
@@ -1691,6 +2190,8 @@ def Main():
     print("No tests to run.")
     return 1
   else:
+    if options.reuse_vm:
+      context.vm_pool = VmServerPool(context, options.reuse_vm_recycle)
     try:
       start = time.time()
       if RunTestCases(cases_to_run, options.progress, options.j, options.flaky_tests):
@@ -1701,6 +2202,16 @@ def Main():
     except KeyboardInterrupt:
       print("Interrupted")
       return 1
+    finally:
+      if context.vm_pool is not None:
+        context.vm_pool.Shutdown()
+
+    if timing_database is not None:
+      timing_database.Update(cases_to_run)
+      try:
+        timing_database.Save()
+      except (IOError, OSError) as e:
+        print("Could not write the timing database: %s" % e)
 
   if options.time:
     # Write the times to stderr to make it easy to separate from the